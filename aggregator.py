@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Tổng hợp metrics theo kiểu streaming (cập nhật sau mỗi query, không cần duyệt lại results)
+
+- Trung bình / min / max: thuật toán Welford (ổn định số học)
+- Median, phân vị: thuật toán P² (Jain & Chlamtac, 1985), 5 marker cho mỗi phân vị,
+  bộ nhớ O(1) dù có bao nhiêu giá trị
+- Đếm theo category / difficulty, theo mức Precision@5, theo các threshold distance
+- Histogram distance cố định (DISTANCE_BINS ô trên [0, DISTANCE_MAX]) → tỷ lệ kết quả dưới
+  một giá trị bất kỳ, ví dụ dưới P25 / P50 / P75 vừa ước lượng
+- Top 5 queries tốt nhất / xấu nhất (giữ đúng thứ tự như sort ổn định của bản cũ)
+
+Trạng thái được lưu cùng progress_final_data.json (to_dict / from_dict) nên khi dừng giữa
+chừng hoặc chạy tiếp, bản tóm tắt luôn sẵn sàng trong O(1).
+"""
+import math
+from typing import List, Dict, Any, Optional
+
+TEST_THRESHOLDS = [0.5, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9]  # Các threshold distance để phân tích
+TOP_N = 5  # Số queries tốt nhất / xấu nhất được giữ lại
+DISTANCE_MAX = 4.0  # Squared L2 giữa 2 vector chuẩn hóa nằm trong [0, 4]
+DISTANCE_BINS = 400  # Độ rộng mỗi ô 0.01
+
+
+class RunningStat:
+    """Số lượng, trung bình, phương sai (Welford), min, max."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2,
+                "min": self.min if self.count else None, "max": self.max if self.count else None}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "RunningStat":
+        stat = cls()
+        stat.count, stat.mean, stat.m2 = d["count"], d["mean"], d["m2"]
+        if stat.count:
+            stat.min, stat.max = d["min"], d["max"]
+        return stat
+
+
+class P2Quantile:
+    """
+    Ước lượng phân vị p bằng thuật toán P² (5 marker, O(1) bộ nhớ).
+    Với <= 5 giá trị trả về giá trị chính xác (sorted[int(n * p)] như bản cũ).
+    """
+
+    def __init__(self, p: float):
+        self.p = p
+        self.n = 0
+        self.heights: List[float] = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        self.n += 1
+        q = self.heights
+        if self.n <= 5:
+            q.append(x)
+            q.sort()
+            return
+
+        # Tìm ô chứa x, cập nhật marker đầu/cuối
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            self.positions[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Điều chỉnh 3 marker giữa nếu lệch khỏi vị trí mong muốn
+        n = self.positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self) -> float:
+        if self.n == 0:
+            return 0.0
+        if self.n <= 5:
+            return self.heights[min(int(self.n * self.p), self.n - 1)]
+        return self.heights[2]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"p": self.p, "n": self.n, "heights": self.heights,
+                "positions": self.positions, "desired": self.desired}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "P2Quantile":
+        est = cls(d["p"])
+        est.n, est.heights, est.positions, est.desired = d["n"], d["heights"], d["positions"], d["desired"]
+        return est
+
+
+def _new_group() -> Dict[str, Any]:
+    return {"count": 0, "total_precision": 0.0, "total_ap": 0.0,
+            "min_precision": None, "max_precision": None, "perfect": 0}
+
+
+class MetricAggregator:
+    """
+    Tổng hợp metrics của các result entry (như trong progress_final_data.json).
+
+    Args:
+        distance_threshold: Threshold distance đang dùng (để tách relevant / non-relevant)
+        thresholds: Các threshold distance cần đếm số kết quả nằm dưới
+    """
+
+    def __init__(self, distance_threshold: float = 0.8, thresholds: Optional[List[float]] = None):
+        self.distance_threshold = distance_threshold
+        self.thresholds = sorted(set((thresholds or TEST_THRESHOLDS) + [distance_threshold]))
+        self.precision = RunningStat()
+        self.ap = RunningStat()
+        self.precision_median = P2Quantile(0.5)
+        self.ap_median = P2Quantile(0.5)
+        self.buckets = {"perfect": 0, "high": 0, "medium": 0, "low": 0}
+        self.total_relevant = 0
+        self.distance = RunningStat()
+        self.distance_quantiles = {str(p): P2Quantile(p) for p in (0.25, 0.5, 0.75)}
+        self.below = {str(t): [0, 0.0] for t in self.thresholds}  # threshold → [số kết quả, tổng distance]
+        self.distance_hist = [0] * DISTANCE_BINS
+        self.categories: Dict[str, Dict[str, Any]] = {}
+        self.difficulties: Dict[str, Dict[str, Any]] = {}
+        self.best: List[list] = []   # [-precision, -ap, seq, tóm tắt query], tăng dần
+        self.worst: List[list] = []  # Cùng key, giữ TOP_N phần tử lớn nhất
+
+    @property
+    def total(self) -> int:
+        return self.precision.count
+
+    def add(self, entry: Dict[str, Any]):
+        """Cập nhật với một result entry, O(1)."""
+        precision = entry.get("precision_at_5", 0.0)
+        ap = entry.get("ap_at_5", 0.0)
+        seq = self.total
+        self.precision.add(precision)
+        self.ap.add(ap)
+        self.precision_median.add(precision)
+        self.ap_median.add(ap)
+        if precision == 1.0:
+            self.buckets["perfect"] += 1
+        elif precision >= 0.8:
+            self.buckets["high"] += 1
+        elif precision >= 0.5:
+            self.buckets["medium"] += 1
+        else:
+            self.buckets["low"] += 1
+        self.total_relevant += entry.get("num_relevant", 0)
+
+        for sr in entry.get("search_results", []):
+            dist = sr.get("distance")
+            if dist is None:
+                continue
+            self.distance.add(dist)
+            for est in self.distance_quantiles.values():
+                est.add(dist)
+            self.distance_hist[min(max(int(dist / DISTANCE_MAX * DISTANCE_BINS), 0), DISTANCE_BINS - 1)] += 1
+            for t in self.thresholds:
+                if dist < t:
+                    slot = self.below[str(t)]
+                    slot[0] += 1
+                    slot[1] += dist
+
+        for groups, key in ((self.categories, entry.get("category")), (self.difficulties, entry.get("difficulty"))):
+            group = groups.setdefault(str(key), _new_group())
+            group["count"] += 1
+            group["total_precision"] += precision
+            group["total_ap"] += ap
+            group["min_precision"] = precision if group["min_precision"] is None else min(group["min_precision"], precision)
+            group["max_precision"] = precision if group["max_precision"] is None else max(group["max_precision"], precision)
+            group["perfect"] += precision == 1.0
+
+        summary = {k: entry.get(k) for k in ("query_id", "category", "difficulty", "num_relevant", "query_text")}
+        item = [-precision, -ap, seq, summary]
+        self.best = sorted(self.best + [item], key=lambda x: x[:3])[:TOP_N]
+        self.worst = sorted(self.worst + [item], key=lambda x: x[:3])[-TOP_N:]
+
+    def below_threshold(self, threshold: float) -> Dict[str, Any]:
+        """Số kết quả và distance trung bình ở hai phía của threshold (phải nằm trong self.thresholds)."""
+        count, total = self.below[str(threshold)]
+        rest = self.distance.count - count
+        rest_sum = self.distance.mean * self.distance.count - total
+        return {"relevant": count, "non_relevant": rest,
+                "relevant_mean": total / count if count else None,
+                "non_relevant_mean": rest_sum / rest if rest else None}
+
+    def fraction_below(self, value: float) -> float:
+        """Tỷ lệ distance < value, ước lượng từ histogram (nội suy tuyến tính trong ô chứa value)."""
+        if not self.distance.count:
+            return 0.0
+        pos = min(max(value / DISTANCE_MAX * DISTANCE_BINS, 0.0), float(DISTANCE_BINS))
+        full = int(pos)
+        count = sum(self.distance_hist[:full])
+        if full < DISTANCE_BINS:
+            count += self.distance_hist[full] * (pos - full)
+        return count / self.distance.count
+
+    def summary(self) -> Dict[str, Any]:
+        """Tóm tắt ngắn (dùng để in sau mỗi query)."""
+        return {"queries": self.total, "precision_at_5": self.precision.mean, "map_at_5": self.ap.mean,
+                "perfect": self.buckets["perfect"]}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "distance_threshold": self.distance_threshold,
+            "thresholds": self.thresholds,
+            "precision": self.precision.to_dict(),
+            "ap": self.ap.to_dict(),
+            "precision_median": self.precision_median.to_dict(),
+            "ap_median": self.ap_median.to_dict(),
+            "buckets": self.buckets,
+            "total_relevant": self.total_relevant,
+            "distance": self.distance.to_dict(),
+            "distance_quantiles": {k: v.to_dict() for k, v in self.distance_quantiles.items()},
+            "below": self.below,
+            "distance_hist": self.distance_hist,
+            "categories": self.categories,
+            "difficulties": self.difficulties,
+            "best": self.best,
+            "worst": self.worst,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "MetricAggregator":
+        agg = cls(d["distance_threshold"], d["thresholds"])
+        agg.precision = RunningStat.from_dict(d["precision"])
+        agg.ap = RunningStat.from_dict(d["ap"])
+        agg.precision_median = P2Quantile.from_dict(d["precision_median"])
+        agg.ap_median = P2Quantile.from_dict(d["ap_median"])
+        agg.buckets = d["buckets"]
+        agg.total_relevant = d["total_relevant"]
+        agg.distance = RunningStat.from_dict(d["distance"])
+        agg.distance_quantiles = {k: P2Quantile.from_dict(v) for k, v in d["distance_quantiles"].items()}
+        agg.below = d["below"]
+        agg.distance_hist = d["distance_hist"]
+        agg.categories = d["categories"]
+        agg.difficulties = d["difficulties"]
+        agg.best = d["best"]
+        agg.worst = d["worst"]
+        return agg
+
+    @classmethod
+    def restore(cls, state: Optional[Dict[str, Any]], results: List[Dict[str, Any]],
+                distance_threshold: float) -> "MetricAggregator":
+        """
+        Khôi phục từ trạng thái đã lưu; nếu chưa có (progress cũ, kể cả trạng thái chưa có
+        distance_hist), không khớp số queries hoặc đã đổi threshold thì dựng lại một lần từ results.
+        """
+        if state and state.get("distance_threshold") == distance_threshold \
+                and state.get("precision", {}).get("count") == len(results) \
+                and len(state.get("distance_hist") or []) == DISTANCE_BINS:
+            return cls.from_dict(state)
+        agg = cls(distance_threshold)
+        for entry in results:
+            agg.add(entry)
+        return agg
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Tự chọn kích thước batch encode theo throughput và bộ nhớ
+
+- tune_token_budget(): lúc khởi động, thử vài token budget (xem batching.py) trên một mẫu
+  text, mỗi lần thử trong một process riêng, đo throughput và peak RSS, chọn budget NHANH
+  NHẤT mà vẫn nằm trong memory budget
+- AdaptiveTokenBudget: khi đang chạy, nếu RSS gần chạm memory budget VÀ còn đang tăng, hoặc
+  gặp MemoryError, thì giảm một nửa token budget (chạy lại batch nếu MemoryError); sau
+  GROW_AFTER_WINDOWS cửa sổ ổn định thì tăng gấp đôi trở lại (không vượt mức an toàn đã biết)
+
+Memory budget mặc định = 50% RAM còn trống lúc khởi động.
+"""
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+from batching import encode_scheduled, TOKEN_BUDGET
+
+CANDIDATE_TOKEN_BUDGETS = [2048, 4096, 8192, 16384, 32768]
+MIN_TOKEN_BUDGET = 512
+PRESSURE_RATIO = 0.9  # RSS >= 90% memory budget → coi là áp lực bộ nhớ
+GROW_AFTER_WINDOWS = 5  # Số cửa sổ liên tiếp không thiếu bộ nhớ trước khi tăng lại token budget
+
+
+def current_rss_mb() -> float:
+    """RSS hiện tại của process (MB)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        # Không có cách đo RSS hiện tại → dùng peak RSS (ru_maxrss: KB trên Linux, byte trên macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def available_memory_mb() -> Optional[float]:
+    """RAM còn trống của máy (MB), None nếu không xác định được."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().available / 1024 / 1024
+    except ImportError:
+        return None
+
+
+def default_memory_budget_mb() -> Optional[float]:
+    """50% RAM còn trống cộng với RSS hiện tại của process."""
+    available = available_memory_mb()
+    return current_rss_mb() + available * 0.5 if available else None
+
+
+class _PeakSampler:
+    """
+    Thread lấy mẫu RSS mỗi `interval` giây để tìm peak trong một đoạn code.
+    `growth` = peak - RSS lúc bắt đầu: phần bộ nhớ đoạn code này cần thêm.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.baseline = current_rss_mb()
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+        return False
+
+    @property
+    def growth(self) -> float:
+        return self.peak - self.baseline
+
+
+def _probe_worker(backend: str, model_name: str, texts: List[str], token_budget: int, queue):
+    """Đo một token budget trong process mới (spawn): không có bộ nhớ do lần thử trước để lại."""
+    try:
+        from encoders import get_encoder
+        encoder = get_encoder(backend, model_name)
+        encode_scheduled(encoder, texts[:16], token_budget)  # Làm nóng
+        gc.collect()
+        with _PeakSampler() as sampler:
+            start = time.perf_counter()
+            encode_scheduled(encoder, texts, token_budget)
+            elapsed = time.perf_counter() - start
+        queue.put({"texts_per_sec": len(texts) / elapsed if elapsed > 0 else 0.0, "growth_mb": sampler.growth})
+    except MemoryError:
+        queue.put({"error": "MemoryError"})
+    except Exception as e:  # Luôn trả kết quả để process cha không chờ mãi
+        queue.put({"error": f"{type(e).__name__}: {e}"[:200]})
+
+
+def _wait_result(proc, queue) -> Dict[str, Any]:
+    """Kết quả của process thử; không chờ mãi nếu process chết trước khi kịp gửi (ví dụ bị OOM kill)."""
+    import queue as queue_module
+    while True:
+        try:
+            result = queue.get(timeout=1.0)
+            break
+        except queue_module.Empty:
+            if not proc.is_alive():
+                result = {"error": f"process thử kết thúc với mã {proc.exitcode}"}
+                break
+    proc.join()
+    return result
+
+
+def tune_token_budget(encoder, sample_texts: List[str], memory_budget_mb: Optional[float] = None,
+                      candidates: List[int] = CANDIDATE_TOKEN_BUDGETS) -> Dict[str, Any]:
+    """
+    Thử từng token budget trên sample_texts, chọn budget có throughput cao nhất
+    mà peak RSS không vượt memory_budget_mb.
+
+    Mỗi lần thử chạy trong một process spawn riêng (tải lại model theo encoder.backend /
+    encoder.model_name, giống benchmark của encoders.py): trong cùng process, allocator giữ và
+    dùng lại bộ nhớ của lần thử trước nên phần tăng của budget sau bị tính thiếu.
+    peak_rss_mb = RSS hiện tại của process gọi + phần tăng thêm đo được trong process riêng.
+
+    Returns:
+        {"token_budget": ..., "memory_budget_mb": ..., "probes": [...]}
+    """
+    import multiprocessing as mp
+
+    if memory_budget_mb is None:
+        memory_budget_mb = default_memory_budget_mb()
+    ctx = mp.get_context("spawn")
+    start_rss = current_rss_mb()
+    probes = []
+    for budget in sorted(candidates):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_probe_worker,
+                           args=(encoder.backend, encoder.model_name, sample_texts, budget, queue))
+        proc.start()
+        result = _wait_result(proc, queue)
+        if "error" in result:
+            probes.append({"token_budget": budget, "error": result["error"]})
+            break
+        peak = start_rss + result["growth_mb"]
+        probe = {
+            "token_budget": budget,
+            "texts_per_sec": result["texts_per_sec"],
+            "peak_rss_mb": peak,
+            "fits": memory_budget_mb is None or peak <= memory_budget_mb,
+        }
+        probes.append(probe)
+        if not probe["fits"]:
+            break  # Budget lớn hơn chỉ tốn thêm bộ nhớ
+
+    fitting = [p for p in probes if p.get("fits")]
+    best = max(fitting, key=lambda p: p["texts_per_sec"]) if fitting else None
+    return {
+        "token_budget": best["token_budget"] if best else MIN_TOKEN_BUDGET,
+        "memory_budget_mb": memory_budget_mb,
+        "cpu_count": os.cpu_count(),
+        "probes": probes,
+    }
+
+
+class AdaptiveTokenBudget:
+    """
+    Token budget thay đổi khi chạy.
+
+    - Giảm một nửa khi gặp MemoryError (và chạy lại batch đó), hoặc khi RSS >= PRESSURE_RATIO x
+      memory budget VÀ cao hơn lần giảm trước: RSS hầu như không giảm sau khi allocator đã
+      cấp phát, nên chỉ "RSS cao" thì sẽ giảm mãi tới MIN_TOKEN_BUDGET dù không còn áp lực
+    - Giảm vì áp lực RSS → budget mới là mức tối đa an toàn (ceiling)
+    - Sau GROW_AFTER_WINDOWS cửa sổ liên tiếp không phải giảm → tăng gấp đôi, không vượt ceiling
+      (ceiling ban đầu = token budget ban đầu) → hồi phục sau MemoryError tạm thời
+    """
+
+    def __init__(self, token_budget: int = TOKEN_BUDGET, memory_budget_mb: Optional[float] = None,
+                 min_token_budget: int = MIN_TOKEN_BUDGET, grow_after: int = GROW_AFTER_WINDOWS):
+        self.token_budget = token_budget
+        self.ceiling = token_budget
+        self.memory_budget_mb = memory_budget_mb
+        self.min_token_budget = min_token_budget
+        self.grow_after = grow_after
+        self.backoffs = 0
+        self.growths = 0
+        self._clean_windows = 0
+        self._pressure_rss = 0.0  # RSS lúc giảm vì áp lực lần gần nhất
+
+    def _back_off(self, reason: str) -> bool:
+        self._clean_windows = 0
+        if self.token_budget <= self.min_token_budget:
+            return False
+        self.token_budget = max(self.min_token_budget, self.token_budget // 2)
+        self.backoffs += 1
+        print(f"\n⚠ {reason} → giam token budget con {self.token_budget}")
+        return True
+
+    def _check_pressure(self):
+        if not self.memory_budget_mb:
+            return
+        rss = current_rss_mb()
+        if rss >= self.memory_budget_mb * PRESSURE_RATIO and rss > self._pressure_rss:
+            self._pressure_rss = rss
+            if self._back_off(f"RSS {rss:.0f} MB gan cham memory budget {self.memory_budget_mb:.0f} MB"):
+                self.ceiling = self.token_budget
+
+    def _maybe_grow(self):
+        self._clean_windows += 1
+        if self._clean_windows >= self.grow_after and self.token_budget < self.ceiling:
+            self.token_budget = min(self.ceiling, self.token_budget * 2)
+            self.growths += 1
+            self._clean_windows = 0
+
+    def encode(self, encoder, texts: List[str]):
+        """encode_scheduled với token budget hiện tại, tự giảm budget và thử lại khi thiếu bộ nhớ."""
+        self._check_pressure()
+        backoffs = self.backoffs
+        while True:
+            try:
+                embeddings = encode_scheduled(encoder, texts, self.token_budget)
+                break
+            except MemoryError:
+                if not self._back_off("MemoryError"):
+                    raise
+        if self.backoffs == backoffs:
+            self._maybe_grow()
+        return embeddings
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Lập lịch batch theo độ dài token cho bước encode
+
+Vấn đề: chia batch cố định theo thứ tự file → một hồ sơ có trường `ability` rất dài
+làm cả batch bị pad tới độ dài lớn nhất, phần lớn phép tính là trên token pad.
+
+Cách làm:
+1. Tokenize trước để biết độ dài (token) của từng text
+2. Sắp xếp theo độ dài, gom thành batch sao cho (số text x độ dài lớn nhất) <= token budget
+3. Encode từng batch rồi đặt embedding về ĐÚNG vị trí ban đầu (thứ tự không đổi)
+
+Dòng lệnh (báo cáo padding ratio và speedup):
+    python batching.py --data Moredata.csv
+"""
+import argparse
+import time
+from pathlib import Path
+from typing import List, Dict
+
+import numpy as np
+
+TOKEN_BUDGET = 8192     # Tổng số token (kể cả pad) tối đa trong một batch, ví dụ 32 x 256
+MAX_BATCH_ROWS = 256    # Giới hạn số text trong một batch (khi text rất ngắn)
+
+
+def plan_batches(lengths: List[int], token_budget: int = TOKEN_BUDGET,
+                 max_batch_rows: int = MAX_BATCH_ROWS) -> List[List[int]]:
+    """
+    Gom chỉ số text thành các batch theo độ dài tăng dần, mỗi batch không vượt token budget.
+    Text dài hơn budget vẫn được xếp vào một batch riêng.
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_max = 0
+    for idx in order:
+        new_max = max(current_max, lengths[idx])
+        if current and (new_max * (len(current) + 1) > token_budget or len(current) >= max_batch_rows):
+            batches.append(current)
+            current, new_max = [], lengths[idx]
+        current.append(idx)
+        current_max = new_max
+    if current:
+        batches.append(current)
+    return batches
+
+
+def padding_stats(lengths: List[int], batches: List[List[int]]) -> Dict[str, float]:
+    """Số token thật, số token sau khi pad và tỷ lệ pad (phần tính toán bị lãng phí)."""
+    real = sum(lengths[i] for batch in batches for i in batch)
+    padded = sum(max(lengths[i] for i in batch) * len(batch) for batch in batches if batch)
+    return {
+        "batches": len(batches),
+        "real_tokens": real,
+        "padded_tokens": padded,
+        "padding_ratio": 1 - real / padded if padded else 0.0,
+    }
+
+
+def encode_scheduled(encoder, texts: List[str], token_budget: int = TOKEN_BUDGET,
+                     max_batch_rows: int = MAX_BATCH_ROWS) -> np.ndarray:
+    """
+    Encode texts theo các batch đã lập lịch, trả về embedding theo thứ tự ban đầu của texts.
+
+    encoder: đối tượng có encode(texts, batch_size) và token_lengths(texts) (xem encoders.py)
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    lengths = encoder.token_lengths(texts)
+    out = None
+    for batch in plan_batches(lengths, token_budget, max_batch_rows):
+        embeddings = encoder.encode([texts[i] for i in batch], batch_size=len(batch))
+        if out is None:
+            out = np.empty((len(texts), embeddings.shape[1]), dtype=embeddings.dtype)
+        out[batch] = embeddings  # Trả về đúng vị trí ban đầu
+    return out
+
+
+def fixed_batches(lengths: List[int], chunk_size: int = 100, sub_batch: int = 32,
+                  sort_within_chunk: bool = True) -> List[List[int]]:
+    """
+    Mô phỏng cách populate_chromadb.py chia batch cũ: chunk cố định 100 dòng theo thứ tự file,
+    mỗi chunk được encode với batch_size=32 (SentenceTransformer tự sắp xếp trong chunk).
+    """
+    batches = []
+    for start in range(0, len(lengths), chunk_size):
+        chunk = list(range(start, min(start + chunk_size, len(lengths))))
+        if sort_within_chunk:
+            chunk.sort(key=lengths.__getitem__, reverse=True)
+        batches.extend(chunk[i:i+sub_batch] for i in range(0, len(chunk), sub_batch))
+    return batches
+
+
+def main():
+    from encoders import get_encoder, load_texts, BACKENDS
+
+    base_dir = Path(__file__).resolve().parent
+    parser = argparse.ArgumentParser(description="So sánh batch cố định và batch theo token budget")
+    parser.add_argument("--data", type=Path, default=base_dir / "Moredata.csv")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--backend", default="torch", choices=BACKENDS)
+    parser.add_argument("--token-budget", type=int, default=TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    encoder = get_encoder(args.backend)
+    texts = load_texts(args.data, args.limit)
+    lengths = encoder.token_lengths(texts)
+    print(f"{len(texts)} texts | độ dài token: min {min(lengths)}, max {max(lengths)}, "
+          f"trung bình {sum(lengths) / len(lengths):.1f}")
+
+    fixed = padding_stats(lengths, fixed_batches(lengths, sort_within_chunk=args.backend == "torch"))
+    scheduled = padding_stats(lengths, plan_batches(lengths, args.token_budget))
+
+    encoder.encode(texts[:32])  # Làm nóng
+    start = time.perf_counter()
+    baseline = [encoder.encode(texts[i:i+100], batch_size=32) for i in range(0, len(texts), 100)]
+    fixed_s = time.perf_counter() - start
+    start = time.perf_counter()
+    result = encode_scheduled(encoder, texts, args.token_budget)
+    scheduled_s = time.perf_counter() - start
+
+    max_diff = float(np.abs(np.vstack(baseline) - result).max())
+    print(f"\n{'':<14}{'Batches':>9}{'Padded tok':>12}{'Pad ratio':>11}{'Seconds':>10}")
+    print(f"{'Cố định 100':<14}{fixed['batches']:>9}{fixed['padded_tokens']:>12}"
+          f"{fixed['padding_ratio']:>11.1%}{fixed_s:>10.2f}")
+    print(f"{'Token budget':<14}{scheduled['batches']:>9}{scheduled['padded_tokens']:>12}"
+          f"{scheduled['padding_ratio']:>11.1%}{scheduled_s:>10.2f}")
+    print(f"\nSpeedup: {fixed_s / scheduled_s:.2f}x | chênh lệch embedding lớn nhất: {max_diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: collection đơn so với N shard (scatter-gather)
+
+Với mỗi cấu hình số shard:
+- Build index trong thư mục tạm từ cùng một bộ embeddings (chỉ encode 1 lần)
+- Đo thời gian build, độ trễ query p50/p99 với các query trong random_queries.csv
+- Đo overlap@5 so với collection đơn (kết quả gộp có giống baseline không)
+
+Ví dụ:
+    python benchmark_shards.py --data Moredata.csv --shards 1 2 4 8
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import chromadb
+
+from final_data import load_queries, model, BASE_DIR
+from metrics import percentile
+from populate_chromadb import load_rows, row_to_record, BATCH_SIZE
+from sharding import ShardedCollection
+
+REPORT_FILE = BASE_DIR / "shard_benchmark.json"
+
+
+def build(collection, ids, embeddings, metadatas, batch_size: int = BATCH_SIZE) -> float:
+    """Thêm toàn bộ dữ liệu vào collection, trả về thời gian (giây)."""
+    start = time.perf_counter()
+    for i in range(0, len(ids), batch_size):
+        collection.add(ids=ids[i:i+batch_size], embeddings=embeddings[i:i+batch_size],
+                       metadatas=metadatas[i:i+batch_size])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sharded collections")
+    parser.add_argument("--data", type=Path, default=BASE_DIR / "Moredata.csv")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--separate-dirs", action="store_true", help="Mỗi shard một thư mục store")
+    args = parser.parse_args()
+
+    records = [r for r in (row_to_record(row) for row in load_rows(args.data)) if r is not None]
+    # Bỏ person_id trùng (ChromaDB không cho add id trùng)
+    records = list({r[0]: r for r in records}.values())
+    ids = [r[0] for r in records]
+    metadatas = [r[2] for r in records]
+    print(f"Encode {len(records)} hồ sơ từ {args.data.name}...")
+    embeddings = model.encode([r[1] for r in records], convert_to_tensor=False,
+                              show_progress_bar=False).tolist()
+
+    queries = [q["query_text"] for q in load_queries() if q["query_text"].strip()]
+    q_embs = model.encode(queries, convert_to_tensor=False, show_progress_bar=False).tolist()
+
+    report = {"data": args.data.name, "num_docs": len(ids), "num_queries": len(queries), "runs": []}
+    baseline_ids = None
+    for num_shards in sorted(set(args.shards)):
+        with tempfile.TemporaryDirectory() as tmp:
+            client = chromadb.PersistentClient(path=tmp)
+            if num_shards == 1:
+                collection = client.get_or_create_collection(name="bench")
+            else:
+                collection = ShardedCollection.open(Path(tmp), "bench", num_shards,
+                                                    separate_dirs=args.separate_dirs, client=client)
+            build_s = build(collection, ids, embeddings, metadatas)
+
+            latencies, result_ids = [], []
+            for emb in q_embs:
+                start = time.perf_counter()
+                res = collection.query(query_embeddings=[emb], n_results=args.k,
+                                       include=["metadatas", "distances"])
+                latencies.append((time.perf_counter() - start) * 1000)
+                result_ids.append(res["ids"][0])
+            if num_shards > 1:
+                collection.close()
+
+        if baseline_ids is None:
+            baseline_ids = result_ids
+        overlap = sum(len(set(a) & set(b)) for a, b in zip(result_ids, baseline_ids))
+        run = {
+            "num_shards": num_shards,
+            "build_s": build_s,
+            "latency_p50_ms": percentile(latencies, 50),
+            "latency_p99_ms": percentile(latencies, 99),
+            "overlap_at_k_vs_first": overlap / (len(queries) * args.k) if queries else 0.0,
+        }
+        report["runs"].append(run)
+        print(f"shards={num_shards}: build {build_s:.2f}s | p50 {run['latency_p50_ms']:.2f} ms | "
+              f"p99 {run['latency_p99_ms']:.2f} ms | overlap@{args.k} {run['overlap_at_k_vs_first']:.3f}")
+
+    with REPORT_FILE.open("w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu báo cáo vào: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
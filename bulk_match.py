@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Ghép hàng loạt mô tả công việc (job) với toàn bộ hồ sơ
+
+Thay vì gọi search_top5 cho từng job, chế độ này:
+1. Đọc embeddings + metadata của hồ sơ từ qa_collection một lần (không encode lại hồ sơ)
+2. Đọc file job theo từng lô JOB_BATCH dòng, encode cả lô bằng batch theo token budget
+   (batching.encode_scheduled)
+3. Tính khoảng cách job x hồ sơ bằng nhân ma trận theo khối, giữ top-K cho mỗi job
+   (similar_candidates.knn_blocked → bộ nhớ giới hạn, chạy song song trên mọi CPU).
+   Distance là L2 bình phương giống ChromaDB (= 2 - 2·cosine với embedding đã chuẩn hóa)
+4. Chấm lại từng cặp bằng calculate_relevance_score (distance + keyword)
+5. Ghi kết quả dần ra file Parquet (mỗi lô một row group) → không giữ toàn bộ kết quả trong RAM.
+   Không có pyarrow thì ghi CSV.
+
+File job: CSV có cột id và text (mặc định query_id / query_text như random_queries.csv).
+
+Ví dụ:
+    python bulk_match.py jobs.csv --id-col job_id --text-col description --k 20
+    python bulk_match.py random_queries.csv --output bulk_matches.parquet
+"""
+import argparse
+import csv
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Iterator, Tuple
+
+import numpy as np
+
+from batching import encode_scheduled
+from metrics import calculate_relevance_score
+from similar_candidates import knn_blocked
+from export_columnar import HAS_PYARROW
+
+if HAS_PYARROW:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+BASE_DIR = Path(__file__).resolve().parent
+STORE_DIR = BASE_DIR / "chromadb_store"
+COLLECTION_NAME = "qa_collection"
+NUM_SHARDS = 1  # Giống populate_chromadb.py / final_data.py
+ENCODER_BACKEND = "torch"
+DEFAULT_K = 20
+JOB_BATCH = 2048  # Số job được encode và ghép cùng lúc
+RESULT_FIELDS = ["job_id", "rank", "person_id", "distance", "relevance_score", "title"]
+
+
+def load_corpus(alias: str = COLLECTION_NAME, num_shards: int = NUM_SHARDS) -> Tuple[List[str], np.ndarray, List[Dict[str, Any]]]:
+    """(ids, embeddings, metadatas) của phiên bản đang phục vụ, đọc theo trang."""
+    import chromadb
+    from collection_alias import resolve
+    from populate_chromadb import open_collection
+    from maintenance import iter_pages
+
+    client = chromadb.PersistentClient(path=str(STORE_DIR))
+    collection = open_collection(client, resolve(STORE_DIR, alias), num_shards)
+    ids, chunks, metadatas = [], [], []
+    for page in iter_pages(collection):
+        ids.extend(page["ids"])
+        chunks.append(np.asarray(page["embeddings"], dtype=np.float32))
+        metadatas.extend(page["metadatas"])
+    return ids, np.vstack(chunks), metadatas
+
+
+def iter_jobs(path: Path, id_col: str, text_col: str, batch_size: int = JOB_BATCH) -> Iterator[List[Tuple[str, str]]]:
+    """Đọc file job theo từng lô (id, text), bỏ dòng không có text."""
+    batch = []
+    with path.open("r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            text = (row.get(text_col) or "").strip()
+            if text:
+                batch.append((row.get(id_col, ""), text))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+class ResultWriter:
+    """Ghi kết quả dần theo lô: Parquet (một row group mỗi lô) hoặc CSV nếu không có pyarrow."""
+
+    def __init__(self, path: Path):
+        self.path = path if HAS_PYARROW else path.with_suffix(".csv")
+        self.rows = 0
+        if HAS_PYARROW:
+            self._schema = pa.schema([
+                ("job_id", pa.string()), ("rank", pa.int16()), ("person_id", pa.string()),
+                ("distance", pa.float32()), ("relevance_score", pa.float32()), ("title", pa.string()),
+            ])
+            self._writer = pq.ParquetWriter(str(self.path), self._schema, compression="zstd")
+        else:
+            self._file = self.path.open("w", encoding="utf-8", newline="")
+            self._writer = csv.DictWriter(self._file, fieldnames=RESULT_FIELDS)
+            self._writer.writeheader()
+
+    def write(self, columns: Dict[str, list]):
+        if HAS_PYARROW:
+            self._writer.write_table(pa.table(columns, schema=self._schema))
+        else:
+            self._writer.writerows(dict(zip(RESULT_FIELDS, values)) for values in zip(*(columns[f] for f in RESULT_FIELDS)))
+        self.rows += len(columns["job_id"])
+
+    def close(self):
+        if HAS_PYARROW:
+            self._writer.close()
+        else:
+            self._file.close()
+
+
+def match_batch(jobs: List[Tuple[str, str]], encoder, ids: List[str], embeddings: np.ndarray,
+                metadatas: List[Dict[str, Any]], k: int) -> Tuple[Dict[str, list], Dict[str, float]]:
+    """Encode một lô job, lấy top-K hồ sơ và chấm relevance_score; trả về các cột kết quả + thời gian."""
+    start = time.perf_counter()
+    job_emb = encode_scheduled(encoder, [text for _, text in jobs]).astype(np.float32)
+    encoded = time.perf_counter()
+    neighbors, distances = knn_blocked(job_emb, embeddings, k)
+    matched = time.perf_counter()
+
+    columns = {f: [] for f in RESULT_FIELDS}
+    for (job_id, text), row_nb, row_dist in zip(jobs, neighbors, distances):
+        for rank, (j, dist) in enumerate(zip(row_nb, row_dist), 1):
+            if j < 0:
+                break
+            meta = metadatas[j] or {}
+            result = {"distance": float(dist), "title": meta.get("title", ""),
+                      "skills": meta.get("skills", ""), "abilities": meta.get("abilities", "")}
+            columns["job_id"].append(str(job_id))
+            columns["rank"].append(rank)
+            columns["person_id"].append(ids[j])
+            columns["distance"].append(float(dist))
+            columns["relevance_score"].append(calculate_relevance_score(text, result))
+            columns["title"].append(result["title"])
+    timings = {"encode_s": encoded - start, "match_s": matched - encoded, "score_s": time.perf_counter() - matched}
+    return columns, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ghép hàng loạt job với hồ sơ")
+    parser.add_argument("jobs", type=Path, help="File CSV chứa các job")
+    parser.add_argument("--id-col", default="query_id")
+    parser.add_argument("--text-col", default="query_text")
+    parser.add_argument("--k", type=int, default=DEFAULT_K)
+    parser.add_argument("--batch", type=int, default=JOB_BATCH)
+    parser.add_argument("--alias", default=COLLECTION_NAME)
+    parser.add_argument("--output", type=Path, default=BASE_DIR / "bulk_matches.parquet")
+    args = parser.parse_args()
+
+    from encoders import get_encoder
+
+    start = time.perf_counter()
+    ids, embeddings, metadatas = load_corpus(args.alias)
+    print(f"Đã đọc {len(ids)} hồ sơ ({embeddings.shape[1]} chiều) trong {time.perf_counter() - start:.1f}s")
+    encoder = get_encoder(ENCODER_BACKEND, 'all-MiniLM-L6-v2')  # Phải cùng model với collection
+
+    writer = ResultWriter(args.output)
+    totals = {"encode_s": 0.0, "match_s": 0.0, "score_s": 0.0}
+    num_jobs = 0
+    try:
+        for jobs in iter_jobs(args.jobs, args.id_col, args.text_col, args.batch):
+            columns, timings = match_batch(jobs, encoder, ids, embeddings, metadatas, args.k)
+            writer.write(columns)
+            num_jobs += len(jobs)
+            for key, value in timings.items():
+                totals[key] += value
+            print(f"  {num_jobs} jobs | encode {timings['encode_s']:.1f}s | "
+                  f"ghép {timings['match_s']:.1f}s | chấm điểm {timings['score_s']:.1f}s")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"\nOK {num_jobs} jobs x {len(ids)} hồ sơ, top-{args.k}: {writer.rows} dòng trong {elapsed:.1f}s "
+          f"({num_jobs / elapsed if elapsed else 0:.1f} jobs/s)")
+    print(f"Encode {totals['encode_s']:.1f}s | Ghép {totals['match_s']:.1f}s | Chấm điểm {totals['score_s']:.1f}s")
+    print(f"Đã lưu kết quả vào: {writer.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Chia hồ sơ dài thành các chunk giới hạn theo token và gộp kết quả tìm kiếm về từng hồ sơ
+
+all-MiniLM-L6-v2 chỉ đọc tối đa max_seq_length (256) token, nên khi embedding một
+combined_text dài, phần lớn mục ability bị cắt mất. Chế độ chunk:
+- Tách title / skill / ability / program thành các đoạn nhỏ (theo dấu câu, dấu phẩy),
+  đo số token THẬT (không cắt ở max_seq_length) của tất cả đoạn bằng một lần tokenizer theo
+  batch; đoạn vẫn dài hơn phần còn lại của chunk được chia theo từ và đo lại, rồi ghép tham
+  lam thành các chunk <= CHUNK_TOKENS token; mỗi chunk mở đầu bằng title để giữ ngữ cảnh
+- Mỗi chunk là một document riêng (id "<person_id>#c<i>") với metadata của hồ sơ cha
+  (person_id) → chunk của một hồ sơ luôn nằm cùng shard
+- Khi tìm kiếm: lấy dư CHUNK_OVERFETCH x k chunk, gộp về từng hồ sơ theo chunk giống nhất
+  (distance nhỏ nhất = max similarity), lấy thêm nếu chưa đủ k hồ sơ khác nhau
+
+Kết quả của query_people có cùng dạng với collection.query() (ids là person_id) nên
+search_top_k trong final_data.py dùng được mà không cần sửa phần xử lý kết quả.
+"""
+import re
+from typing import List, Dict, Any, Optional, Tuple
+
+CHUNK_COLLECTION_NAME = "qa_chunks"  # Alias của collection chunk (khác qa_collection vì id khác)
+CHUNK_TOKENS = 128  # Số token tối đa mỗi chunk (kể cả title mở đầu), <= max_seq_length của model
+CHUNK_OVERFETCH = 8  # Số chunk lấy cho mỗi hồ sơ cần trả về
+MAX_OVERFETCH_ROUNDS = 3  # Số lần lấy thêm (mỗi lần gấp đôi) nếu chưa đủ k hồ sơ khác nhau
+SPECIAL_TOKENS = 2  # [CLS] và [SEP] được token_lengths tính cho mỗi text
+
+_SEGMENT_RE = re.compile(r"[^,.;!?\n]+[,.;!?\n]*")
+
+
+def split_segments(text: str) -> List[str]:
+    """Tách text thành các đoạn ngắn, giữ dấu câu ở cuối mỗi đoạn."""
+    return [s.strip() for s in _SEGMENT_RE.findall(text or "") if s.strip(" ,.;!?\n")]
+
+
+def _split_long(segment: str, tokens: int, limit: int) -> List[str]:
+    """Chia một đoạn dài hơn limit token theo từ (ước lượng tỷ lệ token / từ, cần đo lại)."""
+    words = segment.split()
+    per_piece = max(1, int(len(words) * limit / max(tokens, 1)))
+    return [" ".join(words[i:i + per_piece]) for i in range(0, len(words), per_piece)]
+
+
+def segment_budget(title_tokens: int, chunk_tokens: int = CHUNK_TOKENS) -> int:
+    """Số token còn lại cho các đoạn trong mỗi chunk sau title mở đầu và [CLS]/[SEP]."""
+    return max(chunk_tokens - SPECIAL_TOKENS - title_tokens, 1)
+
+
+def plan_chunks(title: str, segments: List[str], lengths: List[int],
+                chunk_tokens: int = CHUNK_TOKENS) -> List[str]:
+    """
+    Ghép tham lam các đoạn (đã biết số token, không tính [CLS]/[SEP]) thành chunk.
+    Mỗi chunk = "<title>. " + các đoạn liên tiếp, tổng <= chunk_tokens.
+    Đoạn dài hơn segment_budget phải được chia trước (chunk_records); nếu còn thì thành chunk riêng.
+    """
+    title_tokens = lengths[0] if title else 0
+    prefix = f"{title}. " if title else ""
+    budget = segment_budget(title_tokens, chunk_tokens)
+    chunks, current, used = [], [], 0
+    for segment, tokens in zip(segments, lengths[1 if title else 0:]):
+        if current and used + tokens > budget:
+            chunks.append(prefix + " ".join(current))
+            current, used = [], 0
+        current.append(segment)
+        used += tokens
+    if current:
+        chunks.append(prefix + " ".join(current))
+    return chunks or ([title] if title else [])
+
+
+def _measure(encoder, texts: List[str]) -> List[int]:
+    """Số token thật (không cắt ở max_seq_length, không tính [CLS]/[SEP]) của từng text."""
+    if not texts:
+        return []
+    return [n - SPECIAL_TOKENS for n in encoder.token_lengths(texts, truncation=False)]
+
+
+def chunk_records(records: List[Tuple[str, str, Dict[str, Any]]], encoder,
+                  chunk_tokens: int = CHUNK_TOKENS) -> List[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Chuyển các record (id, combined_text, metadata) của populate_chromadb.row_to_record
+    thành các record chunk (id chunk, text chunk, metadata + chunk / num_chunks).
+    Số token của mọi đoạn trong cửa sổ được đo bằng một lần token_lengths; các đoạn vượt
+    segment_budget được chia theo từ và đo lại (theo batch) cho đến khi vừa hoặc chỉ còn một từ.
+    """
+    plans = []
+    all_texts: List[str] = []
+    for person_id, _, meta in records:
+        title = meta.get("title", "")
+        segments = []
+        for field in ("skills", "abilities", "program"):
+            segments.extend(split_segments(meta.get(field, "")))
+        texts = ([title] if title else []) + segments
+        plans.append((person_id, meta, title, len(all_texts), len(texts)))
+        all_texts.extend(texts)
+
+    lengths = _measure(encoder, all_texts)
+    # (person_id, meta, title, số token của title, [(đoạn, số token)], budget của đoạn)
+    pending = []
+    for person_id, meta, title, start, count in plans:
+        title_tokens = lengths[start] if title else 0
+        offset = start + (1 if title else 0)
+        pieces = list(zip(all_texts[offset:start + count], lengths[offset:start + count]))
+        pending.append((person_id, meta, title, title_tokens, pieces, segment_budget(title_tokens, chunk_tokens)))
+
+    while True:
+        splits = []  # (plan, vị trí đoạn, các mảnh)
+        for plan_idx, (_, _, _, _, pieces, budget) in enumerate(pending):
+            for pos, (text, tokens) in enumerate(pieces):
+                if tokens > budget and len(text.split()) > 1:
+                    splits.append((plan_idx, pos, _split_long(text, tokens, budget)))
+        if not splits:
+            break
+        measured = iter(_measure(encoder, [p for _, _, parts in splits for p in parts]))
+        replaced: Dict[int, Dict[int, List[Tuple[str, int]]]] = {}
+        for plan_idx, pos, parts in splits:
+            replaced.setdefault(plan_idx, {})[pos] = [(p, next(measured)) for p in parts]
+        for plan_idx, by_pos in replaced.items():
+            pieces = pending[plan_idx][4]
+            pieces[:] = [piece for pos, old in enumerate(pieces) for piece in by_pos.get(pos, [old])]
+
+    out = []
+    for person_id, meta, title, title_tokens, pieces, _ in pending:
+        segments = [text for text, _ in pieces]
+        chunk_lengths = ([title_tokens] if title else []) + [tokens for _, tokens in pieces]
+        chunks = plan_chunks(title, segments, chunk_lengths, chunk_tokens)
+        for i, text in enumerate(chunks):
+            out.append((f"{person_id}#c{i}", text, {**meta, "chunk": i, "num_chunks": len(chunks)}))
+    return out
+
+
+def collapse_hits(ids: List[str], distances: List[float], metadatas: Optional[List[Dict[str, Any]]],
+                  k: int) -> Tuple[List[str], List[float], List[Dict[str, Any]], List[str]]:
+    """
+    Gộp các chunk (đã sắp theo distance tăng dần) về hồ sơ cha: mỗi person_id chỉ giữ chunk
+    đầu tiên gặp (giống nhất). Trả về (person_ids, distances, metadatas, chunk ids) tối đa k phần tử.
+    """
+    seen = set()
+    out_ids, out_dist, out_meta, out_chunks = [], [], [], []
+    for pos, chunk_id in enumerate(ids):
+        meta = metadatas[pos] if metadatas else {}
+        person_id = str((meta or {}).get("person_id") or chunk_id.split("#c")[0])
+        if person_id in seen:
+            continue
+        seen.add(person_id)
+        out_ids.append(person_id)
+        out_dist.append(distances[pos])
+        out_meta.append(meta)
+        out_chunks.append(chunk_id)
+        if len(out_ids) == k:
+            break
+    return out_ids, out_dist, out_meta, out_chunks
+
+
+def query_people(collection, query_embeddings: List[List[float]], k: int,
+                 include: Optional[List[str]] = None, overfetch: int = CHUNK_OVERFETCH,
+                 max_rounds: int = MAX_OVERFETCH_ROUNDS) -> Dict[str, Any]:
+    """
+    Top-k hồ sơ (không trùng) từ collection chunk, kết quả cùng dạng collection.query().
+    Query nào chưa đủ k hồ sơ khác nhau mà còn chunk thì được lấy lại với số chunk gấp đôi.
+    """
+    include = list(include or ["metadatas", "distances"])
+    for field in ("metadatas", "distances"):
+        if field not in include:
+            include.append(field)
+    total = collection.count()
+    merged: Dict[str, Any] = {"ids": [None] * len(query_embeddings), "distances": [None] * len(query_embeddings),
+                              "metadatas": [None] * len(query_embeddings), "chunk_ids": [None] * len(query_embeddings)}
+    pending = list(range(len(query_embeddings)))
+    n_chunks = min(k * overfetch, total)
+    for round_no in range(max_rounds + 1):
+        if not pending or n_chunks <= 0:
+            break
+        res = collection.query(query_embeddings=[query_embeddings[i] for i in pending],
+                               n_results=n_chunks, include=include)
+        retry = []
+        for pos, qi in enumerate(pending):
+            ids, dists, metas, chunks = collapse_hits(res["ids"][pos], res["distances"][pos],
+                                                      res["metadatas"][pos], k)
+            merged["ids"][qi], merged["distances"][qi] = ids, dists
+            merged["metadatas"][qi], merged["chunk_ids"][qi] = metas, chunks
+            if len(ids) < k and len(res["ids"][pos]) == n_chunks and n_chunks < total:
+                retry.append(qi)
+        pending = retry
+        n_chunks = min(n_chunks * 2, total)
+    return merged
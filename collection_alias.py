@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Alias cho collection: build blue/green và đổi phiên bản nguyên tử (atomic swap)
+
+Manifest chromadb_store/collection_aliases.json có dạng:
+    {
+      "qa_collection": {
+        "current": "qa_collection_v20261018_230000",
+        "versions": ["qa_collection", "qa_collection_v20261018_230000"],
+        "generation": 3,
+        "models": {"qa_collection_v20261018_230000": "all-MiniLM-L6-v2"},
+        "updated_at": "2026-10-18T23:00:00"
+      }
+    }
+
+- populate_chromadb.py build vào một phiên bản mới trong khi phiên bản cũ vẫn phục vụ tìm kiếm,
+  sau đó publish() ghi manifest bằng os.replace (nguyên tử) để trỏ alias sang phiên bản mới
+- final_data.py resolve() alias khi khởi động và tự chuyển khi manifest thay đổi
+- Chỉ giữ lại KEEP_VERSIONS phiên bản gần nhất (để rollback), các phiên bản cũ hơn bị xóa
+- Chưa có manifest → alias chính là tên collection (tương thích với store cũ)
+- "generation" tăng mỗi khi dữ liệu của alias thay đổi (publish hoặc thêm dữ liệu vào
+  phiên bản hiện tại); collection_version() dùng làm key cho cache kết quả tìm kiếm
+- "models" ghi model embedding đã build từng phiên bản; built_with() cho biết model của
+  phiên bản hiện tại (phiên bản build trước khi có "models" coi là DEFAULT_MODEL)
+"""
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List
+
+MANIFEST_NAME = "collection_aliases.json"
+KEEP_VERSIONS = 2  # Phiên bản hiện tại + 1 phiên bản trước để rollback
+DEFAULT_MODEL = "all-MiniLM-L6-v2"  # Model của các phiên bản build trước khi manifest ghi "models"
+
+
+def manifest_path(store_dir: Path) -> Path:
+    return store_dir / MANIFEST_NAME
+
+
+def load_manifest(store_dir: Path) -> Dict[str, Any]:
+    """Đọc manifest, trả về {} nếu chưa có."""
+    path = manifest_path(store_dir)
+    if path.exists():
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(store_dir: Path, manifest: Dict[str, Any]):
+    """Ghi manifest nguyên tử: ghi file tạm rồi os.replace (người đọc không bao giờ thấy file dở dang)."""
+    path = manifest_path(store_dir)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def resolve(store_dir: Path, alias: str) -> str:
+    """Tên collection thật mà alias đang trỏ tới."""
+    entry = load_manifest(store_dir).get(alias)
+    return entry["current"] if entry else alias
+
+
+def collection_version(store_dir: Path, alias: str) -> str:
+    """Định danh dữ liệu hiện tại của alias, ví dụ "qa_collection_v20261018_230000@3"."""
+    entry = load_manifest(store_dir).get(alias)
+    if not entry:
+        return f"{alias}@0"
+    return f"{entry['current']}@{entry.get('generation', 0)}"
+
+
+def bump_generation(store_dir: Path, alias: str) -> int:
+    """Đánh dấu dữ liệu của phiên bản hiện tại đã thay đổi (ví dụ vừa thêm records)."""
+    manifest = load_manifest(store_dir)
+    entry = manifest.get(alias) or {"current": alias, "versions": [alias]}
+    entry["generation"] = entry.get("generation", 0) + 1
+    entry["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    manifest[alias] = entry
+    save_manifest(store_dir, manifest)
+    return entry["generation"]
+
+
+def record_model(store_dir: Path, alias: str, version: str, model: str):
+    """Ghi model embedding đã dùng để build `version` của alias (gọi trước publish)."""
+    manifest = load_manifest(store_dir)
+    entry = manifest.get(alias) or {"current": alias, "versions": [alias]}
+    entry.setdefault("models", {})[version] = model
+    manifest[alias] = entry
+    save_manifest(store_dir, manifest)
+
+
+def built_with(store_dir: Path, alias: str) -> str:
+    """Model embedding của phiên bản alias đang trỏ tới."""
+    entry = load_manifest(store_dir).get(alias)
+    if not entry:
+        return DEFAULT_MODEL
+    return entry.get("models", {}).get(entry["current"], DEFAULT_MODEL)
+
+
+def new_version_name(alias: str) -> str:
+    """Tên phiên bản mới, ví dụ qa_collection_v20261018_230000."""
+    return f"{alias}_v{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+
+
+def publish(store_dir: Path, alias: str, version: str, keep: int = KEEP_VERSIONS) -> List[str]:
+    """
+    Trỏ alias sang `version` và trả về danh sách phiên bản cũ cần xóa (ngoài `keep` bản gần nhất).
+    Việc xóa do người gọi thực hiện SAU khi publish, khi không còn ai được trỏ tới chúng.
+    """
+    manifest = load_manifest(store_dir)
+    entry = manifest.get(alias) or {"current": alias, "versions": []}
+    versions = [v for v in entry["versions"] if v != version]
+    if entry["current"] not in versions and entry["current"] != version:
+        versions.append(entry["current"])  # Collection cũ (kể cả tên gốc chưa có version)
+    versions.append(version)
+
+    # Luôn giữ phiên bản mới và phiên bản vừa phục vụ (có thể còn query đang chạy trên nó),
+    # sau đó giữ thêm các phiên bản gần nhất cho đủ `keep`
+    kept = {version, entry["current"]}
+    for v in reversed(versions):
+        if len(kept) >= max(keep, 2):
+            break
+        kept.add(v)
+    retired = [v for v in versions if v not in kept]
+    manifest[alias] = {
+        "current": version,
+        "versions": [v for v in versions if v in kept],
+        "generation": entry.get("generation", 0) + 1,
+        "models": {v: m for v, m in entry.get("models", {}).items() if v in kept},
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    save_manifest(store_dir, manifest)
+    return retired
+
+
+def rollback(store_dir: Path, alias: str) -> str:
+    """Trỏ alias về phiên bản ngay trước phiên bản hiện tại."""
+    manifest = load_manifest(store_dir)
+    entry = manifest.get(alias)
+    if not entry or len(entry["versions"]) < 2:
+        raise ValueError(f"Không có phiên bản trước để rollback cho '{alias}'")
+    current_idx = entry["versions"].index(entry["current"])
+    if current_idx == 0:
+        raise ValueError(f"'{entry['current']}' đã là phiên bản cũ nhất")
+    entry["current"] = entry["versions"][current_idx - 1]
+    entry["generation"] = entry.get("generation", 0) + 1
+    entry["updated_at"] = datetime.now().isoformat(timespec="seconds")
+    save_manifest(store_dir, manifest)
+    return entry["current"]
+
+
+if __name__ == "__main__":
+    import sys
+    store = Path(__file__).resolve().parent / "chromadb_store"
+    alias_name = sys.argv[2] if len(sys.argv) > 2 else "qa_collection"
+    if len(sys.argv) > 1 and sys.argv[1] == "rollback":
+        print(f"Alias {alias_name} -> {rollback(store, alias_name)}")
+    else:
+        print(json.dumps(load_manifest(store).get(alias_name, {"current": alias_name}), ensure_ascii=False, indent=2))
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+So sánh các model embedding thay thế cho all-MiniLM-L6-v2
+
+Với mỗi model có sẵn trên máy (trong cache HuggingFace), trong một process riêng:
+1. Build collection tạm từ cùng file CSV bằng populate_chromadb.ingest()
+2. Chạy các query trong random_queries.csv
+3. Đo: encode throughput, thời gian build index, độ trễ query p50/p99, peak RSS, MAP@5 / P@5
+
+Lưu ý: ngưỡng distance phụ thuộc model (phân bố distance khác nhau), nên báo cáo có cả
+metrics theo "relevance" (40% distance + 60% keyword) để so sánh công bằng hơn.
+Mỗi model chạy trong process riêng nên peak RSS không bị lẫn giữa các model.
+
+Ví dụ:
+    python compare_models.py --data Moredata.csv
+    python compare_models.py --models all-MiniLM-L6-v2 all-mpnet-base-v2 --download
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Dict, Any
+
+BASE_DIR = Path(__file__).resolve().parent
+REPORT_FILE = BASE_DIR / "model_comparison.json"
+CANDIDATE_MODELS = [
+    "all-MiniLM-L6-v2",
+    "all-MiniLM-L12-v2",
+    "paraphrase-MiniLM-L3-v2",
+    "multi-qa-MiniLM-L6-cos-v1",
+    "all-mpnet-base-v2",
+    "BAAI/bge-small-en-v1.5",
+]
+
+
+class TimedEncoder:
+    """Bọc encoder để cộng dồn thời gian encode trong lúc ingest."""
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.encode_seconds = 0.0
+        self.encoded_texts = 0
+
+    def encode(self, texts, batch_size: int = 32, **kwargs):
+        start = time.perf_counter()
+        embeddings = self.encoder.encode(texts, batch_size=batch_size, **kwargs)
+        self.encode_seconds += time.perf_counter() - start
+        self.encoded_texts += len(texts)
+        return embeddings
+
+    def token_lengths(self, texts, truncation: bool = True):
+        return self.encoder.token_lengths(texts, truncation=truncation)
+
+
+def evaluate_model(model_name: str, data_file: Path, distance_threshold: float,
+                   relevance_threshold: float, allow_download: bool) -> Dict[str, Any]:
+    """Build collection tạm + chạy workload cho một model (gọi trong process riêng)."""
+    if not allow_download:
+        os.environ["HF_HUB_OFFLINE"] = "1"  # Chỉ dùng model đã có trên máy
+    import chromadb
+    from encoders import get_encoder, _peak_rss_mb
+    from metrics import calculate_metrics, percentile
+    from populate_chromadb import merge_sources, ingest
+    from experiment_grid import read_queries
+
+    try:
+        encoder = TimedEncoder(get_encoder("torch", model_name))
+    except Exception as e:
+        return {"model": model_name, "available": False, "error": f"{type(e).__name__}: {e}"[:200]}
+
+    rows, _ = merge_sources([data_file])  # Bỏ person_id trùng giống populate_chromadb.py
+    queries = read_queries()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = chromadb.PersistentClient(path=tmp)
+        collection = client.get_or_create_collection(name="compare")
+        start = time.perf_counter()
+        added = ingest(collection, rows, encoder)
+        ingest_s = time.perf_counter() - start
+
+        latencies = []
+        scores = {"distance": ([], []), "relevance": ([], [])}  # method → (AP@5, P@5)
+        for q in queries:
+            start = time.perf_counter()
+            q_emb = encoder.encoder.encode([q["query_text"]])[0].tolist()
+            res = collection.query(query_embeddings=[q_emb], n_results=5, include=["metadatas", "distances"])
+            latencies.append((time.perf_counter() - start) * 1000)
+            results = [{"person_id": pid, "distance": dist, **meta}
+                       for pid, dist, meta in zip(res["ids"][0], res["distances"][0], res["metadatas"][0])]
+            for method, threshold in (("distance", distance_threshold), ("relevance", relevance_threshold)):
+                metrics = calculate_metrics(results, q["query_text"], k=5, method=method, threshold=threshold)
+                scores[method][0].append(metrics["ap_at_k"])
+                scores[method][1].append(metrics["precision_at_k"])
+
+    n = max(len(queries), 1)
+    return {
+        "model": model_name,
+        "available": True,
+        "dim": len(q_emb) if queries else None,
+        "docs": added,
+        "encode_per_sec": encoder.encoded_texts / encoder.encode_seconds if encoder.encode_seconds else 0.0,
+        "index_build_s": ingest_s - encoder.encode_seconds,
+        "ingest_total_s": ingest_s,
+        "query_p50_ms": percentile(latencies, 50),
+        "query_p99_ms": percentile(latencies, 99),
+        "peak_rss_mb": _peak_rss_mb(),
+        **{f"{key}_{method}": sum(values) / n
+           for method, (ap_scores, precisions) in scores.items()
+           for key, values in (("map_at_5", ap_scores), ("precision_at_5", precisions))},
+    }
+
+
+def _worker(args, queue):
+    try:
+        queue.put(evaluate_model(*args))
+    except Exception as e:  # Luôn trả kết quả để process cha không chờ mãi
+        queue.put({"model": args[0], "available": False, "error": f"{type(e).__name__}: {e}"[:200]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh model embedding")
+    parser.add_argument("--models", nargs="+", default=CANDIDATE_MODELS)
+    parser.add_argument("--data", type=Path, default=BASE_DIR / "Moredata.csv")
+    parser.add_argument("--distance-threshold", type=float, default=0.8, help="Giống final_data.py")
+    parser.add_argument("--relevance-threshold", type=float, default=0.5, help="Giống final_data.py")
+    parser.add_argument("--download", action="store_true", help="Cho phép tải model chưa có trên máy")
+    args = parser.parse_args()
+
+    import multiprocessing as mp
+    ctx = mp.get_context("spawn")  # Mỗi model một process → peak RSS không lẫn nhau
+    rows: List[Dict[str, Any]] = []
+    for model_name in args.models:
+        print(f"Đang đánh giá {model_name}...")
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_worker,
+                           args=((model_name, args.data, args.distance_threshold, args.relevance_threshold,
+                                  args.download), queue))
+        proc.start()
+        result = queue.get()
+        proc.join()
+        rows.append(result)
+        if not result["available"]:
+            print(f"  Bỏ qua: {result['error']}")
+
+    available = [r for r in rows if r["available"]]
+    print(f"\nDữ liệu: {args.data.name} | distance threshold {args.distance_threshold} | "
+          f"relevance threshold {args.relevance_threshold}")
+    print(f"{'Model':<30}{'Enc/s':>8}{'Build s':>9}{'p50 ms':>8}{'p99 ms':>8}{'RSS MB':>8}"
+          f"{'MAP@5 d':>9}{'P@5 d':>8}{'MAP@5 r':>9}{'P@5 r':>8}")
+    for r in available:
+        print(f"{r['model'][:29]:<30}{r['encode_per_sec']:>8.1f}{r['index_build_s']:>9.2f}"
+              f"{r['query_p50_ms']:>8.1f}{r['query_p99_ms']:>8.1f}{r['peak_rss_mb']:>8.0f}"
+              f"{r['map_at_5_distance']:>9.4f}{r['precision_at_5_distance']:>8.4f}"
+              f"{r['map_at_5_relevance']:>9.4f}{r['precision_at_5_relevance']:>8.4f}")
+
+    with REPORT_FILE.open("w", encoding="utf-8") as f:
+        json.dump({"data": args.data.name, "distance_threshold": args.distance_threshold,
+                   "relevance_threshold": args.relevance_threshold, "models": rows},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu báo cáo vào: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
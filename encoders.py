@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Encoder có thể thay thế: PyTorch (SentenceTransformer) hoặc ONNX Runtime (fp32 / int8)
+
+Tất cả backend có cùng interface:
+    encoder.encode(texts, batch_size=32) -> np.ndarray (n, dim)
+    encoder.token_lengths(texts, truncation=True) -> List[int]
+và cho ra embedding tương thích với collection đã build bằng all-MiniLM-L6-v2
+(mean pooling + chuẩn hóa L2 giống SentenceTransformer).
+
+Dòng lệnh:
+    python encoders.py export              # Xuất model sang ONNX (fp32 + int8)
+    python encoders.py parity              # Kiểm tra cosine giữa các backend và torch
+    python encoders.py benchmark           # So sánh encodes/giây và peak RSS
+"""
+import argparse
+import json
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import List, Dict
+
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent
+MODEL_NAME = "all-MiniLM-L6-v2"
+ONNX_DIR = BASE_DIR / "onnx_models"
+BACKENDS = ["torch", "onnx", "onnx-int8"]
+PARITY_MIN_COSINE = 0.98  # int8 thường đạt ~0.99; thấp hơn ngưỡng này coi là không tương thích
+
+
+class TorchEncoder:
+    """Backend mặc định: SentenceTransformer trên PyTorch."""
+
+    backend = "torch"
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        # kwargs (convert_to_tensor, show_progress_bar, ...) được bỏ qua để tương thích
+        # với các lời gọi model.encode(...) cũ
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                 show_progress_bar=False)
+
+    def token_lengths(self, texts: List[str], truncation: bool = True) -> List[int]:
+        """Số token (kể cả [CLS]/[SEP]); truncation=False: độ dài thật, có thể > max_seq_length."""
+        if truncation:
+            encoded = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)
+        else:
+            encoded = self.tokenizer(texts, truncation=False, verbose=False)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+
+class OnnxEncoder:
+    """
+    Backend ONNX Runtime trên CPU, không cần PyTorch lúc chạy.
+
+    Model được xuất bằng export_onnx(); thư mục chứa model.onnx (fp32),
+    model_int8.onnx (quantize động int8), tokenizer.json và encoder_config.json.
+    """
+
+    def __init__(self, model_dir: Path, quantized: bool = False, num_threads: int = 0):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with (model_dir / "encoder_config.json").open("r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.backend = "onnx-int8" if quantized else "onnx"
+        self.model_name = self.config["model_name"]
+        self.max_seq_length = self.config["max_seq_length"]
+        self.normalize = self.config["normalize"]
+
+        self.tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_file = model_dir / ("model_int8.onnx" if quantized else "model.onnx")
+        self.session = ort.InferenceSession(str(model_file), options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, texts: List[str], batch_size: int = 32, **kwargs) -> np.ndarray:
+        outputs = []
+        for i in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[i:i+batch_size])
+            input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            # Mean pooling theo attention mask (giống Pooling của SentenceTransformer)
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(pooled.astype(np.float32))
+        if not outputs:
+            return np.zeros((0, self.config["dim"]), dtype=np.float32)
+        return np.vstack(outputs)
+
+    def token_lengths(self, texts: List[str], truncation: bool = True) -> List[int]:
+        """Số token (kể cả [CLS]/[SEP]); truncation=False: độ dài thật, có thể > max_seq_length."""
+        self.tokenizer.no_padding()
+        if not truncation:
+            self.tokenizer.no_truncation()
+        try:
+            return [len(e.ids) for e in self.tokenizer.encode_batch(texts)]
+        finally:
+            self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+            self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+
+
+def onnx_model_dir(model_name: str = MODEL_NAME) -> Path:
+    return ONNX_DIR / model_name.replace("/", "__")
+
+
+def export_onnx(model_name: str = MODEL_NAME, quantize: bool = True) -> Path:
+    """
+    Xuất transformer của SentenceTransformer sang ONNX (và bản int8 nếu quantize=True).
+    Bước này cần PyTorch; lúc chạy OnnxEncoder thì không cần.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out_dir = onnx_model_dir(model_name)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+
+    # Chỉ hỗ trợ pipeline Transformer → mean Pooling → (Normalize)
+    module_types = [type(m).__name__ for m in st]
+    pooling = st[1]
+    if getattr(pooling, "pooling_mode_mean_tokens", False) is not True:
+        raise ValueError(f"Chỉ hỗ trợ mean pooling, model có: {module_types}")
+
+    transformer = st[0].auto_model.eval()
+    tokenizer = st.tokenizer
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    dynamic_axes = {n: {0: "batch", 1: "sequence"} for n in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[n] for n in input_names),
+            str(out_dir / "model.onnx"),
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    tokenizer.save_pretrained(str(out_dir))  # Ghi tokenizer.json (fast tokenizer)
+
+    config = {
+        "model_name": model_name,
+        "max_seq_length": st.max_seq_length,
+        "normalize": "Normalize" in module_types,
+        "dim": st.get_sentence_embedding_dimension(),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+    }
+    with (out_dir / "encoder_config.json").open("w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(str(out_dir / "model.onnx"), str(out_dir / "model_int8.onnx"),
+                         weight_type=QuantType.QInt8)
+    return out_dir
+
+
+def get_encoder(backend: str = "torch", model_name: str = MODEL_NAME):
+    """
+    Tạo encoder theo backend: "torch", "onnx" hoặc "onnx-int8".
+    Model ONNX được tự động xuất ở lần dùng đầu tiên nếu chưa có.
+    """
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        model_dir = onnx_model_dir(model_name)
+        quantized = backend == "onnx-int8"
+        model_file = model_dir / ("model_int8.onnx" if quantized else "model.onnx")
+        if not model_file.exists():
+            print(f"Chưa có model ONNX, đang xuất vào {model_dir}...")
+            export_onnx(model_name, quantize=quantized)
+        return OnnxEncoder(model_dir, quantized=quantized)
+    raise ValueError(f"Backend không hợp lệ: {backend} (chọn một trong {BACKENDS})")
+
+
+# ============================================================================
+# KIỂM TRA TƯƠNG THÍCH VÀ BENCHMARK
+# ============================================================================
+
+def check_parity(reference, candidate, texts: List[str]) -> Dict[str, float]:
+    """Cosine giữa embedding của candidate và reference trên cùng tập texts."""
+    a = reference.encode(texts)
+    b = candidate.encode(texts)
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    cos = (a * b).sum(axis=1)
+    return {
+        "n": len(texts),
+        "min_cosine": float(cos.min()),
+        "mean_cosine": float(cos.mean()),
+        "passed": bool(cos.min() >= PARITY_MIN_COSINE),
+    }
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _benchmark_worker(backend: str, model_name: str, texts: List[str], batch_size: int, queue):
+    """
+    Chạy trong process riêng để peak RSS của mỗi backend không lẫn vào nhau.
+    Model ONNX phải được xuất trước (ở process cha), nếu không RSS gồm cả PyTorch lúc xuất.
+    """
+    try:
+        encoder = get_encoder(backend, model_name)
+        encoder.encode(texts[:batch_size], batch_size=batch_size)  # Làm nóng
+        start = time.perf_counter()
+        encoder.encode(texts, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        queue.put({
+            "backend": backend,
+            "texts": len(texts),
+            "seconds": elapsed,
+            "encodes_per_sec": len(texts) / elapsed if elapsed > 0 else 0.0,
+            "peak_rss_mb": _peak_rss_mb(),
+        })
+    except Exception as e:  # Luôn trả kết quả để process cha không chờ mãi
+        queue.put({"backend": backend, "error": f"{type(e).__name__}: {e}"[:200]})
+
+
+def load_texts(path: Path, limit: int) -> List[str]:
+    """Lấy combined_text của các hồ sơ trong CSV (giống populate_chromadb.py)."""
+    from populate_chromadb import load_rows, row_to_record
+    records = (row_to_record(row) for row in load_rows(path))
+    return [r[1] for r in records if r is not None][:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encoder backends: export / parity / benchmark")
+    parser.add_argument("command", choices=["export", "parity", "benchmark"])
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--data", type=Path, default=BASE_DIR / "Moredata.csv")
+    parser.add_argument("--limit", type=int, default=500, help="Số hồ sơ dùng để kiểm tra/benchmark")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Đã xuất ONNX vào: {export_onnx(args.model)}")
+        return
+
+    texts = load_texts(args.data, args.limit)
+    if args.command == "parity":
+        reference = get_encoder("torch", args.model)
+        for backend in args.backends:
+            if backend == "torch":
+                continue
+            result = check_parity(reference, get_encoder(backend, args.model), texts)
+            status = "✓ OK" if result["passed"] else f"✗ < {PARITY_MIN_COSINE}"
+            print(f"{backend}: min cosine {result['min_cosine']:.5f} | "
+                  f"mean cosine {result['mean_cosine']:.5f} ({result['n']} texts) {status}")
+        return
+
+    onnx_backends = [b for b in args.backends if b != "torch"]
+    model_dir = onnx_model_dir(args.model)
+    if onnx_backends and not all((model_dir / ("model_int8.onnx" if b == "onnx-int8" else "model.onnx")).exists()
+                                 for b in onnx_backends):
+        print(f"Chưa có model ONNX, đang xuất vào {model_dir}...")
+        export_onnx(args.model, quantize="onnx-int8" in onnx_backends)
+
+    import multiprocessing as mp
+    ctx = mp.get_context("spawn")
+    results = []
+    for backend in args.backends:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_benchmark_worker, args=(backend, args.model, texts, args.batch_size, queue))
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+    print(f"\n{args.model}")
+    print(f"{'Backend':<12}{'Encodes/s':>12}{'Seconds':>10}{'Peak RSS (MB)':>16}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:<12}  lỗi: {r['error']}")
+            continue
+        print(f"{r['backend']:<12}{r['encodes_per_sec']:>12.1f}{r['seconds']:>10.2f}{r['peak_rss_mb']:>16.1f}")
+    with (BASE_DIR / "encoder_benchmark.json").open("w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
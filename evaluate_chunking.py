@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+So sánh index một vector / hồ sơ với index chunk (chunking.py) trên cùng dữ liệu
+
+Với mỗi chế độ, build collection trong thư mục tạm rồi đo:
+- Chi phí: số document, dung lượng index trên đĩa, thời gian ingest (encode + add),
+  độ trễ query p50/p99 (chế độ chunk gồm cả lấy dư và gộp về hồ sơ)
+- Chất lượng với metrics có sẵn: MAP@5 / Precision@5 (distance và relevance, threshold
+  giống final_data.py) và known-item (hit@k, MRR của target_person_id, xem known_item.py)
+
+Lưu ý: distance của chunk thường nhỏ hơn distance của cả hồ sơ (chunk ngắn, tập trung hơn),
+nên metric theo distance threshold thiên về chế độ chunk; known-item là tín hiệu khách quan hơn.
+
+Ví dụ:
+    python evaluate_chunking.py --chunk-tokens 128 256          # Dữ liệu: populate_chromadb.DATA_FILES
+    python evaluate_chunking.py --data data.csv Moredata.csv
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from chunking import query_people, CHUNK_TOKENS
+from known_item import summarize, DEFAULT_DEPTH
+from maintenance import _dir_size
+from metrics import calculate_metrics, percentile
+
+BASE_DIR = Path(__file__).resolve().parent
+REPORT_FILE = BASE_DIR / "chunking_report.json"
+ENCODER_BACKEND = "torch"
+
+
+def evaluate_mode(rows: List[Dict[str, str]], queries: List[Dict[str, str]], encoder,
+                  chunk_tokens: Optional[int], distance_threshold: float, relevance_threshold: float,
+                  depth: int = DEFAULT_DEPTH) -> Dict[str, Any]:
+    """Build index tạm (chunk_tokens=None: một vector / hồ sơ) và đo chi phí + chất lượng."""
+    import chromadb
+    from populate_chromadb import ingest
+
+    q_embs = encoder.encode([q["query_text"] for q in queries]).tolist()
+    with tempfile.TemporaryDirectory() as tmp:
+        client = chromadb.PersistentClient(path=tmp)
+        collection = client.get_or_create_collection(name="chunking_eval")
+        start = time.perf_counter()
+        docs = ingest(collection, rows, encoder, chunk_tokens=chunk_tokens)
+        ingest_s = time.perf_counter() - start
+
+        def search(emb, k):
+            if chunk_tokens:
+                return query_people(collection, [emb], k)
+            return collection.query(query_embeddings=[emb], n_results=min(k, docs),
+                                    include=["metadatas", "distances"])
+
+        latencies = []
+        scores = {"distance": ([], []), "relevance": ([], [])}  # method → (AP@5, P@5)
+        for q, emb in zip(queries, q_embs):
+            begin = time.perf_counter()
+            res = search(emb, 5)
+            latencies.append((time.perf_counter() - begin) * 1000)
+            results = [{"person_id": pid, "distance": dist, **meta}
+                       for pid, dist, meta in zip(res["ids"][0], res["distances"][0], res["metadatas"][0])]
+            for method, threshold in (("distance", distance_threshold), ("relevance", relevance_threshold)):
+                metrics = calculate_metrics(results, q["query_text"], k=5, method=method, threshold=threshold)
+                scores[method][0].append(metrics["ap_at_k"])
+                scores[method][1].append(metrics["precision_at_k"])
+
+        # Known-item: hạng của target_person_id trong top-depth hồ sơ
+        ranks = np.zeros(len(queries), dtype=np.int32)
+        for i, (q, emb) in enumerate(zip(queries, q_embs)):
+            ids = search(emb, depth)["ids"][0]
+            target = str(q.get("target_person_id", "")).strip()
+            if target in ids:
+                ranks[i] = ids.index(target) + 1
+        index_bytes = _dir_size(Path(tmp))
+
+    n = max(len(queries), 1)
+    return {
+        "mode": f"chunk{chunk_tokens}" if chunk_tokens else "whole",
+        "chunk_tokens": chunk_tokens,
+        "documents": docs,
+        "index_mb": index_bytes / 1024 / 1024,
+        "ingest_s": ingest_s,
+        "query_p50_ms": percentile(latencies, 50),
+        "query_p99_ms": percentile(latencies, 99),
+        **{f"{key}_{method}": sum(values) / n
+           for method, (ap_scores, precisions) in scores.items()
+           for key, values in (("map_at_5", ap_scores), ("precision_at_5", precisions))},
+        "known_item": summarize(ranks, depth),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="So sánh index chunk với index một vector / hồ sơ")
+    parser.add_argument("--data", type=Path, nargs="+", default=None,
+                        help="File CSV hồ sơ (mặc định populate_chromadb.DATA_FILES)")
+    parser.add_argument("--chunk-tokens", type=int, nargs="+", default=[CHUNK_TOKENS])
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="Độ sâu cho known-item")
+    parser.add_argument("--distance-threshold", type=float, default=0.8, help="Giống final_data.py")
+    parser.add_argument("--relevance-threshold", type=float, default=0.5, help="Giống final_data.py")
+    args = parser.parse_args()
+
+    from encoders import get_encoder
+    from experiment_grid import read_queries
+    from populate_chromadb import merge_sources, DATA_FILES
+
+    data_files = args.data or DATA_FILES
+    for path in data_files:
+        if not path.exists():
+            parser.error(f"Không tìm thấy file {path}")
+    encoder = get_encoder(ENCODER_BACKEND, 'all-MiniLM-L6-v2')
+    rows, _ = merge_sources(data_files)
+    queries = read_queries()
+    # Query có hồ sơ đích không nằm trong dữ liệu luôn bị tính là miss → bỏ để known-item không lệch
+    person_ids = {str(row.get("person_id", "")).strip() for row in rows}
+    missing = [q for q in queries if str(q.get("target_person_id", "")).strip() not in person_ids]
+    if missing:
+        print(f"⚠️  {len(missing)}/{len(queries)} queries có target_person_id không có trong "
+              f"{', '.join(p.name for p in data_files)} → bỏ qua")
+        queries = [q for q in queries if str(q.get("target_person_id", "")).strip() in person_ids]
+    runs = []
+    for chunk_tokens in [None] + sorted(set(args.chunk_tokens)):
+        label = f"chunk {chunk_tokens} token" if chunk_tokens else "một vector / hồ sơ"
+        print(f"Đang đánh giá {label}...")
+        runs.append(evaluate_mode(rows, queries, encoder, chunk_tokens, args.distance_threshold,
+                                  args.relevance_threshold, args.depth))
+
+    base = runs[0]
+    print(f"\nDữ liệu: {', '.join(p.name for p in data_files)} ({len(rows)} hồ sơ) | {len(queries)} queries")
+    print(f"{'Mode':<12}{'Docs':>8}{'Index MB':>10}{'Ingest s':>10}{'p50 ms':>8}{'p99 ms':>8}"
+          f"{'MAP@5 d':>9}{'MAP@5 r':>9}{'hit@10':>8}{'MRR':>8}")
+    for r in runs:
+        ki = r["known_item"]
+        print(f"{r['mode']:<12}{r['documents']:>8}{r['index_mb']:>10.1f}{r['ingest_s']:>10.1f}"
+              f"{r['query_p50_ms']:>8.1f}{r['query_p99_ms']:>8.1f}{r['map_at_5_distance']:>9.4f}"
+              f"{r['map_at_5_relevance']:>9.4f}{ki['hit_at'].get('10', 0.0):>8.3f}{ki['mrr']:>8.4f}")
+    for r in runs[1:]:
+        print(f"\n{r['mode']} so với một vector / hồ sơ: index x{r['index_mb'] / max(base['index_mb'], 1e-9):.1f}, "
+              f"ingest x{r['ingest_s'] / max(base['ingest_s'], 1e-9):.1f}, "
+              f"p50 {r['query_p50_ms'] - base['query_p50_ms']:+.1f} ms | "
+              f"MRR {r['known_item']['mrr'] - base['known_item']['mrr']:+.4f}, "
+              f"MAP@5 (relevance) {r['map_at_5_relevance'] - base['map_at_5_relevance']:+.4f}")
+
+    with REPORT_FILE.open("w", encoding="utf-8") as f:
+        json.dump({"data": [p.name for p in data_files], "skipped_queries": len(missing),
+                   "distance_threshold": args.distance_threshold,
+                   "relevance_threshold": args.relevance_threshold, "runs": runs},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu báo cáo vào: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+So sánh tìm kiếm gốc (top 5 theo embedding) với tìm kiếm có re-rank cross-encoder
+
+Chạy tất cả queries trong random_queries.csv theo cả 2 cách và báo cáo:
+- Chất lượng, chấm bằng tín hiệu KHÔNG suy ra từ thứ tự distance của bản gốc
+  (kết quả re-rank giữ distance bi-encoder cũ, nên chấm theo distance threshold thì
+  top 5 gốc luôn tốt nhất và re-rank không bao giờ "tăng" được):
+  1. Known-item (chính): hồ sơ đích target_person_id có trong top 5 không (hit@5), MRR@5
+  2. Nhãn qrels đã đánh giá thủ công (nếu có qrels.sqlite3): tỷ lệ phù hợp trên các cặp đã có nhãn
+  3. MAP@5, Precision@5 theo method "relevance" (keyword + distance, tham khảo)
+- Độ trễ p50/p99 của từng cách và độ trễ tăng thêm do re-rank
+"""
+import argparse
+import json
+import time
+from typing import List, Dict, Any, Optional
+
+import final_data
+from final_data import (
+    load_queries, search_top5, search_reranked_top5, get_reranker, RELEVANCE_THRESHOLD, BASE_DIR,
+)
+from metrics import calculate_metrics, percentile
+from qrels import JudgmentStore, QRELS_FILE
+
+REPORT_FILE = BASE_DIR / "rerank_report.json"
+QUALITY_SIGNALS = "known-item (target_person_id), qrels (nếu có), relevance method"
+
+
+def evaluate(search_fn, queries: List[Dict[str, str]], store: Optional[JudgmentStore] = None) -> Dict[str, Any]:
+    """Chạy search_fn cho từng query, trả về metrics và độ trễ (ms) từng query."""
+    hits, reciprocal_ranks, ap_scores, precisions, latencies = [], [], [], [], []
+    judged, judged_relevant = 0, 0
+    for q in queries:
+        start = time.perf_counter()
+        results = search_fn(q["query_text"])
+        latencies.append((time.perf_counter() - start) * 1000)
+        person_ids = [str(r.get("person_id")) for r in results[:5]]
+
+        target = str(q.get("target_person_id", "")).strip()
+        rank = person_ids.index(target) + 1 if target in person_ids else 0
+        hits.append(1 if rank else 0)
+        reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+        if store is not None:
+            labels = store.lookup(q.get("query_id", ""), person_ids)
+            judged += len(labels)
+            judged_relevant += sum(labels.values())
+
+        metrics = calculate_metrics(results, q["query_text"], k=5,
+                                    method="relevance", threshold=RELEVANCE_THRESHOLD)
+        ap_scores.append(metrics["ap_at_k"])
+        precisions.append(metrics["precision_at_k"])
+    n = max(len(queries), 1)
+    return {
+        "hit_at_5": sum(hits) / n,
+        "mrr_at_5": sum(reciprocal_ranks) / n,
+        "qrels_judged": judged,
+        "qrels_precision": judged_relevant / judged if judged else None,
+        "map_at_5_relevance": sum(ap_scores) / n,
+        "precision_at_5_relevance": sum(precisions) / n,
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p99_ms": percentile(latencies, 99),
+        "latencies_ms": latencies,
+    }
+
+
+def _fmt(value: Optional[float]) -> str:
+    return f"{value:.4f}" if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đánh giá re-rank cross-encoder")
+    parser.add_argument("--limit", type=int, default=None, help="Chỉ chạy N queries đầu tiên")
+    parser.add_argument("--top-n", type=int, default=final_data.RERANK_TOP_N)
+    parser.add_argument("--budget-ms", type=float, default=final_data.RERANK_LATENCY_BUDGET_MS)
+    args = parser.parse_args()
+
+    queries = [q for q in load_queries() if q["query_text"].strip()][:args.limit]
+
+    reranker = get_reranker()
+    reranker.top_n = args.top_n
+    reranker.latency_budget_ms = args.budget_ms
+
+    store = JudgmentStore(QRELS_FILE) if QRELS_FILE.exists() else None
+    print(f"Đánh giá {len(queries)} queries, chấm bằng: {QUALITY_SIGNALS}")
+    try:
+        baseline = evaluate(search_top5, queries, store)
+        reranked = evaluate(search_reranked_top5, queries, store)
+    finally:
+        if store:
+            store.close()
+
+    added = [r - b for r, b in zip(reranked["latencies_ms"], baseline["latencies_ms"])]
+    report = {
+        "num_queries": len(queries),
+        "rerank_model": final_data.RERANK_MODEL,
+        "top_n": args.top_n,
+        "latency_budget_ms": args.budget_ms,
+        "final_top_n": reranker.last_top_n,
+        "baseline": {k: v for k, v in baseline.items() if k != "latencies_ms"},
+        "reranked": {k: v for k, v in reranked.items() if k != "latencies_ms"},
+        "quality_signals": QUALITY_SIGNALS,
+        "hit_at_5_gain": reranked["hit_at_5"] - baseline["hit_at_5"],
+        "mrr_at_5_gain": reranked["mrr_at_5"] - baseline["mrr_at_5"],
+        "map_at_5_relevance_gain": reranked["map_at_5_relevance"] - baseline["map_at_5_relevance"],
+        "precision_at_5_relevance_gain": reranked["precision_at_5_relevance"] - baseline["precision_at_5_relevance"],
+        "added_latency_p50_ms": percentile(added, 50),
+        "added_latency_p99_ms": percentile(added, 99),
+    }
+
+    print("\n" + "="*80)
+    print("KẾT QUẢ RE-RANK")
+    print("="*80)
+    print(f"Known-item hit@5: {baseline['hit_at_5']:.4f} → {reranked['hit_at_5']:.4f} "
+          f"(gain: {report['hit_at_5_gain']:+.4f})")
+    print(f"Known-item MRR@5: {baseline['mrr_at_5']:.4f} → {reranked['mrr_at_5']:.4f} "
+          f"(gain: {report['mrr_at_5_gain']:+.4f})")
+    if baseline["qrels_judged"] or reranked["qrels_judged"]:
+        print(f"Qrels (tỷ lệ phù hợp trên cặp đã có nhãn): {_fmt(baseline['qrels_precision'])} "
+              f"({baseline['qrels_judged']} cặp) → {_fmt(reranked['qrels_precision'])} "
+              f"({reranked['qrels_judged']} cặp)")
+    print(f"MAP@5 (relevance): {baseline['map_at_5_relevance']:.4f} → {reranked['map_at_5_relevance']:.4f} "
+          f"(gain: {report['map_at_5_relevance_gain']:+.4f})")
+    print(f"Precision@5 (relevance): {baseline['precision_at_5_relevance']:.4f} → "
+          f"{reranked['precision_at_5_relevance']:.4f} (gain: {report['precision_at_5_relevance_gain']:+.4f})")
+    print(f"Độ trễ tăng thêm: p50 = {report['added_latency_p50_ms']:.1f} ms | "
+          f"p99 = {report['added_latency_p99_ms']:.1f} ms")
+    print(f"N cuối cùng sau khi điều chỉnh theo ngân sách: {reranker.last_top_n}")
+
+    with REPORT_FILE.open("w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu báo cáo vào: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Đánh giá cache ngữ nghĩa trên random_queries.csv: hit rate và recall bị mất
+
+Cách làm (chỉ 1 lần encode + 1 lần query theo batch cho tất cả queries):
+1. Encode tất cả queries, lấy top-K thật (không cache) bằng một lời gọi collection.query
+2. Với mỗi bán kính, phát lại queries theo thứ tự qua một SemanticQueryCache mới:
+   hit → dùng kết quả của query đã cache, miss → dùng kết quả thật rồi thêm vào cache
+3. Recall@K = |kết quả trả về ∩ kết quả thật| / K, so sánh với 1.0 của bản không cache
+
+Ví dụ:
+    python evaluate_semantic_cache.py --radii 0.02 0.05 0.1 0.15
+"""
+import argparse
+import json
+
+from final_data import load_queries, model, collection, BASE_DIR, SEMANTIC_CACHE_SIZE
+from semantic_cache import SemanticQueryCache
+
+REPORT_FILE = BASE_DIR / "semantic_cache_report.json"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit rate / recall của cache ngữ nghĩa")
+    parser.add_argument("--radii", type=float, nargs="+", default=[0.02, 0.05, 0.1, 0.15])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--capacity", type=int, default=SEMANTIC_CACHE_SIZE)
+    args = parser.parse_args()
+
+    queries = [q["query_text"] for q in load_queries() if q["query_text"].strip()]
+    embeddings = model.encode(queries)
+    truth = collection.query(query_embeddings=embeddings.tolist(), n_results=args.k,
+                             include=["distances"])["ids"]
+
+    runs = []
+    for radius in args.radii:
+        cache = SemanticQueryCache(args.capacity, radius)
+        recalls, hit_recalls = [], []
+        for emb, true_ids in zip(embeddings, truth):
+            cached = cache.lookup(emb, args.k, "eval")
+            if cached is None:
+                cache.add(emb, args.k, "eval", [{"person_id": pid} for pid in true_ids])
+                recalls.append(1.0)
+            else:
+                returned = {r["person_id"] for r in cached}
+                recall = len(returned & set(true_ids)) / max(len(true_ids), 1)
+                recalls.append(recall)
+                hit_recalls.append(recall)
+        stats = cache.stats()
+        run = {
+            "radius": radius,
+            "hits": stats["hits"],
+            "hit_rate": stats["hit_rate"],
+            "recall_at_k": sum(recalls) / len(recalls) if recalls else 0.0,
+            "recall_at_k_on_hits": sum(hit_recalls) / len(hit_recalls) if hit_recalls else None,
+        }
+        run["recall_loss"] = 1.0 - run["recall_at_k"]
+        runs.append(run)
+        on_hits = f"{run['recall_at_k_on_hits']:.4f}" if hit_recalls else "-"
+        print(f"radius {radius:.3f}: hit rate {run['hit_rate']:.1%} ({run['hits']}/{len(queries)}) | "
+              f"recall@{args.k} {run['recall_at_k']:.4f} (mất {run['recall_loss']:.4f}) | "
+              f"recall trên hits {on_hits}")
+
+    with REPORT_FILE.open("w", encoding="utf-8") as f:
+        json.dump({"num_queries": len(queries), "k": args.k, "capacity": args.capacity, "runs": runs},
+                  f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu báo cáo vào: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Chạy lưới thí nghiệm (grid) các cấu hình đánh giá, dùng chung phần việc tốn kém
+
+Thay vì sửa hằng số trong final_data.py và chạy lại toàn bộ cho mỗi tổ hợp:
+- Encode mỗi (model, query) đúng 1 lần
+- Truy vấn mỗi (collection, model, query) đúng 1 lần với K lớn nhất trong grid; collection
+  được mở qua alias (kể cả khi chia shard) và cặp (collection, model) mà collection không được
+  build bằng model đó bị bỏ qua (cùng số chiều vẫn không so sánh được embedding của 2 model)
+- Mỗi ô (K, EVALUATION_METHOD, threshold) chỉ cắt top-K và tính metrics → chạy song song
+  trên process pool (worker chỉ import metrics.py, không tải model/ChromaDB)
+- Kết quả: một bảng so sánh (in ra màn hình + experiment_results.csv)
+
+File grid (JSON), ví dụ experiment_grid.json:
+    {
+      "models": ["all-MiniLM-L6-v2"],
+      "collections": ["qa_collection"],
+      "k": [3, 5, 10],
+      "evaluation_method": ["distance", "relevance"],
+      "distance_threshold": [0.7, 0.8, 0.9],
+      "relevance_threshold": [0.4, 0.5]
+    }
+
+Ví dụ:
+    python experiment_grid.py experiment_grid.json --workers 4
+"""
+import argparse
+import csv
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any
+
+from metrics import calculate_metrics
+
+BASE_DIR = Path(__file__).resolve().parent
+STORE_DIR = BASE_DIR / "chromadb_store"
+QUERIES_FILE = BASE_DIR / "random_queries.csv"
+OUTPUT_FILE = BASE_DIR / "experiment_results.csv"
+NUM_SHARDS = 1  # Giống populate_chromadb.py / final_data.py
+
+DEFAULT_GRID = {
+    "models": ["all-MiniLM-L6-v2"],
+    "collections": ["qa_collection"],
+    "k": [5],
+    "evaluation_method": ["distance", "relevance"],
+    "distance_threshold": [0.8],
+    "relevance_threshold": [0.5],
+}
+
+# Dữ liệu dùng chung trong worker: {(collection, model): (queries, retrieved)}
+_worker_data: Dict[tuple, Any] = {}
+
+
+def read_queries(path: Path = QUERIES_FILE) -> List[Dict[str, str]]:
+    """Đọc queries (giống load_queries của final_data.py, nhưng không cần import final_data)."""
+    with path.open("r", encoding="utf-8", newline="") as f:
+        return [row for row in csv.DictReader(f) if (row.get("query_text") or "").strip()]
+
+
+def expand_cells(grid: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Sinh các ô của grid; threshold đi theo method tương ứng."""
+    cells = []
+    for collection, model, k, method in itertools.product(
+            grid["collections"], grid["models"], grid["k"], grid["evaluation_method"]):
+        thresholds = grid["distance_threshold"] if method == "distance" else grid["relevance_threshold"]
+        for threshold in thresholds:
+            cells.append({"collection": collection, "model": model, "k": k,
+                          "method": method, "threshold": threshold})
+    return cells
+
+
+def retrieve_all(grid: Dict[str, Any], queries: List[Dict[str, str]]) -> Dict[tuple, Any]:
+    """Encode 1 lần cho mỗi (model, query), truy vấn 1 lần cho mỗi (collection, model) với K lớn nhất."""
+    import chromadb
+    from collection_alias import resolve, built_with
+    from encoders import get_encoder
+    from populate_chromadb import open_collection
+
+    client = chromadb.PersistentClient(path=str(STORE_DIR))
+    max_k = max(grid["k"])
+    texts = [q["query_text"] for q in queries]
+    data = {}
+    for model_name in grid["models"]:
+        start = time.perf_counter()
+        embeddings = get_encoder("torch", model_name).encode(texts).tolist()
+        print(f"Encode {len(texts)} queries với {model_name}: {time.perf_counter() - start:.1f}s")
+        for alias in grid["collections"]:
+            build_model = built_with(STORE_DIR, alias)
+            if build_model != model_name:
+                print(f"  Bỏ qua ({alias}, {model_name}): collection được build bằng {build_model}")
+                continue
+            try:
+                collection = open_collection(client, resolve(STORE_DIR, alias), NUM_SHARDS)
+                res = collection.query(query_embeddings=embeddings, n_results=max_k,
+                                       include=["metadatas", "distances"])
+            except Exception as e:
+                print(f"  Bỏ qua ({alias}, {model_name}): {e}")
+                continue
+            retrieved = [
+                [{"person_id": pid, "distance": dist, **meta}
+                 for pid, dist, meta in zip(ids, dists, metas)]
+                for ids, dists, metas in zip(res["ids"], res["distances"], res["metadatas"])
+            ]
+            data[(alias, model_name)] = (texts, retrieved)
+    return data
+
+
+def _init_worker(data: Dict[tuple, Any]):
+    global _worker_data
+    _worker_data = data
+
+
+def score_cell(cell: Dict[str, Any]) -> Dict[str, Any]:
+    """Tính MAP@K, Precision@K trung bình cho một ô từ kết quả truy vấn đã có."""
+    texts, retrieved = _worker_data[(cell["collection"], cell["model"])]
+    ap_scores, precisions = [], []
+    for query, results in zip(texts, retrieved):
+        metrics = calculate_metrics(results[:cell["k"]], query, k=cell["k"],
+                                    method=cell["method"], threshold=cell["threshold"])
+        ap_scores.append(metrics["ap_at_k"])
+        precisions.append(metrics["precision_at_k"])
+    n = max(len(texts), 1)
+    return {**cell, "num_queries": len(texts),
+            "map_at_k": sum(ap_scores) / n, "precision_at_k": sum(precisions) / n}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chạy grid thí nghiệm đánh giá")
+    parser.add_argument("grid", nargs="?", type=Path, default=None, help="File JSON mô tả grid")
+    parser.add_argument("--workers", type=int, default=None, help="Số process (mặc định = số CPU)")
+    parser.add_argument("--output", type=Path, default=OUTPUT_FILE)
+    args = parser.parse_args()
+
+    grid = dict(DEFAULT_GRID)
+    if args.grid:
+        with args.grid.open("r", encoding="utf-8") as f:
+            grid.update(json.load(f))
+
+    queries = read_queries()
+    data = retrieve_all(grid, queries)
+    cells = [c for c in expand_cells(grid) if (c["collection"], c["model"]) in data]
+    print(f"Chấm điểm {len(cells)} ô trên {len(queries)} queries...")
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(data,)) as pool:
+        rows = list(pool.map(score_cell, cells))
+    rows.sort(key=lambda r: (r["map_at_k"], r["precision_at_k"]), reverse=True)
+
+    print(f"\n{'Collection':<20}{'Model':<24}{'K':>4}  {'Method':<10}{'Thresh':>7}{'MAP@K':>9}{'P@K':>9}")
+    for r in rows:
+        print(f"{r['collection']:<20}{r['model']:<24}{r['k']:>4}  {r['method']:<10}{r['threshold']:>7.2f}"
+              f"{r['map_at_k']:>9.4f}{r['precision_at_k']:>9.4f}")
+
+    with args.output.open("w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ["collection"])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"\nĐã lưu bảng so sánh vào: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
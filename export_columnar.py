@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Xuất kết quả đánh giá sang dạng cột (Parquet / Arrow)
+
+final_results.json lặp lại toàn bộ metadata hồ sơ cho mỗi lần hồ sơ xuất hiện trong kết quả.
+Bản xuất dạng cột tách thành 3 bảng, hồ sơ chỉ được tham chiếu qua person_id:
+
+    runs/<run_id>/queries.parquet   query_id, query_text, category, difficulty, target_person_id,
+                                    precision_at_5, ap_at_5, num_relevant
+    runs/<run_id>/hits.parquet      query_id, rank, person_id, distance, label
+    runs/<run_id>/resumes.parquet   person_id, title, skills, abilities, program (mỗi hồ sơ 1 dòng)
+
+Thống kê theo category / difficulty được tính trực tiếp trên bảng queries bằng group_by
+của pyarrow (vectorized), không cần duyệt lại từng entry.
+
+Ví dụ:
+    python export_columnar.py final_results.json          # Xuất một file kết quả
+    python export_columnar.py --summary runs/<run_id>     # In thống kê từ bảng đã xuất
+"""
+import argparse
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+BASE_DIR = Path(__file__).resolve().parent
+RUNS_DIR = BASE_DIR / "runs"
+RESUME_FIELDS = ["title", "skills", "abilities", "program"]
+
+
+def _require_pyarrow():
+    if not HAS_PYARROW:
+        raise ImportError("Cần cài pyarrow để xuất Parquet: pip install pyarrow")
+
+
+def build_tables(results: List[Dict[str, Any]]) -> Dict[str, "pa.Table"]:
+    """Tách danh sách result entry (như trong final_results.json) thành 3 bảng."""
+    _require_pyarrow()
+    queries = {c: [] for c in ["query_id", "query_text", "category", "difficulty", "target_person_id",
+                               "precision_at_5", "ap_at_5", "num_relevant"]}
+    hits = {c: [] for c in ["query_id", "rank", "person_id", "distance", "label"]}
+    resumes: Dict[str, Dict[str, Any]] = {}
+
+    for r in results:
+        for col in ("query_id", "query_text", "category", "difficulty", "target_person_id"):
+            queries[col].append(str(r.get(col, "")))
+        queries["precision_at_5"].append(float(r.get("precision_at_5", 0.0)))
+        queries["ap_at_5"].append(float(r.get("ap_at_5", 0.0)))
+        queries["num_relevant"].append(int(r.get("num_relevant", 0)))
+
+        labels = r.get("relevance_labels") or []
+        for rank, sr in enumerate(r.get("search_results", []), 1):
+            person_id = str(sr.get("person_id"))
+            hits["query_id"].append(str(r.get("query_id", "")))
+            hits["rank"].append(rank)
+            hits["person_id"].append(person_id)
+            hits["distance"].append(sr.get("distance"))
+            hits["label"].append(labels[rank - 1] if rank - 1 < len(labels) else None)
+            if person_id not in resumes:
+                resumes[person_id] = {f: sr.get(f, "") for f in RESUME_FIELDS}
+
+    return {
+        "queries": pa.table(queries, schema=pa.schema([
+            ("query_id", pa.string()), ("query_text", pa.string()), ("category", pa.string()),
+            ("difficulty", pa.string()), ("target_person_id", pa.string()),
+            ("precision_at_5", pa.float64()), ("ap_at_5", pa.float64()), ("num_relevant", pa.int32()),
+        ])),
+        "hits": pa.table(hits, schema=pa.schema([
+            ("query_id", pa.string()), ("rank", pa.int16()), ("person_id", pa.string()),
+            ("distance", pa.float32()), ("label", pa.int8()),
+        ])),
+        "resumes": pa.table({
+            "person_id": list(resumes.keys()),
+            **{f: [v[f] for v in resumes.values()] for f in RESUME_FIELDS},
+        }),
+    }
+
+
+def export_run(results: List[Dict[str, Any]], out_root: Path = RUNS_DIR, run_id: str = None) -> Path:
+    """Ghi 3 bảng Parquet (nén zstd) vào out_root/<run_id>/ và trả về thư mục đó."""
+    tables = build_tables(results)
+    run_dir = out_root / (run_id or datetime.now().strftime("%Y%m%d_%H%M%S"))
+    run_dir.mkdir(parents=True, exist_ok=True)
+    for name, table in tables.items():
+        pq.write_table(table, run_dir / f"{name}.parquet", compression="zstd")
+    return run_dir
+
+
+def load_run(run_dir: Path) -> Dict[str, "pa.Table"]:
+    _require_pyarrow()
+    return {name: pq.read_table(run_dir / f"{name}.parquet") for name in ("queries", "hits", "resumes")}
+
+
+def group_summary(queries: "pa.Table", key: str) -> "pa.Table":
+    """
+    Thống kê theo `key` ("category" hoặc "difficulty"): số query, Precision@5 trung bình/min/max,
+    số query perfect, AP@5 trung bình — tất cả trong một lần group_by.
+    """
+    perfect = pc.cast(pc.equal(queries["precision_at_5"], 1.0), pa.int32())
+    table = queries.append_column("perfect", perfect)
+    summary = table.group_by(key).aggregate([
+        ("query_id", "count"),
+        ("precision_at_5", "mean"),
+        ("precision_at_5", "min"),
+        ("precision_at_5", "max"),
+        ("perfect", "sum"),
+        ("ap_at_5", "mean"),
+    ])
+    return summary.sort_by(key)
+
+
+def print_summary(tables: Dict[str, "pa.Table"]):
+    queries = tables["queries"]
+    total = queries.num_rows
+    print(f"Tổng số queries: {total}")
+    if total:
+        print(f"Precision@5 trung bình: {pc.mean(queries['precision_at_5']).as_py():.4f}")
+        print(f"MAP@5: {pc.mean(queries['ap_at_5']).as_py():.4f}")
+    print(f"Số hits: {tables['hits'].num_rows} | Số hồ sơ khác nhau: {tables['resumes'].num_rows}")
+    for key in ("category", "difficulty"):
+        print(f"\nTHỐNG KÊ THEO {key.upper()}")
+        for row in group_summary(queries, key).to_pylist():
+            print(f"  {row[key]} (n={row['query_id_count']}): "
+                  f"Precision@5 {row['precision_at_5_mean']:.4f} "
+                  f"(min: {row['precision_at_5_min']:.4f}, max: {row['precision_at_5_max']:.4f}, "
+                  f"perfect: {row['perfect_sum']}) | AP@5 {row['ap_at_5_mean']:.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Xuất kết quả đánh giá sang Parquet")
+    parser.add_argument("source", nargs="?", type=Path, default=BASE_DIR / "final_results.json",
+                        help="final_results.json, progress_final_data.json, hoặc thư mục run (với --summary)")
+    parser.add_argument("--summary", action="store_true", help="Chỉ đọc bảng đã xuất và in thống kê")
+    parser.add_argument("--run-id", default=None)
+    args = parser.parse_args()
+
+    if args.summary:
+        print_summary(load_run(args.source))
+        return
+
+    with args.source.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    results = data["results"] if isinstance(data, dict) else data  # progress file hoặc final results
+    run_dir = export_run(results, run_id=args.run_id)
+    source_size = args.source.stat().st_size
+    export_size = sum(p.stat().st_size for p in run_dir.glob("*.parquet"))
+    print(f"Đã xuất {len(results)} queries vào: {run_dir}")
+    print(f"Kích thước: {source_size / 1024:.0f} KB (JSON) → {export_size / 1024:.0f} KB (Parquet)\n")
+    print_summary(load_run(run_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,11 +10,25 @@ Chức năng:
 """
 import csv
 import json
-import re
 from pathlib import Path
-from typing import List, Dict, Any, Optional
-from sentence_transformers import SentenceTransformer
+from typing import List, Dict, Any, Optional, Tuple
 import chromadb
+from encoders import get_encoder
+from metrics import (  # noqa: F401 - giữ các tên cũ import được từ final_data
+    extract_keywords, calculate_relevance_score, get_relevance_labels,
+    precision_at_k, average_precision_at_k, percentile, calculate_metrics,
+)
+from instrumentation import Tracer
+from sharding import ShardedCollection
+from partitioned_index import PartitionedCollection
+from chunking import query_people, CHUNK_COLLECTION_NAME
+from collection_alias import resolve as resolve_alias, collection_version, manifest_path
+from query_cache import QueryResultCache
+from semantic_cache import SemanticQueryCache
+from export_columnar import export_run, HAS_PYARROW, RUNS_DIR
+from prefetch import Prefetcher
+from qrels import JudgmentStore, QRELS_FILE
+from aggregator import MetricAggregator, TEST_THRESHOLDS
 
 # ============================================================================
 # CẤU HÌNH
@@ -28,7 +42,12 @@ PROGRESS_FILE = BASE_DIR / "progress_final_data.json"       # File lưu tiến t
 RESULTS_FILE = BASE_DIR / "final_results.json"              # File kết quả cuối cùng
 SEARCH_RESULTS_FILE = BASE_DIR / "search_results_data.json" # File lưu kết quả tìm kiếm
 
-COLLECTION_NAME = "qa_collection"  # Tên collection trong ChromaDB
+STORE_DIR = BASE_DIR / "chromadb_store"
+CHUNKED_SEARCH = False  # True: tìm trên các chunk hồ sơ (populate với CHUNKING_ENABLED), gộp về từng hồ sơ
+COLLECTION_NAME = CHUNK_COLLECTION_NAME if CHUNKED_SEARCH else "qa_collection"  # Alias trong ChromaDB, xem collection_alias.py
+NUM_SHARDS = 1  # > 1: tìm song song trên N shard (phải giống populate_chromadb.py)
+IVF_ENABLED = False  # True: chỉ tìm trong IVF_NPROBE phân vùng gần query nhất (xem partitioned_index.py)
+IVF_NPROBE = 4
 
 # Cấu hình
 BATCH_SIZE = 20  # Xử lý 20 queries mỗi lần chạy
@@ -37,40 +56,177 @@ EVALUATION_METHOD = "distance"  # Cách đánh giá: "distance" hoặc "relevanc
 DISTANCE_THRESHOLD = 0.8  # Nếu distance < 0.8 thì coi là phù hợp
 RELEVANCE_THRESHOLD = 0.5  # Nếu relevance score >= 0.5 thì coi là phù hợp
 
+# Backend encoder (xem encoders.py): "torch", "onnx" hoặc "onnx-int8"
+# Cả 3 đều cho embedding tương thích với collection build bằng all-MiniLM-L6-v2
+ENCODER_BACKEND = "torch"
+
+# Re-rank giai đoạn 2 bằng cross-encoder (tùy chọn, xem rerank.py)
+RERANK_ENABLED = False  # True: lấy top-N rồi re-rank bằng cross-encoder
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_TOP_N = 50  # Số ứng viên tối đa lấy từ ChromaDB để re-rank
+RERANK_LATENCY_BUDGET_MS = 200  # Ngân sách độ trễ cho bước re-rank mỗi query
+
+# Cache kết quả tìm kiếm theo query (xem query_cache.py)
+QUERY_CACHE_ENABLED = False  # True: query giống hệt (sau chuẩn hóa) không phải tìm lại
+QUERY_CACHE_SIZE = 1024  # Số query tối đa trong cache (LRU)
+QUERY_CACHE_FILE = None  # Ví dụ BASE_DIR / "query_cache.json" để giữ cache giữa các lần chạy
+
+# Cache ngữ nghĩa cho query gần trùng (paraphrase), xem semantic_cache.py
+SEMANTIC_CACHE_ENABLED = False  # True: query có embedding gần query đã tìm → dùng lại kết quả
+SEMANTIC_CACHE_SIZE = 512  # Số query gần đây được giữ lại
+SEMANTIC_CACHE_RADIUS = 0.05  # Cosine distance tối đa (0.05 ≈ cosine >= 0.95)
+
+# Kho nhãn đánh giá theo cặp (query_id, person_id), dùng lại giữa các lần chạy (xem qrels.py)
+QRELS_ENABLED = False  # True: đánh giá từng kết quả, chỉ hỏi các cặp chưa có nhãn (qrels.sqlite3); False: nhập số kết quả đúng như cũ
+
+# Tìm trước các query kế tiếp trong lúc người dùng đang đánh giá (xem prefetch.py)
+PREFETCH_ENABLED = True
+PREFETCH_DEPTH = 3  # Số query được tìm trước
+
+# Xuất kết quả dạng cột (Parquet) khi hoàn thành, xem export_columnar.py (cần pyarrow)
+COLUMNAR_EXPORT = True
+
+# Đo thời gian theo giai đoạn (xem instrumentation.py)
+TRACE_ENABLED = False  # True: đo thời gian từng stage, xuất file vào TRACE_DIR
+TRACE_PROFILE = False  # True: bật thêm cProfile (file .prof)
+TRACE_MEMORY = False   # True: bật thêm tracemalloc (peak memory)
+TRACE_DIR = BASE_DIR / "traces"
+
 # Kết nối ChromaDB và khởi tạo model
-client = chromadb.PersistentClient(path=str(BASE_DIR / "chromadb_store"))
-collection = client.get_or_create_collection(name=COLLECTION_NAME)
-model = SentenceTransformer('all-MiniLM-L6-v2')  # Model để chuyển text thành vector
+client = chromadb.PersistentClient(path=str(STORE_DIR))
+
+
+def open_collection(name: str):
+    """Mở collection theo tên thật (đã resolve alias)."""
+    if IVF_ENABLED:
+        # Index phân vùng build từ collection này bằng partitioned_index.py build; nếu dữ liệu
+        # của alias đã đổi (phiên bản mới hoặc thêm records) thì index cũ bị bỏ qua
+        partitioned = PartitionedCollection.open(client, nprobe=IVF_NPROBE)
+        built_from = partitioned.meta.get("collection_version")
+        current = collection_version(STORE_DIR, COLLECTION_NAME)
+        if built_from == current:
+            return partitioned
+        partitioned.close()
+        print(f"⚠️  Index phân vùng được build từ {built_from}, dữ liệu hiện tại là {current} "
+              f"→ tìm trên {name} (chạy lại partitioned_index.py build)")
+    if NUM_SHARDS > 1:
+        # Scatter-gather trên các shard <name>_shard0..N-1 (xem sharding.py)
+        return ShardedCollection.open(STORE_DIR, name, NUM_SHARDS, client=client)
+    return client.get_or_create_collection(name=name)
+
+
+def _manifest_mtime() -> float:
+    path = manifest_path(STORE_DIR)
+    return path.stat().st_mtime if path.exists() else 0.0
+
+
+active_collection_name = resolve_alias(STORE_DIR, COLLECTION_NAME)
+active_collection_version = collection_version(STORE_DIR, COLLECTION_NAME)
+collection = open_collection(active_collection_name)
+_active_manifest_mtime = _manifest_mtime()
+
+query_cache = QueryResultCache(QUERY_CACHE_SIZE, QUERY_CACHE_FILE) if QUERY_CACHE_ENABLED else None
+if query_cache:
+    query_cache.load(active_collection_version)
+semantic_cache = SemanticQueryCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_RADIUS) if SEMANTIC_CACHE_ENABLED else None
+model = get_encoder(ENCODER_BACKEND, 'all-MiniLM-L6-v2')  # Model để chuyển text thành vector
+tracer = Tracer(enabled=TRACE_ENABLED, profile=TRACE_PROFILE, trace_memory=TRACE_MEMORY)
 
 
 # ============================================================================
 # HÀM TÌM KIẾM
 # ============================================================================
 
+def refresh_collection() -> bool:
+    """
+    Chuyển sang phiên bản collection mới nếu populate_chromadb.py vừa đổi alias.
+    Chỉ tốn một lần stat() manifest cho mỗi query khi không có thay đổi.
+    
+    Returns:
+        True nếu đã chuyển sang phiên bản khác
+    """
+    global collection, active_collection_name, active_collection_version, _active_manifest_mtime
+    mtime = _manifest_mtime()
+    if mtime == _active_manifest_mtime:
+        return False
+    _active_manifest_mtime = mtime
+    active_collection_version = collection_version(STORE_DIR, COLLECTION_NAME)
+    if query_cache:
+        # Dữ liệu đã đổi → bỏ các kết quả cache của phiên bản cũ
+        query_cache.invalidate(active_collection_version)
+    if semantic_cache:
+        semantic_cache.invalidate(active_collection_version)
+    name = resolve_alias(STORE_DIR, COLLECTION_NAME)
+    if name == active_collection_name and not IVF_ENABLED:
+        return False  # Với IVF, thêm records cũng làm index phân vùng cũ → mở lại để kiểm tra
+    old_collection = collection
+    collection = open_collection(name)
+    active_collection_name = name
+    if hasattr(old_collection, "close"):
+        old_collection.close()  # ShardedCollection / PartitionedCollection: dừng thread pool của bản cũ
+    print(f"\n🔄 Đã chuyển sang collection mới: {name}")
+    return True
+
+
 def search_top5(query: str) -> List[Dict[str, Any]]:
     """
     Tìm kiếm top 5 hồ sơ phù hợp nhất với query.
     
+    Xem search_top_k() để biết chi tiết các bước.
+    Nếu QUERY_CACHE_ENABLED, query đã tìm trên cùng phiên bản collection được lấy từ cache.
+    """
+    if query_cache is None:
+        return search_top_k(query, 5)
+    refresh_collection()  # Cập nhật phiên bản collection trước khi tra cache
+    cached = query_cache.get(query, 5, active_collection_version)
+    if cached is not None:
+        tracer.count("query_cache_hit")
+        return cached
+    results = search_top_k(query, 5)
+    query_cache.put(query, 5, active_collection_version, results)
+    return results
+
+
+def search_top_k(query: str, k: int) -> List[Dict[str, Any]]:
+    """
+    Tìm kiếm top k hồ sơ phù hợp nhất với query.
+    
     Cách hoạt động:
     1. Chuyển query thành vector (embedding) - vector này biểu diễn ngữ nghĩa của câu
     2. So sánh vector này với tất cả vector của hồ sơ trong database
-    3. Lấy 5 hồ sơ có distance nhỏ nhất (tức là giống nhất về mặt ngữ nghĩa)
+    3. Lấy k hồ sơ có distance nhỏ nhất (tức là giống nhất về mặt ngữ nghĩa)
     """
     # Bước 1: Chuyển query thành vector (embedding)
     # Model SentenceTransformer sẽ chuyển text thành một mảng số (vector)
     # Ví dụ: "Python developer" → [0.1, -0.3, 0.5, ...] (384 số)
     # Các câu có nghĩa giống nhau sẽ có vector gần giống nhau
-    q_emb = model.encode([query], convert_to_tensor=False)[0].tolist()
+    with tracer.stage("encode"):
+        q_emb = model.encode([query], convert_to_tensor=False)[0].tolist()
     
     # Bước 2: Tìm kiếm trong ChromaDB
+    # (Nếu alias vừa được đổi sang phiên bản mới thì dùng phiên bản mới)
+    refresh_collection()
+    
+    # Nếu bật cache ngữ nghĩa: query gần trùng với query đã tìm → dùng lại kết quả, bỏ qua ChromaDB
+    if semantic_cache:
+        cached = semantic_cache.lookup(q_emb, k, active_collection_version)
+        if cached is not None:
+            tracer.count("semantic_cache_hit")
+            return cached
+    
     # ChromaDB sẽ tính khoảng cách (distance) giữa vector query và tất cả vector hồ sơ
     # Distance càng nhỏ = càng giống nhau về mặt ngữ nghĩa
-    # Trả về 5 hồ sơ có distance nhỏ nhất (giống nhất)
-    results = collection.query(
-        query_embeddings=[q_emb],  # Vector của query để so sánh
-        n_results=5,               # Chỉ lấy 5 kết quả tốt nhất
-        include=["metadatas", "distances"],  # Cần metadata (thông tin hồ sơ) và distances (độ tương đồng)
-    )
+    # Trả về k hồ sơ có distance nhỏ nhất (giống nhất)
+    with tracer.stage("chroma_query"):
+        if CHUNKED_SEARCH:
+            # Lấy dư chunk rồi gộp về k hồ sơ khác nhau (chunk giống nhất của mỗi hồ sơ)
+            results = query_people(collection, [q_emb], k)
+        else:
+            results = collection.query(
+                query_embeddings=[q_emb],  # Vector của query để so sánh
+                n_results=k,               # Chỉ lấy k kết quả tốt nhất
+                include=["metadatas", "distances"],  # Cần metadata (thông tin hồ sơ) và distances (độ tương đồng)
+            )
     
     # Bước 3: Xử lý kết quả trả về từ ChromaDB
     # ChromaDB trả về dữ liệu dạng nested list, cần lấy phần tử đầu tiên
@@ -94,9 +250,38 @@ def search_top5(query: str) -> List[Dict[str, Any]]:
             "program": meta.get("program", ""),     # Bằng cấp/chương trình học
             "distance": distance,                   # Độ tương đồng: càng nhỏ càng giống query
         })
+    if semantic_cache:
+        semantic_cache.add(q_emb, k, active_collection_version, items)
     return items
 
 
+_reranker = None
+
+
+def get_reranker():
+    """Khởi tạo cross-encoder một lần, chỉ khi thật sự dùng đến re-rank."""
+    global _reranker
+    if _reranker is None:
+        from rerank import CrossEncoderReranker
+        _reranker = CrossEncoderReranker(
+            RERANK_MODEL,
+            top_n=RERANK_TOP_N,
+            latency_budget_ms=RERANK_LATENCY_BUDGET_MS,
+        )
+    return _reranker
+
+
+def search_reranked_top5(query: str) -> List[Dict[str, Any]]:
+    """
+    Tìm kiếm 2 giai đoạn: lấy top-N theo embedding, re-rank bằng cross-encoder,
+    trả về top 5. N tự thu nhỏ để giữ ngân sách RERANK_LATENCY_BUDGET_MS.
+    """
+    reranker = get_reranker()
+    candidates = search_top_k(query, reranker.candidate_count())
+    with tracer.stage("rerank"):
+        return reranker.rerank(query, candidates, k=5)
+
+
 # ============================================================================
 # HÀM ĐỌC/GHI FILE
 # ============================================================================
@@ -133,7 +318,7 @@ def load_progress() -> Dict[str, Any]:
 
 def save_progress(progress: Dict[str, Any]):
     """Lưu tiến trình vào file để có thể tiếp tục sau."""
-    with PROGRESS_FILE.open("w", encoding="utf-8") as f:
+    with tracer.stage("save_progress"), PROGRESS_FILE.open("w", encoding="utf-8") as f:
         json.dump(progress, f, ensure_ascii=False, indent=2)
 
 
@@ -153,7 +338,7 @@ def load_search_results() -> List[Dict[str, Any]]:
 
 def save_search_results(search_results_data: List[Dict[str, Any]]):
     """Lưu kết quả tìm kiếm vào file."""
-    with SEARCH_RESULTS_FILE.open("w", encoding="utf-8") as f:
+    with tracer.stage("save_search_results"), SEARCH_RESULTS_FILE.open("w", encoding="utf-8") as f:
         json.dump(search_results_data, f, ensure_ascii=False, indent=2)
 
 
@@ -261,281 +446,9 @@ def display_results(results: List[Dict[str, Any]], query_info: Dict[str, str], q
 
 
 # ============================================================================
-# HÀM XỬ LÝ TEXT VÀ TÍNH RELEVANCE
-# ============================================================================
-
-def extract_keywords(text: str) -> set:
-    """
-    Trích xuất từ khóa từ text, bỏ qua các từ không quan trọng.
-    
-    Ví dụ: "Looking for a Python developer" → {"looking", "python", "developer"}
-    """
-    # Tách text thành các từ
-    words = re.findall(r'\b\w+\b', text.lower())
-    
-    # Loại bỏ các từ không quan trọng (từ ngắn và từ thường gặp)
-    stop_words = {'the', 'for', 'and', 'with', 'in', 'on', 'at', 'to', 'a', 'an', 
-                  'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 
-                  'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 
-                  'may', 'might', 'must', 'can', 'of', 'from', 'by', 'as', 'or', 
-                  'but', 'not', 'this', 'that', 'these', 'those'}
-    
-    # Chỉ giữ lại từ có ý nghĩa (dài hơn 2 ký tự và không phải stop word)
-    keywords = {w for w in words if len(w) >= 3 and w not in stop_words}
-    return keywords
-
-
-def calculate_relevance_score(query: str, result: Dict[str, Any]) -> float:
-    """
-    Tính điểm phù hợp (0-1) của một kết quả với query.
-    
-    Điểm được tính từ 4 yếu tố:
-    - 40%: Độ tương đồng ngữ nghĩa (distance) - đánh giá bằng embedding
-    - 20%: Từ khóa khớp trong chức danh (title)
-    - 25%: Từ khóa khớp trong kỹ năng (skills) - quan trọng nhất
-    - 15%: Từ khóa khớp trong khả năng (abilities)
-    
-    Ví dụ: Query "Python developer" với hồ sơ có skills "Python, Django"
-    → Skills match cao → điểm relevance cao
-    """
-    score = 0.0
-    
-    # Phần 1: Điểm từ độ tương đồng ngữ nghĩa (40%)
-    # Distance là khoảng cách giữa vector query và vector hồ sơ
-    # Distance thường trong khoảng 0-2:
-    #   - 0 = giống hoàn toàn
-    #   - 2 = khác biệt hoàn toàn
-    distance = result.get('distance')
-    if distance is not None:
-        # Chuyển distance (0-2) thành điểm (1-0)
-        # distance = 0 → score = 1 (giống hoàn toàn)
-        # distance = 1 → score = 0.5 (giống một nửa)
-        # distance = 2 → score = 0 (khác biệt hoàn toàn)
-        distance_score = max(0, 1 - (distance / 2.0))
-        score += distance_score * 0.4  # Chiếm 40% tổng điểm
-    
-    # Phần 2-4: Điểm từ từ khóa khớp (60% còn lại)
-    # Trích xuất từ khóa từ query (bỏ qua các từ không quan trọng như "the", "a", "for")
-    query_keywords = extract_keywords(query)
-    # Ví dụ: "Looking for a Python developer" → {"looking", "python", "developer"}
-    
-    # So khớp trong chức danh (20%)
-    # Ví dụ: Query có "developer" và hồ sơ có title "Senior Developer" → khớp
-    title = result.get('title', '').lower()
-    title_keywords = extract_keywords(title)
-    # Tính tỷ lệ: số từ khóa chung / tổng số từ khóa trong query
-    # Ví dụ: query có 3 từ khóa, title có 1 từ khóa chung → match = 1/3 = 0.33
-    title_match = len(query_keywords & title_keywords) / max(len(query_keywords), 1)
-    score += title_match * 0.2
-    
-    # So khớp trong kỹ năng (25% - quan trọng nhất)
-    # Ví dụ: Query có "Python" và hồ sơ có skills "Python, Django, SQL" → khớp
-    skills = result.get('skills', '').lower()
-    skills_keywords = extract_keywords(skills)
-    skills_match = len(query_keywords & skills_keywords) / max(len(query_keywords), 1)
-    score += skills_match * 0.25  # Chiếm 25% - quan trọng nhất vì skills là yêu cầu chính
-    
-    # So khớp trong khả năng (15%)
-    # Ví dụ: Query có "leadership" và hồ sơ có abilities "leadership, communication" → khớp
-    abilities = result.get('abilities', '').lower()
-    abilities_keywords = extract_keywords(abilities)
-    abilities_match = len(query_keywords & abilities_keywords) / max(len(query_keywords), 1)
-    score += abilities_match * 0.15
-    
-    # Đảm bảo điểm không vượt quá 1.0 (tối đa 100%)
-    return min(1.0, score)
-
-
-# ============================================================================
-# HÀM TÍNH METRICS ĐÁNH GIÁ
+# HÀM ĐÁNH GIÁ
 # ============================================================================
-
-def get_relevance_labels(results: List[Dict[str, Any]], query: str, 
-                         method: str = "distance", threshold: float = 0.8) -> List[int]:
-    """
-    Xác định kết quả nào phù hợp (1) và không phù hợp (0).
-    
-    Có 2 phương pháp đánh giá:
-    
-    1. "distance" (mặc định):
-       - Chỉ dựa vào độ tương đồng ngữ nghĩa (embedding)
-       - Nếu distance < threshold → phù hợp (1)
-       - Ví dụ: threshold = 0.8, distance = 0.6 → phù hợp (0.6 < 0.8)
-       - Ưu điểm: Nhanh, đơn giản
-       - Nhược điểm: Có thể bỏ sót kết quả phù hợp về từ khóa nhưng khác về ngữ nghĩa
-    
-    2. "relevance":
-       - Kết hợp distance (40%) + keyword matching (60%)
-       - Nếu relevance score >= threshold → phù hợp (1)
-       - Ví dụ: threshold = 0.5, score = 0.7 → phù hợp (0.7 >= 0.5)
-       - Ưu điểm: Chính xác hơn, xem xét cả từ khóa
-       - Nhược điểm: Chậm hơn vì phải tính relevance score
-    
-    Returns:
-        List nhãn binary [0, 1, 0, 1, ...] tương ứng với từng kết quả
-        - 1 = phù hợp (relevant)
-        - 0 = không phù hợp (non-relevant)
-    """
-    labels = []
-    
-    # Duyệt qua từng kết quả tìm kiếm
-    for result in results:
-        is_relevant = False
-        
-        if method == "distance":
-            # Phương pháp 1: Chỉ dùng distance
-            # Distance là khoảng cách giữa vector query và vector hồ sơ
-            # Distance càng nhỏ = càng giống nhau về mặt ngữ nghĩa = càng phù hợp
-            distance = result.get('distance')
-            if distance is not None:
-                # Nếu distance nhỏ hơn ngưỡng → kết quả này phù hợp
-                # Ví dụ: threshold = 0.8, distance = 0.6 → 0.6 < 0.8 → phù hợp
-                is_relevant = distance < threshold
-                
-        elif method == "relevance":
-            # Phương pháp 2: Dùng relevance score (kết hợp distance + keywords)
-            # Relevance score được tính từ:
-            # - 40% distance (độ tương đồng ngữ nghĩa)
-            # - 60% keyword matching (từ khóa khớp trong title, skills, abilities)
-            score = calculate_relevance_score(query, result)
-            # Nếu score lớn hơn hoặc bằng ngưỡng → kết quả này phù hợp
-            # Ví dụ: threshold = 0.5, score = 0.7 → 0.7 >= 0.5 → phù hợp
-            is_relevant = score >= threshold
-        
-        # Chuyển đổi thành nhãn binary: 1 = phù hợp, 0 = không phù hợp
-        labels.append(1 if is_relevant else 0)
-    
-    return labels
-
-
-def precision_at_k(relevance_labels: List[int], k: int) -> float:
-    """
-    Tính Precision@K - Tỷ lệ kết quả phù hợp trong top K.
-    
-    Công thức: Precision@K = (Số kết quả phù hợp trong top K) / K
-    
-    Ví dụ: 
-    - labels = [1, 1, 0, 1, 0] (5 kết quả, 3 phù hợp)
-    - Precision@5 = 3/5 = 0.6 (60% kết quả phù hợp)
-    - Precision@5 = 1.0 nghĩa là tất cả 5 kết quả đều phù hợp (hoàn hảo)
-    
-    Precision@K càng cao → hệ thống càng chính xác
-    """
-    if k == 0:
-        return 0.0
-    
-    # Lấy k nhãn đầu tiên (top K kết quả)
-    top_k_labels = relevance_labels[:k]
-    if not top_k_labels:
-        return 0.0
-    
-    # Đếm số kết quả phù hợp (nhãn = 1)
-    # Ví dụ: [1, 1, 0, 1, 0] → sum = 3
-    relevant_count = sum(top_k_labels)
-    
-    # Tính tỷ lệ: số phù hợp / tổng số kết quả
-    return relevant_count / len(top_k_labels)
-
-
-def average_precision_at_k(relevance_labels: List[int], k: int) -> float:
-    """
-    Tính AP@K (Average Precision@K) - Đánh giá chất lượng thứ tự sắp xếp.
-    
-    AP@K khác với Precision@K ở chỗ:
-    - Precision@K: Chỉ quan tâm có bao nhiêu kết quả phù hợp
-    - AP@K: Quan tâm cả vị trí của các kết quả phù hợp
-    
-    Nếu kết quả phù hợp được xếp ở vị trí cao (1, 2, 3) → AP@K cao
-    Nếu kết quả phù hợp bị xếp ở vị trí thấp (4, 5) → AP@K thấp
-    
-    Công thức: AP@K = (1/R) * Σ(P@i cho mỗi vị trí i có kết quả phù hợp)
-    R = tổng số kết quả phù hợp trong top K
-    
-    Ví dụ chi tiết với labels = [1, 1, 0, 1, 0]:
-    - Vị trí 1: phù hợp (1) → P@1 = 1/1 = 1.0 (có 1 phù hợp trong 1 kết quả đầu)
-    - Vị trí 2: phù hợp (1) → P@2 = 2/2 = 1.0 (có 2 phù hợp trong 2 kết quả đầu)
-    - Vị trí 3: không phù hợp (0) → bỏ qua
-    - Vị trí 4: phù hợp (1) → P@4 = 3/4 = 0.75 (có 3 phù hợp trong 4 kết quả đầu)
-    - Vị trí 5: không phù hợp (0) → bỏ qua
-    
-    AP@5 = (1.0 + 1.0 + 0.75) / 3 = 0.917
-    → Điểm cao vì các kết quả phù hợp được xếp ở vị trí cao
-    """
-    if k == 0:
-        return 0.0
-    
-    top_k_labels = relevance_labels[:k]
-    if not top_k_labels:
-        return 0.0
-    
-    # Đếm tổng số kết quả phù hợp trong top K
-    total_relevant = sum(top_k_labels)
-    if total_relevant == 0:
-        return 0.0  # Không có kết quả phù hợp nào → AP@K = 0
-    
-    # Tính precision tại mỗi vị trí có kết quả phù hợp
-    ap_sum = 0.0
-    relevant_found = 0  # Số lượng kết quả phù hợp đã tìm thấy từ đầu đến vị trí hiện tại
-    
-    # Duyệt qua từng vị trí trong top K
-    for i, label in enumerate(top_k_labels, 1):  # i bắt đầu từ 1 (vị trí 1, 2, 3, ...)
-        if label == 1:  # Nếu kết quả ở vị trí i là phù hợp
-            relevant_found += 1  # Tăng số lượng phù hợp đã tìm thấy
-            # Tính precision tại vị trí i
-            # Precision@i = số phù hợp từ đầu đến vị trí i / vị trí i
-            precision_at_i = relevant_found / i
-            ap_sum += precision_at_i  # Cộng dồn vào tổng
-    
-    # Trung bình: tổng precision / số lượng kết quả phù hợp
-    return ap_sum / total_relevant
-
-
-def calculate_metrics(results: List[Dict[str, Any]], query: str,
-                     k: int = 5, method: str = "distance", threshold: float = 0.8) -> Dict[str, float]:
-    """
-    Tính các chỉ số đánh giá: Precision@K và AP@K.
-    
-    Quy trình:
-    1. Xác định kết quả nào phù hợp (relevant) và không phù hợp (non-relevant)
-    2. Tính Precision@K: Tỷ lệ kết quả phù hợp trong top K
-    3. Tính AP@K: Đánh giá chất lượng thứ tự sắp xếp
-    
-    Args:
-        results: Danh sách 5 kết quả tìm kiếm
-        query: Câu truy vấn
-        k: Số kết quả đầu tiên (thường là 5)
-        method: "distance" hoặc "relevance"
-        threshold: Ngưỡng để xác định phù hợp
-    
-    Returns:
-        Dictionary chứa:
-        - precision_at_k: Precision@K (0.0 - 1.0)
-        - ap_at_k: Average Precision@K (0.0 - 1.0)
-        - relevance_labels: [0, 1, 0, 1, ...] - nhãn của từng kết quả
-        - num_relevant: Số lượng kết quả phù hợp (0-5)
-    """
-    # Bước 1: Xác định kết quả nào phù hợp
-    # Chuyển đổi mỗi kết quả thành nhãn binary: 1 = phù hợp, 0 = không phù hợp
-    # Ví dụ: [1, 1, 0, 1, 0] nghĩa là kết quả 1, 2, 4 phù hợp; kết quả 3, 5 không phù hợp
-    relevance_labels = get_relevance_labels(results, query, method, threshold)
-    
-    # Bước 2: Tính Precision@K
-    # Precision@K = số kết quả phù hợp / tổng số kết quả
-    # Ví dụ: [1, 1, 0, 1, 0] → 3 phù hợp / 5 tổng = 0.6
-    p_at_k = precision_at_k(relevance_labels, k)
-    
-    # Bước 3: Tính AP@K
-    # AP@K đánh giá chất lượng thứ tự: kết quả phù hợp ở vị trí cao → AP@K cao
-    # Ví dụ: [1, 1, 0, 1, 0] → AP@5 = 0.917 (các kết quả phù hợp ở vị trí 1, 2, 4)
-    ap_at_k = average_precision_at_k(relevance_labels, k)
-    
-    return {
-        'precision_at_k': p_at_k,              # Precision@K
-        'ap_at_k': ap_at_k,                    # Average Precision@K
-        'relevance_labels': relevance_labels,   # Nhãn binary [0, 1, 0, 1, ...]
-        'num_relevant': sum(relevance_labels)  # Số lượng kết quả phù hợp
-    }
-
+# (Các hàm tính relevance và metrics nằm trong metrics.py)
 
 def auto_evaluate_results(query: str, results: List[Dict[str, Any]], method: str = "combined", threshold: float = 0.5) -> int:
     """
@@ -666,10 +579,263 @@ def get_correct_count(query: str, results: List[Dict[str, Any]], auto_mode: bool
                 print("⚠️  Vui lòng nhập một số hợp lệ!")
 
 
+def judge_results(query_info: Dict[str, str], results: List[Dict[str, Any]], auto_labels: List[int],
+                  store: JudgmentStore, auto_mode: bool = False) -> Optional[List[int]]:
+    """
+    Đánh giá từng kết quả, dùng lại nhãn đã có trong kho qrels.
+    Chỉ hỏi người dùng về các cặp (query_id, person_id) chưa từng được đánh giá.
+    
+    Returns:
+        Nhãn 0/1 cho từng kết quả, hoặc None nếu người dùng muốn dừng
+    """
+    query_id = query_info["query_id"]
+    person_ids = [str(r.get("person_id")) for r in results]
+    known = store.lookup(query_id, person_ids)
+    unseen = [i for i, pid in enumerate(person_ids) if pid not in known]
+    
+    print("\n" + "="*80)
+    print("ĐÁNH GIÁ KẾT QUẢ")
+    print("="*80)
+    for i, pid in enumerate(person_ids):
+        if pid in known:
+            status = "✓ PHÙ HỢP" if known[pid] else "✗ Không phù hợp"
+            print(f"  [{i + 1}] Person ID: {pid} | {status} (đã đánh giá ở lần chạy trước)")
+    if not unseen:
+        print(f"✓ Đã có nhãn cho cả {len(person_ids)} kết quả, không cần đánh giá lại.")
+        return [known[pid] for pid in person_ids]
+    
+    positions = [i + 1 for i in unseen]
+    if auto_mode:
+        suggested = [i + 1 for i in unseen if i < len(auto_labels) and auto_labels[i]]
+        print(f"Cần đánh giá các vị trí: {positions} | Gợi ý tự động PHÙ HỢP: {suggested or 'không có'}")
+        print("Enter để chấp nhận gợi ý, hoặc nhập các vị trí PHÙ HỢP (ví dụ: 1 3), 0 = không có:")
+    else:
+        print("Một kết quả được coi là PHÙ HỢP nếu có kỹ năng, chức danh, bằng cấp phù hợp với query.")
+        print(f"Nhập các vị trí PHÙ HỢP trong {positions} (ví dụ: 1 3), 0 = không có:")
+    
+    while True:
+        answer = input(">>> ").strip()
+        if answer.lower() in ['exit', 'quit', 'q']:
+            return None  # Signal để dừng
+        if answer == "" and auto_mode:
+            new_labels = {person_ids[i]: int(i < len(auto_labels) and bool(auto_labels[i])) for i in unseen}
+            source = "auto_confirmed"
+            break
+        try:
+            chosen = {int(x) for x in answer.replace(",", " ").split()}
+        except ValueError:
+            print("⚠️  Vui lòng nhập các số vị trí hợp lệ!")
+            continue
+        if chosen == {0}:
+            chosen = set()
+        if not answer or not chosen <= set(positions):
+            print(f"⚠️  Vui lòng nhập các vị trí trong {positions} hoặc 0!")
+            continue
+        new_labels = {person_ids[i]: int(i + 1 in chosen) for i in unseen}
+        source = "manual"
+        break
+    
+    store.record(query_id, new_labels, source)
+    labels = {**known, **new_labels}
+    return [labels[pid] for pid in person_ids]
+
+
 # ============================================================================
 # HÀM CHÍNH XỬ LÝ QUERIES
 # ============================================================================
 
+def search_and_score(query_text: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Tìm top 5 và tính metrics cho một query (không in gì, không cần người dùng).
+    Được gọi trực tiếp hoặc chạy trước trên thread nền bởi Prefetcher.
+    """
+    # (Nếu RERANK_ENABLED: lấy top-N rồi re-rank bằng cross-encoder)
+    if RERANK_ENABLED:
+        search_results = search_reranked_top5(query_text)
+    else:
+        search_results = search_top5(query_text)
+    
+    if not search_results:
+        # Nếu không tìm thấy kết quả nào → metrics = 0
+        return search_results, {
+            'precision_at_k': 0.0,                    # Không có kết quả phù hợp
+            'ap_at_k': 0.0,                          # Không có kết quả phù hợp
+            'relevance_labels': [0, 0, 0, 0, 0],     # Tất cả đều không phù hợp
+            'num_relevant': 0                        # 0 kết quả phù hợp
+        }
+    
+    # Tính các metrics đánh giá
+    # - Precision@5: Tỷ lệ kết quả phù hợp trong top 5
+    # - AP@5: Đánh giá chất lượng thứ tự sắp xếp
+    threshold = DISTANCE_THRESHOLD if EVALUATION_METHOD == "distance" else RELEVANCE_THRESHOLD
+    with tracer.stage("scoring"):
+        metrics = calculate_metrics(
+            search_results,              # 5 kết quả tìm kiếm
+            query=query_text,            # Query để tính relevance score (nếu dùng method="relevance")
+            k=5,                        # Đánh giá top 5
+            method=EVALUATION_METHOD,    # Phương pháp đánh giá: "distance" hoặc "relevance"
+            threshold=threshold         # Ngưỡng để xác định phù hợp
+        )
+    return search_results, metrics
+
+
+def print_summary(agg: MetricAggregator):
+    """In báo cáo tổng kết trực tiếp từ bộ tổng hợp streaming (không duyệt lại results)."""
+    total = agg.total
+    if total == 0:
+        return
+    avg_precision_at_5 = agg.precision.mean
+    map_at_5 = agg.ap.mean
+    perfect_queries = agg.buckets["perfect"]
+    high_queries = agg.buckets["high"]
+    medium_queries = agg.buckets["medium"]
+    low_queries = agg.buckets["low"]
+    max_possible = total * 5  # Mỗi query có 5 kết quả
+    
+    print(f"\nTổng số queries đã xử lý: {total}")
+    print(f"\n{'='*80}")
+    print("METRICS TỔNG KẾT")
+    print(f"{'='*80}")
+    print(f"Precision@5 trung bình: {avg_precision_at_5:.4f}")
+    print(f"MAP@5 (Mean Average Precision@5): {map_at_5:.4f}")
+    
+    print(f"\n{'='*80}")
+    print("PHÂN TÍCH CHI TIẾT PRECISION@5")
+    print(f"{'='*80}")
+    print(f"Min: {agg.precision.min:.4f} | Max: {agg.precision.max:.4f} | Median: {agg.precision_median.value():.4f}")
+    print(f"\nPhân bố Precision@5:")
+    print(f"  Perfect (1.0000): {perfect_queries} queries ({perfect_queries/total*100:.1f}%)")
+    print(f"  High (0.80-0.99): {high_queries} queries ({high_queries/total*100:.1f}%)")
+    print(f"  Medium (0.50-0.79): {medium_queries} queries ({medium_queries/total*100:.1f}%)")
+    print(f"  Low (<0.50): {low_queries} queries ({low_queries/total*100:.1f}%)")
+    
+    print(f"\n{'='*80}")
+    print("PHÂN TÍCH CHI TIẾT AP@5")
+    print(f"{'='*80}")
+    print(f"Min: {agg.ap.min:.4f} | Max: {agg.ap.max:.4f} | Median: {agg.ap_median.value():.4f}")
+    
+    print(f"\n{'='*80}")
+    print("PHÂN TÍCH SỐ LƯỢNG RELEVANT RESULTS")
+    print(f"{'='*80}")
+    print(f"Tổng số kết quả relevant: {agg.total_relevant}/{max_possible}")
+    print(f"Tỷ lệ relevant: {agg.total_relevant/max_possible*100:.2f}%")
+    print(f"Số lượng relevant trung bình mỗi query: {agg.total_relevant/total:.2f}/5")
+    
+    num_distances = agg.distance.count
+    if num_distances:
+        median_distance = agg.distance_quantiles["0.5"].value()
+        print(f"\n{'='*80}")
+        print("PHÂN TÍCH DISTANCE")
+        print(f"{'='*80}")
+        print(f"Distance trung bình: {agg.distance.mean:.4f}")
+        print(f"Min: {agg.distance.min:.4f} | Max: {agg.distance.max:.4f} | Median: {median_distance:.4f}")
+        if EVALUATION_METHOD == "distance":
+            split = agg.below_threshold(DISTANCE_THRESHOLD)
+            print(f"\nVới threshold = {DISTANCE_THRESHOLD}:")
+            print(f"  Relevant: {split['relevant']} kết quả ({split['relevant']/num_distances*100:.1f}%)")
+            print(f"  Non-relevant: {split['non_relevant']} kết quả ({split['non_relevant']/num_distances*100:.1f}%)")
+            if split["relevant_mean"] is not None:
+                print(f"  Distance trung bình của relevant: {split['relevant_mean']:.4f}")
+            if split["non_relevant_mean"] is not None:
+                print(f"  Distance trung bình của non-relevant: {split['non_relevant_mean']:.4f}")
+    
+    # Top queries tốt nhất và xấu nhất (bộ tổng hợp giữ sẵn TOP 5 mỗi loại)
+    for heading, items in (("TOP 5 QUERIES TỐT NHẤT (theo Precision@5)", agg.best),
+                           ("TOP 5 QUERIES XẤU NHẤT (theo Precision@5)", agg.worst)):
+        print(f"\n{'='*80}")
+        print(heading)
+        print(f"{'='*80}")
+        for i, (neg_prec, neg_ap, _, r) in enumerate(items, 1):
+            print(f"{i}. Query ID: {r['query_id']} | Category: {r['category']} | Difficulty: {r['difficulty']}")
+            print(f"   Precision@5: {-neg_prec:.4f} | AP@5: {-neg_ap:.4f} | Relevant: {r.get('num_relevant', 0)}/5")
+            print(f"   Query: {r['query_text'][:80]}...")
+    
+    # Thống kê theo category / difficulty
+    for heading, groups in (("THỐNG KÊ THEO CATEGORY", agg.categories),
+                            ("THỐNG KÊ THEO DIFFICULTY", agg.difficulties)):
+        print(f"\n{'='*80}")
+        print(heading)
+        print(f"{'='*80}")
+        for name, stats in sorted(groups.items()):
+            avg_prec = stats["total_precision"] / stats["count"]
+            avg_ap = stats["total_ap"] / stats["count"]
+            print(f"  {name} (n={stats['count']}):")
+            print(f"    Precision@5: {avg_prec:.4f} (min: {stats['min_precision']:.4f}, "
+                  f"max: {stats['max_precision']:.4f}, perfect: {stats['perfect']})")
+            print(f"    AP@5: {avg_ap:.4f}")
+    
+    # Phân tích và đề xuất threshold
+    if EVALUATION_METHOD == "distance" and num_distances:
+        print(f"\n{'='*80}")
+        print("PHÂN TÍCH VÀ ĐỀ XUẤT THRESHOLD")
+        print(f"{'='*80}")
+        print(f"Threshold hiện tại: {DISTANCE_THRESHOLD}")
+        print(f"\nPhân tích với các threshold khác nhau:")
+        for thresh in TEST_THRESHOLDS:
+            relevant_count = agg.below_threshold(thresh)["relevant"]
+            relevant_pct = relevant_count / num_distances * 100
+            print(f"  Threshold {thresh:.2f}: {relevant_count}/{num_distances} relevant ({relevant_pct:.1f}%)")
+        
+        # Đề xuất threshold dựa trên phân vị (ước lượng P²)
+        if num_distances >= 10:
+            p25 = agg.distance_quantiles["0.25"].value()
+            p50 = median_distance
+            p75 = agg.distance_quantiles["0.75"].value()
+            print(f"\nPhân vị distance:")
+            print(f"  25th percentile (P25): {p25:.4f}")
+            print(f"  50th percentile (Median): {p50:.4f}")
+            print(f"  75th percentile (P75): {p75:.4f}")
+            print(f"\n💡 Đề xuất:")
+            print(f"  - Threshold chặt chẽ (P25): {p25:.4f} → {agg.fraction_below(p25) * 100:.1f}% relevant")
+            print(f"  - Threshold vừa phải (P50): {p50:.4f} → {agg.fraction_below(p50) * 100:.1f}% relevant")
+            print(f"  - Threshold lỏng (P75): {p75:.4f} → {agg.fraction_below(p75) * 100:.1f}% relevant")
+    
+    # Tóm tắt cuối cùng
+    print(f"\n{'='*80}")
+    print("TÓM TẮT ĐÁNH GIÁ")
+    print(f"{'='*80}")
+    print(f"📊 Tổng quan:")
+    print(f"   - Tổng số queries: {total}")
+    print(f"   - Precision@5 trung bình: {avg_precision_at_5:.4f} ({avg_precision_at_5*100:.2f}%)")
+    print(f"   - MAP@5: {map_at_5:.4f} ({map_at_5*100:.2f}%)")
+    print(f"   - Số queries đạt perfect (1.0): {perfect_queries}/{total} ({perfect_queries/total*100:.1f}%)")
+    print(f"   - Số queries có Precision@5 >= 0.8: {perfect_queries + high_queries}/{total} ({(perfect_queries + high_queries)/total*100:.1f}%)")
+    print(f"\n📈 Chất lượng:")
+    if avg_precision_at_5 >= 0.9:
+        print(f"   ✓ Hệ thống hoạt động RẤT TỐT (Precision@5 >= 90%)")
+    elif avg_precision_at_5 >= 0.8:
+        print(f"   ✓ Hệ thống hoạt động TỐT (Precision@5 >= 80%)")
+    elif avg_precision_at_5 >= 0.7:
+        print(f"   ⚠ Hệ thống hoạt động KHÁ (Precision@5 >= 70%)")
+    else:
+        print(f"   ⚠ Hệ thống cần CẢI THIỆN (Precision@5 < 70%)")
+    
+    if EVALUATION_METHOD == "distance":
+        print(f"\n⚙️  Cấu hình đánh giá:")
+        print(f"   - Phương pháp: Distance-based")
+        print(f"   - Threshold: {DISTANCE_THRESHOLD}")
+        print(f"   - Tiêu chí: distance < {DISTANCE_THRESHOLD} → relevant")
+    else:
+        print(f"\n⚙️  Cấu hình đánh giá:")
+        print(f"   - Phương pháp: Relevance score-based")
+        print(f"   - Threshold: {RELEVANCE_THRESHOLD}")
+        print(f"   - Tiêu chí: relevance score >= {RELEVANCE_THRESHOLD} → relevant")
+
+
+def _finish_batch(prefetcher: Optional[Prefetcher], judgment_store: Optional[JudgmentStore]):
+    """Dừng thread prefetch, đóng kho nhãn và in thống kê của batch."""
+    if prefetcher:
+        prefetcher.close()
+        stats = prefetcher.stats()
+        print(f"\nPrefetch: {stats['ready']}/{stats['ready'] + stats['waited']} queries có sẵn kết quả "
+              f"khi cần (chờ tổng cộng {stats['wait_seconds']:.2f}s)")
+    if judgment_store:
+        stats = judgment_store.stats()
+        judgment_store.close()
+        print(f"Qrels: dùng lại {stats['reused']} nhãn, thêm {stats['added']} nhãn mới "
+              f"(kho có {stats['judgments']} nhãn cho {stats['queries']} queries)")
+
+
 def process_queries():
     """
     Hàm chính xử lý tất cả queries.
@@ -690,6 +856,8 @@ def process_queries():
     start_index = progress["last_processed_index"]
     results = progress["results"]
     search_results_data = load_search_results()
+    # Bộ tổng hợp metrics lưu cùng progress (progress cũ chưa có thì dựng lại một lần)
+    aggregator = MetricAggregator.restore(progress.get("aggregate"), results, DISTANCE_THRESHOLD)
     
     print(f"\nTiếp tục từ query thứ {start_index + 1} (đã xử lý {len(results)} queries)")
     
@@ -700,6 +868,15 @@ def process_queries():
     print(f"Sẽ xử lý {len(queries_to_process)} queries (từ {start_index + 1} đến {end_index})")
     print(f"Bạn có thể nhập 'exit' hoặc 'quit' bất cứ lúc nào để dừng và lưu progress\n")
     
+    judgment_store = JudgmentStore(QRELS_FILE) if QRELS_ENABLED else None
+    
+    # Trong lúc người dùng đánh giá query hiện tại, thread nền tìm trước các query tiếp theo
+    prefetcher = None
+    if PREFETCH_ENABLED and PREFETCH_DEPTH > 0:
+        prefetcher = Prefetcher(tracer.profiled(search_and_score),  # TRACE_PROFILE: đo cả thread prefetch
+                                [q["query_text"] if q["query_text"].strip() else None for q in queries_to_process],
+                                PREFETCH_DEPTH)
+    
     # Xử lý từng query trong batch
     for idx, query_info in enumerate(queries_to_process, start=start_index):
         # Lấy nội dung query (câu truy vấn)
@@ -711,13 +888,18 @@ def process_queries():
             continue
         
         print(f"\n[{idx + 1}/{len(all_queries)}] Đang xử lý query...")
+        tracer.count("queries")
         
-        # Bước 1: Tìm kiếm top 5 hồ sơ phù hợp nhất
+        # Bước 1: Tìm kiếm top 5 hồ sơ phù hợp nhất và tính metrics
         # Hàm này sẽ:
         # - Chuyển query thành vector (embedding)
         # - So sánh với tất cả hồ sơ trong database
         # - Trả về 5 hồ sơ có distance nhỏ nhất (giống nhất)
-        search_results = search_top5(query_text)
+        # (Nếu có prefetch thì kết quả thường đã được tính sẵn trong lúc đánh giá query trước)
+        if prefetcher:
+            search_results, metrics = prefetcher.get(idx - start_index)
+        else:
+            search_results, metrics = search_and_score(query_text)
         
         # Bước 2: Lưu kết quả tìm kiếm vào file
         # Lưu để có thể đánh giá lại sau này hoặc phân tích
@@ -741,41 +923,23 @@ def process_queries():
             search_results_data.append(search_result_entry)
         save_search_results(search_results_data)
         
-        # Bước 3: Tính metrics đánh giá
+        # Bước 3: Hiển thị metrics đánh giá (đã tính ở bước 1)
+        judged_labels = None  # Nhãn theo từng kết quả (khi QRELS_ENABLED)
         if not search_results:
-            # Nếu không tìm thấy kết quả nào → metrics = 0
             print("Không tìm thấy kết quả nào!")
-            metrics = {
-                'precision_at_k': 0.0,                    # Không có kết quả phù hợp
-                'ap_at_k': 0.0,                          # Không có kết quả phù hợp
-                'relevance_labels': [0, 0, 0, 0, 0],     # Tất cả đều không phù hợp
-                'num_relevant': 0                        # 0 kết quả phù hợp
-            }
         else:
             # Hiển thị kết quả tìm kiếm cho người dùng xem
             # Hiển thị thông tin query và 5 kết quả với đánh giá phù hợp/không phù hợp
-            display_results(search_results, query_info, query_text)
+            with tracer.stage("display_results"):
+                display_results(search_results, query_info, query_text)
             
-            # Xác định threshold và method dựa trên cấu hình
+            # Mô tả tiêu chí dựa trên cấu hình
             if EVALUATION_METHOD == "distance":
                 # Dùng distance: distance < threshold → phù hợp
-                threshold = DISTANCE_THRESHOLD
-                method_desc = f"distance < {threshold}"
+                method_desc = f"distance < {DISTANCE_THRESHOLD}"
             else:
                 # Dùng relevance score: score >= threshold → phù hợp
-                threshold = RELEVANCE_THRESHOLD
-                method_desc = f"relevance score >= {threshold}"
-            
-            # Tính các metrics đánh giá
-            # - Precision@5: Tỷ lệ kết quả phù hợp trong top 5
-            # - AP@5: Đánh giá chất lượng thứ tự sắp xếp
-            metrics = calculate_metrics(
-                search_results,              # 5 kết quả tìm kiếm
-                query=query_text,            # Query để tính relevance score (nếu dùng method="relevance")
-                k=5,                        # Đánh giá top 5
-                method=EVALUATION_METHOD,    # Phương pháp đánh giá: "distance" hoặc "relevance"
-                threshold=threshold         # Ngưỡng để xác định phù hợp
-            )
+                method_desc = f"relevance score >= {RELEVANCE_THRESHOLD}"
             
             # Hiển thị metrics
             print("\n" + "="*80)
@@ -799,12 +963,22 @@ def process_queries():
                 print(f"   (Relevance score = distance 40% + keyword matching 60%)")
             
             # Đánh giá (tự động hoặc thủ công) - giữ lại để tương thích (không dùng cho metrics)
-            correct_count = get_correct_count(query_text, search_results, auto_mode=AUTO_EVALUATION)
+            # Nếu QRELS_ENABLED: đánh giá từng kết quả, cặp đã có nhãn được dùng lại không hỏi lại
+            # (Thời gian chờ người đánh giá được đo riêng trong stage "review")
+            with tracer.stage("review"):
+                if judgment_store:
+                    judged_labels = judge_results(query_info, search_results, metrics['relevance_labels'],
+                                                  judgment_store, auto_mode=AUTO_EVALUATION)
+                    correct_count = -1 if judged_labels is None else sum(judged_labels)
+                else:
+                    correct_count = get_correct_count(query_text, search_results, auto_mode=AUTO_EVALUATION)
             
             if correct_count == -1:
+                _finish_batch(prefetcher, judgment_store)  # Bỏ các query đã tìm trước nhưng chưa đánh giá
                 print("\nĐã dừng. Đang lưu progress...")
                 progress["last_processed_index"] = idx
                 progress["results"] = results
+                progress["aggregate"] = aggregator.to_dict()
                 save_progress(progress)
                 print(f"Đã lưu progress. Đã xử lý {len(results)} queries.")
                 print(f"Đã lưu kết quả tìm kiếm vào: {SEARCH_RESULTS_FILE}")
@@ -821,258 +995,41 @@ def process_queries():
             "ap_at_5": metrics['ap_at_k'],
             "relevance_labels": metrics['relevance_labels'],
             "num_relevant": metrics['num_relevant'],
+            "judged_labels": judged_labels,
             "search_results": search_results
         }
         results.append(result_entry)
+        aggregator.add(result_entry)
         
         # Lưu progress sau mỗi query
         progress["last_processed_index"] = idx + 1
         progress["results"] = results
+        progress["aggregate"] = aggregator.to_dict()
         save_progress(progress)
         
+        running = aggregator.summary()
         print(f"✓ Đã lưu. Precision@5: {metrics['precision_at_k']:.4f} ({metrics['num_relevant']}/5)")
+        print(f"✓ Tổng đến hiện tại ({running['queries']} queries): Precision@5 {running['precision_at_5']:.4f} | "
+              f"MAP@5 {running['map_at_5']:.4f} | perfect {running['perfect']}")
         print(f"✓ Đã lưu kết quả tìm kiếm vào file: {SEARCH_RESULTS_FILE.name}")
     
+    _finish_batch(prefetcher, judgment_store)
+    
     # Kiểm tra xem đã xử lý hết chưa
     if end_index >= len(all_queries):
         print("\n" + "="*80)
         print("ĐÃ XỬ LÝ HẾT TẤT CẢ QUERIES!")
         print("="*80)
         
-        # Tính thống kê tổng hợp
-        total = len(results)
-        if total > 0:
-            # Tính MAP@5 (trung bình AP@5 của tất cả queries)
-            ap_scores = [r.get("ap_at_5", 0.0) for r in results]
-            map_at_5 = sum(ap_scores) / total if total > 0 else 0.0
-            
-            # Tính Precision@5 trung bình
-            precision_scores = [r.get("precision_at_5", 0.0) for r in results]
-            avg_precision_at_5 = sum(precision_scores) / total if total > 0 else 0.0
-            
-            # Phân tích phân phối Precision@5
-            precision_sorted = sorted(precision_scores)
-            min_precision = min(precision_scores)
-            max_precision = max(precision_scores)
-            median_precision = precision_sorted[total // 2] if total > 0 else 0.0
-            
-            # Đếm số queries theo mức Precision@5
-            perfect_queries = sum(1 for p in precision_scores if p == 1.0)
-            high_queries = sum(1 for p in precision_scores if 0.8 <= p < 1.0)
-            medium_queries = sum(1 for p in precision_scores if 0.5 <= p < 0.8)
-            low_queries = sum(1 for p in precision_scores if p < 0.5)
-            
-            # Phân tích phân phối AP@5
-            ap_sorted = sorted(ap_scores)
-            min_ap = min(ap_scores)
-            max_ap = max(ap_scores)
-            median_ap = ap_sorted[total // 2] if total > 0 else 0.0
-            
-            # Phân tích số lượng relevant results
-            all_num_relevant = [r.get("num_relevant", 0) for r in results]
-            avg_relevant = sum(all_num_relevant) / total if total > 0 else 0.0
-            total_relevant_all = sum(all_num_relevant)
-            max_possible = total * 5  # Mỗi query có 5 kết quả
-            
-            # Phân tích distance (nếu có)
-            all_distances = []
-            for r in results:
-                for sr in r.get("search_results", []):
-                    dist = sr.get("distance")
-                    if dist is not None:
-                        all_distances.append(dist)
-            
-            print(f"\nTổng số queries đã xử lý: {total}")
-            print(f"\n{'='*80}")
-            print("METRICS TỔNG KẾT")
-            print(f"{'='*80}")
-            print(f"Precision@5 trung bình: {avg_precision_at_5:.4f}")
-            print(f"MAP@5 (Mean Average Precision@5): {map_at_5:.4f}")
-            
-            print(f"\n{'='*80}")
-            print("PHÂN TÍCH CHI TIẾT PRECISION@5")
-            print(f"{'='*80}")
-            print(f"Min: {min_precision:.4f} | Max: {max_precision:.4f} | Median: {median_precision:.4f}")
-            print(f"\nPhân bố Precision@5:")
-            print(f"  Perfect (1.0000): {perfect_queries} queries ({perfect_queries/total*100:.1f}%)")
-            print(f"  High (0.80-0.99): {high_queries} queries ({high_queries/total*100:.1f}%)")
-            print(f"  Medium (0.50-0.79): {medium_queries} queries ({medium_queries/total*100:.1f}%)")
-            print(f"  Low (<0.50): {low_queries} queries ({low_queries/total*100:.1f}%)")
-            
-            print(f"\n{'='*80}")
-            print("PHÂN TÍCH CHI TIẾT AP@5")
-            print(f"{'='*80}")
-            print(f"Min: {min_ap:.4f} | Max: {max_ap:.4f} | Median: {median_ap:.4f}")
-            
-            print(f"\n{'='*80}")
-            print("PHÂN TÍCH SỐ LƯỢNG RELEVANT RESULTS")
-            print(f"{'='*80}")
-            print(f"Tổng số kết quả relevant: {total_relevant_all}/{max_possible}")
-            print(f"Tỷ lệ relevant: {total_relevant_all/max_possible*100:.2f}%")
-            print(f"Số lượng relevant trung bình mỗi query: {avg_relevant:.2f}/5")
-            
-            if all_distances:
-                avg_distance = sum(all_distances) / len(all_distances)
-                min_distance = min(all_distances)
-                max_distance = max(all_distances)
-                distance_sorted = sorted(all_distances)
-                median_distance = distance_sorted[len(distance_sorted) // 2]
-                
-                print(f"\n{'='*80}")
-                print("PHÂN TÍCH DISTANCE")
-                print(f"{'='*80}")
-                print(f"Distance trung bình: {avg_distance:.4f}")
-                print(f"Min: {min_distance:.4f} | Max: {max_distance:.4f} | Median: {median_distance:.4f}")
-                if EVALUATION_METHOD == "distance":
-                    relevant_distances = [d for d in all_distances if d < DISTANCE_THRESHOLD]
-                    non_relevant_distances = [d for d in all_distances if d >= DISTANCE_THRESHOLD]
-                    print(f"\nVới threshold = {DISTANCE_THRESHOLD}:")
-                    print(f"  Relevant: {len(relevant_distances)} kết quả ({len(relevant_distances)/len(all_distances)*100:.1f}%)")
-                    print(f"  Non-relevant: {len(non_relevant_distances)} kết quả ({len(non_relevant_distances)/len(all_distances)*100:.1f}%)")
-                    if relevant_distances:
-                        print(f"  Distance trung bình của relevant: {sum(relevant_distances)/len(relevant_distances):.4f}")
-                    if non_relevant_distances:
-                        print(f"  Distance trung bình của non-relevant: {sum(non_relevant_distances)/len(non_relevant_distances):.4f}")
-            
-            # Thống kê theo category
-            category_stats = {}
-            for r in results:
-                cat = r["category"]
-                if cat not in category_stats:
-                    category_stats[cat] = {
-                        "count": 0, 
-                        "total_precision": 0,
-                        "total_ap": 0
-                    }
-                category_stats[cat]["count"] += 1
-                category_stats[cat]["total_precision"] += r.get("precision_at_5", 0.0)
-                category_stats[cat]["total_ap"] += r.get("ap_at_5", 0.0)
-            
-            # Top queries tốt nhất và xấu nhất
-            results_with_scores = [(r, r.get("precision_at_5", 0.0), r.get("ap_at_5", 0.0)) for r in results]
-            results_with_scores.sort(key=lambda x: (x[1], x[2]), reverse=True)
-            
-            print(f"\n{'='*80}")
-            print("TOP 5 QUERIES TỐT NHẤT (theo Precision@5)")
-            print(f"{'='*80}")
-            for i, (r, prec, ap) in enumerate(results_with_scores[:5], 1):
-                print(f"{i}. Query ID: {r['query_id']} | Category: {r['category']} | Difficulty: {r['difficulty']}")
-                print(f"   Precision@5: {prec:.4f} | AP@5: {ap:.4f} | Relevant: {r.get('num_relevant', 0)}/5")
-                print(f"   Query: {r['query_text'][:80]}...")
-            
-            print(f"\n{'='*80}")
-            print("TOP 5 QUERIES XẤU NHẤT (theo Precision@5)")
-            print(f"{'='*80}")
-            for i, (r, prec, ap) in enumerate(results_with_scores[-5:], 1):
-                print(f"{i}. Query ID: {r['query_id']} | Category: {r['category']} | Difficulty: {r['difficulty']}")
-                print(f"   Precision@5: {prec:.4f} | AP@5: {ap:.4f} | Relevant: {r.get('num_relevant', 0)}/5")
-                print(f"   Query: {r['query_text'][:80]}...")
-            
-            print(f"\n{'='*80}")
-            print("THỐNG KÊ THEO CATEGORY")
-            print(f"{'='*80}")
-            for cat, stats in sorted(category_stats.items()):
-                avg_prec = stats["total_precision"] / stats["count"]
-                avg_ap = stats["total_ap"] / stats["count"]
-                # Tính min, max cho category này
-                cat_precisions = [r.get("precision_at_5", 0.0) for r in results if r["category"] == cat]
-                cat_min = min(cat_precisions) if cat_precisions else 0.0
-                cat_max = max(cat_precisions) if cat_precisions else 0.0
-                cat_perfect = sum(1 for p in cat_precisions if p == 1.0)
-                print(f"  {cat} (n={stats['count']}):")
-                print(f"    Precision@5: {avg_prec:.4f} (min: {cat_min:.4f}, max: {cat_max:.4f}, perfect: {cat_perfect})")
-                print(f"    AP@5: {avg_ap:.4f}")
-            
-            # Thống kê theo difficulty
-            difficulty_stats = {}
-            for r in results:
-                diff = r["difficulty"]
-                if diff not in difficulty_stats:
-                    difficulty_stats[diff] = {
-                        "count": 0, 
-                        "total_precision": 0,
-                        "total_ap": 0
-                    }
-                difficulty_stats[diff]["count"] += 1
-                difficulty_stats[diff]["total_precision"] += r.get("precision_at_5", 0.0)
-                difficulty_stats[diff]["total_ap"] += r.get("ap_at_5", 0.0)
-            
-            print(f"\n{'='*80}")
-            print("THỐNG KÊ THEO DIFFICULTY")
-            print(f"{'='*80}")
-            for diff, stats in sorted(difficulty_stats.items()):
-                avg_prec = stats["total_precision"] / stats["count"]
-                avg_ap = stats["total_ap"] / stats["count"]
-                # Tính min, max cho difficulty này
-                diff_precisions = [r.get("precision_at_5", 0.0) for r in results if r["difficulty"] == diff]
-                diff_min = min(diff_precisions) if diff_precisions else 0.0
-                diff_max = max(diff_precisions) if diff_precisions else 0.0
-                diff_perfect = sum(1 for p in diff_precisions if p == 1.0)
-                print(f"  {diff} (n={stats['count']}):")
-                print(f"    Precision@5: {avg_prec:.4f} (min: {diff_min:.4f}, max: {diff_max:.4f}, perfect: {diff_perfect})")
-                print(f"    AP@5: {avg_ap:.4f}")
-            
-            # Phân tích và đề xuất threshold
-            if EVALUATION_METHOD == "distance" and all_distances:
-                print(f"\n{'='*80}")
-                print("PHÂN TÍCH VÀ ĐỀ XUẤT THRESHOLD")
-                print(f"{'='*80}")
-                print(f"Threshold hiện tại: {DISTANCE_THRESHOLD}")
-                print(f"\nPhân tích với các threshold khác nhau:")
-                test_thresholds = [0.5, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9]
-                for thresh in test_thresholds:
-                    relevant_count = sum(1 for d in all_distances if d < thresh)
-                    relevant_pct = relevant_count / len(all_distances) * 100
-                    print(f"  Threshold {thresh:.2f}: {relevant_count}/{len(all_distances)} relevant ({relevant_pct:.1f}%)")
-                
-                # Đề xuất threshold dựa trên phân vị
-                if len(all_distances) >= 10:
-                    p25 = distance_sorted[len(distance_sorted) // 4]
-                    p50 = median_distance
-                    p75 = distance_sorted[len(distance_sorted) * 3 // 4]
-                    print(f"\nPhân vị distance:")
-                    print(f"  25th percentile (P25): {p25:.4f}")
-                    print(f"  50th percentile (Median): {p50:.4f}")
-                    print(f"  75th percentile (P75): {p75:.4f}")
-                    print(f"\n💡 Đề xuất:")
-                    print(f"  - Threshold chặt chẽ (P25): {p25:.4f} → ~{sum(1 for d in all_distances if d < p25)/len(all_distances)*100:.1f}% relevant")
-                    print(f"  - Threshold vừa phải (P50): {p50:.4f} → ~{sum(1 for d in all_distances if d < p50)/len(all_distances)*100:.1f}% relevant")
-                    print(f"  - Threshold lỏng (P75): {p75:.4f} → ~{sum(1 for d in all_distances if d < p75)/len(all_distances)*100:.1f}% relevant")
-            
-            # Tóm tắt cuối cùng
-            print(f"\n{'='*80}")
-            print("TÓM TẮT ĐÁNH GIÁ")
-            print(f"{'='*80}")
-            print(f"📊 Tổng quan:")
-            print(f"   - Tổng số queries: {total}")
-            print(f"   - Precision@5 trung bình: {avg_precision_at_5:.4f} ({avg_precision_at_5*100:.2f}%)")
-            print(f"   - MAP@5: {map_at_5:.4f} ({map_at_5*100:.2f}%)")
-            print(f"   - Số queries đạt perfect (1.0): {perfect_queries}/{total} ({perfect_queries/total*100:.1f}%)")
-            print(f"   - Số queries có Precision@5 >= 0.8: {perfect_queries + high_queries}/{total} ({(perfect_queries + high_queries)/total*100:.1f}%)")
-            print(f"\n📈 Chất lượng:")
-            if avg_precision_at_5 >= 0.9:
-                print(f"   ✓ Hệ thống hoạt động RẤT TỐT (Precision@5 >= 90%)")
-            elif avg_precision_at_5 >= 0.8:
-                print(f"   ✓ Hệ thống hoạt động TỐT (Precision@5 >= 80%)")
-            elif avg_precision_at_5 >= 0.7:
-                print(f"   ⚠ Hệ thống hoạt động KHÁ (Precision@5 >= 70%)")
-            else:
-                print(f"   ⚠ Hệ thống cần CẢI THIỆN (Precision@5 < 70%)")
-            
-            if EVALUATION_METHOD == "distance":
-                print(f"\n⚙️  Cấu hình đánh giá:")
-                print(f"   - Phương pháp: Distance-based")
-                print(f"   - Threshold: {DISTANCE_THRESHOLD}")
-                print(f"   - Tiêu chí: distance < {DISTANCE_THRESHOLD} → relevant")
-            else:
-                print(f"\n⚙️  Cấu hình đánh giá:")
-                print(f"   - Phương pháp: Relevance score-based")
-                print(f"   - Threshold: {RELEVANCE_THRESHOLD}")
-                print(f"   - Tiêu chí: relevance score >= {RELEVANCE_THRESHOLD} → relevant")
+        # Báo cáo tổng kết lấy thẳng từ bộ tổng hợp streaming (không duyệt lại results)
+        print_summary(aggregator)
         
         # Lưu kết quả cuối cùng
         save_results(results)
         print(f"\nĐã lưu kết quả vào: {RESULTS_FILE}")
+        if COLUMNAR_EXPORT and HAS_PYARROW:
+            run_dir = export_run(results, RUNS_DIR)
+            print(f"Đã xuất bảng Parquet (queries/hits/resumes) vào: {run_dir}")
         print(f"Đã lưu kết quả tìm kiếm để đánh giá vào: {SEARCH_RESULTS_FILE}")
         
         # Xóa file progress vì đã xong
@@ -1098,4 +1055,21 @@ if __name__ == "__main__":
         print(f"\nLỗi: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        if query_cache:
+            query_cache.save()
+            stats = query_cache.stats()
+            print(f"\nQuery cache: {stats['hits']} hits | {stats['misses']} misses | "
+                  f"{stats['evictions']} evictions | hit rate {stats['hit_rate']:.1%} | "
+                  f"{stats['size']}/{stats['max_entries']} entries")
+        if semantic_cache:
+            stats = semantic_cache.stats()
+            print(f"Semantic cache: {stats['hits']} hits | {stats['misses']} misses | "
+                  f"hit rate {stats['hit_rate']:.1%} (radius {stats['radius']})")
+        # Xuất thống kê thời gian theo stage (chỉ khi TRACE_ENABLED)
+        trace_files = tracer.export(TRACE_DIR)
+        if trace_files:
+            tracer.print_summary()
+            for path in trace_files.values():
+                print(f"Đã lưu trace vào: {path}")
 
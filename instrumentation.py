@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Đo thời gian theo từng giai đoạn (stage) và xuất trace cho mỗi lần chạy
+
+Cách dùng:
+    tracer = Tracer(enabled=True)
+    with tracer.stage("encode"):
+        ...
+    tracer.count("queries")
+    tracer.export(Path("traces"))   # → run_<timestamp>.json + run_<timestamp>.trace.json
+    executor.submit(tracer.profiled(fn), ...)  # cProfile cả hàm chạy trên thread khác
+
+Khi enabled=False, stage() trả về một context manager rỗng dùng chung và
+count() thoát ngay → chi phí gần như bằng 0.
+File .trace.json mở được bằng chrome://tracing hoặc https://ui.perfetto.dev
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+_NULL_STAGE = nullcontext()
+
+
+class _Stage:
+    """Context manager ghi lại thời gian của một giai đoạn."""
+
+    __slots__ = ("tracer", "name", "start_ns")
+
+    def __init__(self, tracer: "Tracer", name: str):
+        self.tracer = tracer
+        self.name = name
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._record(self.name, self.start_ns, time.perf_counter_ns())
+        return False
+
+
+class Tracer:
+    """
+    Bộ đo thời gian nhẹ: timer theo stage, counter, hook cProfile/tracemalloc tùy chọn.
+
+    Args:
+        enabled: Bật/tắt toàn bộ việc đo
+        profile: Bật cProfile cho cả lần chạy (xuất thêm file .prof)
+        trace_memory: Bật tracemalloc để ghi peak memory và top dòng cấp phát nhiều nhất
+        max_events: Số event tối đa giữ lại cho Chrome trace (thống kê vẫn đầy đủ)
+    """
+
+    def __init__(self, enabled: bool = False, profile: bool = False,
+                 trace_memory: bool = False, max_events: int = 200000):
+        self.enabled = enabled
+        self.profile = profile and enabled
+        self.trace_memory = trace_memory and enabled
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._counters: Dict[str, int] = {}
+        self._events: List[tuple] = []
+        self._origin_ns = time.perf_counter_ns()
+        self._started_at = datetime.now()
+        self._profiler = None
+        self._thread_profilers: Dict[int, Any] = {}  # thread id → cProfile.Profile (Python < 3.12)
+        self._memory: Dict[str, Any] = {}
+        if self.enabled:
+            self.start()
+
+    # ------------------------------------------------------------------
+    # Ghi nhận
+    # ------------------------------------------------------------------
+
+    def stage(self, name: str):
+        """Context manager đo một giai đoạn. Không làm gì nếu tracer bị tắt."""
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def count(self, name: str, n: int = 1):
+        """Tăng counter `name` thêm n."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def _record(self, name: str, start_ns: int, end_ns: int):
+        duration_ns = end_ns - start_ns
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = {"count": 0, "total_ns": 0, "max_ns": 0}
+            stats["count"] += 1
+            stats["total_ns"] += duration_ns
+            if duration_ns > stats["max_ns"]:
+                stats["max_ns"] = duration_ns
+            if len(self._events) < self.max_events:
+                self._events.append((name, start_ns, duration_ns, threading.get_ident()))
+
+    # ------------------------------------------------------------------
+    # cProfile / tracemalloc
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Bật các hook tùy chọn (tự gọi trong __init__ nếu enabled)."""
+        if self.profile and self._profiler is None:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        if self.trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    def profiled(self, fn):
+        """
+        Bọc hàm chạy trên thread khác (ví dụ thread prefetch) để cProfile ghi cả thread đó.
+        Trước Python 3.12, cProfile chỉ đo thread đã gọi enable() → mỗi thread một Profile,
+        được gộp vào file .prof khi export. Từ 3.12 cProfile đo mọi thread → trả về fn.
+        """
+        if not self.profile or sys.version_info >= (3, 12):
+            return fn
+
+        def wrapper(*args, **kwargs):
+            import cProfile
+            ident = threading.get_ident()
+            with self._lock:
+                profiler = self._thread_profilers.get(ident)
+                if profiler is None:
+                    profiler = self._thread_profilers[ident] = cProfile.Profile()
+            profiler.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.disable()
+        return wrapper
+
+    def stop(self):
+        """Tắt các hook và chụp lại thông tin bộ nhớ."""
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self.trace_memory:
+            import tracemalloc
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics("lineno")[:10]
+                self._memory = {
+                    "current_mb": current / 1024 / 1024,
+                    "peak_mb": peak / 1024 / 1024,
+                    "top_allocations": [
+                        {"location": str(stat.traceback[0]), "size_kb": stat.size / 1024, "count": stat.count}
+                        for stat in top
+                    ],
+                }
+                tracemalloc.stop()
+
+    # ------------------------------------------------------------------
+    # Xuất kết quả
+    # ------------------------------------------------------------------
+
+    def summary(self) -> Dict[str, Any]:
+        """Thống kê theo stage (ms), sắp xếp theo tổng thời gian giảm dần."""
+        with self._lock:
+            stages = {
+                name: {
+                    "count": s["count"],
+                    "total_ms": s["total_ns"] / 1e6,
+                    "mean_ms": s["total_ns"] / s["count"] / 1e6,
+                    "max_ms": s["max_ns"] / 1e6,
+                }
+                for name, s in sorted(self._stats.items(), key=lambda x: x[1]["total_ns"], reverse=True)
+            }
+            counters = dict(self._counters)
+        return {
+            "started_at": self._started_at.isoformat(timespec="seconds"),
+            "wall_ms": (time.perf_counter_ns() - self._origin_ns) / 1e6,
+            "stages": stages,
+            "counters": counters,
+            "memory": self._memory,
+        }
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Chuyển các event sang định dạng Chrome trace (phase "X", đơn vị µs)."""
+        pid = os.getpid()
+        with self._lock:
+            events = [
+                {
+                    "name": name, "cat": "stage", "ph": "X", "pid": pid, "tid": tid,
+                    "ts": (start_ns - self._origin_ns) / 1000, "dur": duration_ns / 1000,
+                }
+                for name, start_ns, duration_ns, tid in self._events
+            ]
+            end_ts = (time.perf_counter_ns() - self._origin_ns) / 1000
+            events.extend(
+                {"name": name, "ph": "C", "pid": pid, "tid": 0, "ts": end_ts, "args": {name: value}}
+                for name, value in self._counters.items()
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, out_dir: Path) -> Optional[Dict[str, Path]]:
+        """
+        Ghi file thống kê JSON, Chrome trace và (nếu có) cProfile cho lần chạy này.
+
+        Returns:
+            Dictionary đường dẫn các file đã ghi, hoặc None nếu tracer bị tắt
+        """
+        if not self.enabled:
+            return None
+        self.stop()
+        out_dir.mkdir(parents=True, exist_ok=True)
+        stem = f"run_{self._started_at.strftime('%Y%m%d_%H%M%S')}"
+        paths = {
+            "summary": out_dir / f"{stem}.json",
+            "chrome_trace": out_dir / f"{stem}.trace.json",
+        }
+        with paths["summary"].open("w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+        with paths["chrome_trace"].open("w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+        if self._profiler is not None:
+            import pstats
+            paths["profile"] = out_dir / f"{stem}.prof"
+            stats = pstats.Stats(self._profiler)
+            with self._lock:
+                for profiler in self._thread_profilers.values():
+                    stats.add(profiler)
+            stats.dump_stats(str(paths["profile"]))
+        return paths
+
+    def print_summary(self):
+        """In bảng thời gian theo stage ra màn hình."""
+        if not self.enabled:
+            return
+        summary = self.summary()
+        print("\n" + "="*80)
+        print("THỜI GIAN THEO GIAI ĐOẠN")
+        print("="*80)
+        print(f"{'Stage':<24}{'Count':>8}{'Total (ms)':>14}{'Mean (ms)':>12}{'Max (ms)':>12}")
+        for name, s in summary["stages"].items():
+            print(f"{name:<24}{s['count']:>8}{s['total_ms']:>14.1f}{s['mean_ms']:>12.2f}{s['max_ms']:>12.2f}")
+        if summary["counters"]:
+            print("Counters: " + ", ".join(f"{k}={v}" for k, v in summary["counters"].items()))
+        if summary["memory"]:
+            print(f"Peak memory (tracemalloc): {summary['memory']['peak_mb']:.1f} MB")
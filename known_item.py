@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Đánh giá known-item: hồ sơ đích (target_person_id) của mỗi query có được tìm thấy không, ở hạng mấy
+
+Mỗi dòng random_queries.csv được sinh từ một hồ sơ cụ thể (target_person_id), nên có thể
+đánh giá tự động, không cần nhãn thủ công:
+- Encode tất cả queries theo batch, truy vấn theo batch QUERY_BATCH queries một lần
+  với độ sâu K = DEFAULT_DEPTH (>= 100) → chỉ một lượt truy vấn
+- Hạng của hồ sơ đích trong danh sách (0 = không có trong top-K); với collection chunk
+  (--alias qa_chunks) các chunk được gộp về hồ sơ bằng chunking.query_people trước khi xếp hạng
+- Từ mảng hạng tính hit@k cho MỌI k <= K cùng lúc (cộng dồn histogram hạng), MRR,
+  phân bố hạng; tổng và theo category / difficulty
+
+Đủ rẻ để chạy sau mỗi lần build lại index (populate_chromadb.py, maintenance.py rebuild,
+partitioned_index.py build) và so sánh với lần trước.
+
+Ví dụ:
+    python known_item.py                    # K = 100 trên qa_collection
+    python known_item.py --depth 200 --ivf 4   # Đánh giá index phân vùng với nprobe = 4
+    python known_item.py --alias qa_chunks     # Collection chunk (chunking.py), hạng theo hồ sơ
+"""
+import argparse
+import csv
+import json
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from batching import encode_scheduled
+from chunking import query_people, CHUNK_COLLECTION_NAME
+from metrics import percentile
+
+BASE_DIR = Path(__file__).resolve().parent
+STORE_DIR = BASE_DIR / "chromadb_store"
+QUERIES_FILE = BASE_DIR / "random_queries.csv"
+REPORT_FILE = BASE_DIR / "known_item_report.json"
+COLLECTION_NAME = "qa_collection"
+NUM_SHARDS = 1  # Giống populate_chromadb.py / final_data.py
+ENCODER_BACKEND = "torch"
+DEFAULT_DEPTH = 100  # Số kết quả lấy cho mỗi query
+QUERY_BATCH = 64  # Số queries mỗi lần collection.query
+CUTOFFS = [1, 5, 10, 20, 50, 100]  # Các k được in ra (hit@k được tính cho mọi k)
+RANK_BUCKETS = [(1, 1), (2, 5), (6, 10), (11, 20), (21, 50), (51, 100), (101, None)]
+
+
+def load_known_items(path: Path = QUERIES_FILE) -> List[Dict[str, str]]:
+    """Các query có query_text và target_person_id."""
+    with path.open("r", encoding="utf-8", newline="") as f:
+        return [row for row in csv.DictReader(f)
+                if (row.get("query_text") or "").strip() and (row.get("target_person_id") or "").strip()]
+
+
+def retrieve_ranks(collection, encoder, queries: List[Dict[str, str]], depth: int = DEFAULT_DEPTH,
+                   batch_size: int = QUERY_BATCH, chunked: bool = False) -> Dict[str, Any]:
+    """
+    Hạng (1-based) của target_person_id trong top-`depth` hồ sơ của mỗi query, 0 nếu không có.
+    chunked=True: collection chứa chunk (id "<person_id>#c<i>") → gộp về hồ sơ bằng query_people.
+    Trả về {"ranks", "distances" (distance của hồ sơ đích, NaN nếu không có), thời gian}.
+    """
+    start = time.perf_counter()
+    embeddings = encode_scheduled(encoder, [q["query_text"] for q in queries])
+    encoded = time.perf_counter()
+    ranks = np.zeros(len(queries), dtype=np.int32)
+    target_dist = np.full(len(queries), np.nan)
+    batch_ms = []
+    for i in range(0, len(queries), batch_size):
+        batch_start = time.perf_counter()
+        batch = embeddings[i:i + batch_size].tolist()
+        if chunked:
+            res = query_people(collection, batch, depth, include=["distances"])
+        else:
+            res = collection.query(query_embeddings=batch, n_results=depth, include=["distances"])
+        batch_ms.append((time.perf_counter() - batch_start) * 1000)
+        for j, (ids, dists) in enumerate(zip(res["ids"], res["distances"])):
+            target = str(queries[i + j]["target_person_id"]).strip()
+            try:
+                pos = ids.index(target)
+            except ValueError:
+                continue
+            ranks[i + j] = pos + 1
+            target_dist[i + j] = dists[pos]
+    return {"ranks": ranks, "distances": target_dist, "encode_s": encoded - start,
+            "query_s": time.perf_counter() - encoded,
+            "batch_p50_ms": percentile(batch_ms, 50), "batch_p99_ms": percentile(batch_ms, 99)}
+
+
+def hit_curve(ranks: np.ndarray, depth: int) -> np.ndarray:
+    """hit@k cho k = 1..depth: tỷ lệ query có hồ sơ đích ở hạng <= k."""
+    if len(ranks) == 0:
+        return np.zeros(depth)
+    hist = np.bincount(ranks[ranks > 0], minlength=depth + 1)[1:depth + 1]
+    return np.cumsum(hist) / len(ranks)
+
+
+def summarize(ranks: np.ndarray, depth: int, cutoffs: Optional[List[int]] = None) -> Dict[str, Any]:
+    """hit@k, MRR, phân bố hạng của một nhóm queries."""
+    cutoffs = [k for k in (cutoffs or CUTOFFS) if k <= depth]
+    curve = hit_curve(ranks, depth)
+    found = ranks[ranks > 0]
+    distribution = {}
+    for low, high in RANK_BUCKETS:
+        if low > depth:
+            break
+        high = min(high or depth, depth)
+        label = str(low) if low == high else f"{low}-{high}"
+        distribution[label] = int(np.count_nonzero((ranks >= low) & (ranks <= high)))
+    distribution["miss"] = int(np.count_nonzero(ranks == 0))
+    return {
+        "n": int(len(ranks)),
+        "mrr": float(np.where(ranks > 0, 1.0 / np.maximum(ranks, 1), 0.0).mean()) if len(ranks) else 0.0,
+        "hit_at": {str(k): float(curve[k - 1]) for k in cutoffs},
+        "found": int(len(found)),
+        "median_rank": float(np.median(found)) if len(found) else None,
+        "distribution": distribution,
+    }
+
+
+def known_item_report(queries: List[Dict[str, str]], ranks: np.ndarray, depth: int,
+                      cutoffs: Optional[List[int]] = None) -> Dict[str, Any]:
+    """Tổng, theo category và theo difficulty, kèm đường hit@k đầy đủ (k = 1..depth)."""
+    report: Dict[str, Any] = {"depth": depth, "overall": summarize(ranks, depth, cutoffs),
+                              "hit_curve": [round(float(x), 6) for x in hit_curve(ranks, depth)]}
+    for field, key in (("category", "by_category"), ("difficulty", "by_difficulty")):
+        labels = np.array([q.get(field, "") for q in queries])
+        report[key] = {label: summarize(ranks[labels == label], depth, cutoffs)
+                       for label in sorted(set(labels.tolist()))}
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    cutoffs = list(report["overall"]["hit_at"].keys())
+    header = f"{'':<16}{'n':>5}{'MRR':>8}" + "".join(f"{'hit@' + k:>9}" for k in cutoffs) + f"{'median':>8}"
+
+    def line(label, s):
+        median = f"{s['median_rank']:.0f}" if s["median_rank"] is not None else "-"
+        return (f"{label:<16}{s['n']:>5}{s['mrr']:>8.4f}"
+                + "".join(f"{s['hit_at'][k]:>9.3f}" for k in cutoffs) + f"{median:>8}")
+
+    print(header)
+    print(line("TỔNG", report["overall"]))
+    for key, title in (("by_category", "THEO CATEGORY"), ("by_difficulty", "THEO DIFFICULTY")):
+        print(f"\n{title}")
+        for label, s in report[key].items():
+            print(line(label or "(trống)", s))
+    print("\nPhân bố hạng: " + " | ".join(f"{b}: {c}" for b, c in report["overall"]["distribution"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đánh giá known-item (hạng của target_person_id)")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="Số kết quả lấy cho mỗi query")
+    parser.add_argument("--batch", type=int, default=QUERY_BATCH, help="Số queries mỗi lần truy vấn")
+    parser.add_argument("--alias", default=COLLECTION_NAME)
+    parser.add_argument("--ivf", type=int, default=None, metavar="NPROBE",
+                        help="Đánh giá index phân vùng (partitioned_index.py) với nprobe này")
+    parser.add_argument("--queries", type=Path, default=QUERIES_FILE)
+    parser.add_argument("--output", type=Path, default=REPORT_FILE)
+    args = parser.parse_args()
+
+    import chromadb
+    from collection_alias import resolve, collection_version
+    from encoders import get_encoder
+    from populate_chromadb import open_collection
+
+    client = chromadb.PersistentClient(path=str(STORE_DIR))
+    version = collection_version(STORE_DIR, args.alias)
+    if args.ivf:
+        from partitioned_index import PartitionedCollection
+        collection = PartitionedCollection.open(client, nprobe=args.ivf)
+        source = f"{collection.meta['prefix']} (nprobe={args.ivf})"
+        # Báo cáo ghi phiên bản dữ liệu mà index phân vùng được build từ, không phải phiên bản hiện tại
+        ivf_alias = collection.meta.get("alias", args.alias)
+        current = collection_version(STORE_DIR, ivf_alias)
+        version = collection.meta.get("collection_version")
+        if version != current:
+            print(f"⚠️  Index phân vùng được build từ {version}, dữ liệu hiện tại của {ivf_alias} là "
+                  f"{current} → kết quả là của index cũ (chạy lại partitioned_index.py build)")
+    else:
+        source = resolve(STORE_DIR, args.alias)
+        collection = open_collection(client, source, NUM_SHARDS)
+    queries = load_known_items(args.queries)
+    encoder = get_encoder(ENCODER_BACKEND, 'all-MiniLM-L6-v2')  # Phải cùng model với collection
+    print(f"Đánh giá known-item: {len(queries)} queries, K = {args.depth} trên {source}")
+
+    retrieval = retrieve_ranks(collection, encoder, queries, args.depth, args.batch,
+                               chunked=not args.ivf and args.alias == CHUNK_COLLECTION_NAME)
+    report = known_item_report(queries, retrieval["ranks"], args.depth)
+    report.update({
+        "collection": source,
+        "collection_version": version,
+        "timing": {k: retrieval[k] for k in ("encode_s", "query_s", "batch_p50_ms", "batch_p99_ms")},
+        "queries": [{"query_id": q.get("query_id"), "category": q.get("category"),
+                     "difficulty": q.get("difficulty"), "target_person_id": q.get("target_person_id"),
+                     "rank": int(r), "distance": None if np.isnan(d) else float(d)}
+                    for q, r, d in zip(queries, retrieval["ranks"], retrieval["distances"])],
+    })
+    if args.ivf:
+        report["stale_index"] = version != current
+        collection.close()
+    print_report(report)
+    timing = report["timing"]
+    print(f"\nEncode {timing['encode_s']:.1f}s | Truy vấn {timing['query_s']:.1f}s "
+          f"(mỗi batch p50 {timing['batch_p50_ms']:.0f} ms, p99 {timing['batch_p99_ms']:.0f} ms)")
+
+    with args.output.open("w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Đã lưu báo cáo vào: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+Kiểm thử tải (open-loop) cho đường tìm kiếm search_top5
+
+Chức năng:
+- Phát lại các query trong random_queries.csv (hoặc tập query tổng hợp lớn hơn
+  sinh từ cùng template, dựa trên data.csv) với tốc độ đến cố định (QPS)
+- Open-loop: query được gửi đúng thời điểm đã lên lịch, KHÔNG chờ query trước
+  xong → độ trễ bao gồm cả thời gian xếp hàng khi hệ thống bị quá tải
+- Ghi histogram độ trễ (p50/p95/p99/max), throughput, lỗi ra file JSON
+  để so sánh (diff) giữa các phiên bản
+
+Ví dụ:
+    python load_test.py --qps 20 --duration 60 --concurrency 8
+    python load_test.py --qps 50 --synthetic 5000 --poisson
+"""
+import argparse
+import bisect
+import csv
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, Dict, Any
+
+from final_data import load_queries, search_top5, BASE_DIR
+from metrics import percentile
+
+RESOURCE_FILE = BASE_DIR / "data.csv"       # Nguồn để sinh query tổng hợp
+REPORT_DIR = BASE_DIR / "load_reports"
+
+# Biên trên của các bucket histogram (ms), tăng theo cấp số nhân
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+
+def synthesize_queries(count: int, seed: int = 42) -> List[str]:
+    """
+    Sinh query tổng hợp theo cùng template với random_queries.csv:
+    "Looking for a <title> with <skill>, <skill>, and <skill> and a background in <program>."
+    """
+    rng = random.Random(seed)
+    profiles = []
+    with RESOURCE_FILE.open("r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            title = (row.get("title") or "").strip().lower()
+            skills = [s.strip() for s in (row.get("skill") or "").split(",") if s.strip()]
+            program = (row.get("program") or "").strip().lower()
+            if title and len(skills) >= 3 and program:
+                profiles.append((title, skills, program))
+    if not profiles:
+        raise ValueError(f"Không có hồ sơ hợp lệ trong {RESOURCE_FILE}")
+
+    queries = []
+    for _ in range(count):
+        title, skills, program = rng.choice(profiles)
+        s1, s2, s3 = rng.sample(skills, 3)
+        queries.append(f"Looking for a {title} with {s1}, {s2}, and {s3} "
+                       f"and a background in {program}.")
+    return queries
+
+
+def build_histogram(latencies_ms: List[float]) -> Dict[str, int]:
+    """Đếm số request theo từng bucket độ trễ (key là biên trên, '+Inf' cho phần còn lại)."""
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for value in latencies_ms:
+        counts[bisect.bisect_left(HISTOGRAM_BUCKETS_MS, value)] += 1
+    labels = [f"<={b}ms" for b in HISTOGRAM_BUCKETS_MS] + ["+Inf"]
+    return dict(zip(labels, counts))
+
+
+def run_load(queries: List[str], qps: float, duration_s: float, concurrency: int,
+             poisson: bool = False, seed: int = 42) -> Dict[str, Any]:
+    """
+    Gửi query theo lịch open-loop và thu thập độ trễ.
+
+    Độ trễ = thời điểm xong - thời điểm LÊN LỊCH (không phải thời điểm bắt đầu chạy),
+    để không che giấu thời gian chờ trong hàng đợi (coordinated omission).
+    """
+    rng = random.Random(seed)
+    total = max(1, int(qps * duration_s))
+    # Lịch gửi: đều đặn 1/qps hoặc khoảng cách ngẫu nhiên theo phân phối mũ (Poisson)
+    offsets, t = [], 0.0
+    for _ in range(total):
+        offsets.append(t)
+        t += rng.expovariate(qps) if poisson else 1.0 / qps
+
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def task(query: str, scheduled: float):
+        try:
+            search_top5(query)
+            elapsed = (time.perf_counter() - scheduled) * 1000
+            with lock:
+                latencies.append(elapsed)
+        except Exception as e:  # Ghi nhận lỗi, không dừng cả bài test
+            key = f"{type(e).__name__}: {e}"[:200]
+            with lock:
+                errors[key] = errors.get(key, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i, offset in enumerate(offsets):
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, queries[i % len(queries)], scheduled)
+    elapsed_s = time.perf_counter() - start
+
+    completed = len(latencies)
+    return {
+        "requests": total,
+        "completed": completed,
+        "errors": sum(errors.values()),
+        "error_types": errors,
+        "elapsed_s": elapsed_s,
+        "throughput_qps": completed / elapsed_s if elapsed_s > 0 else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies) if latencies else 0.0,
+            "mean": sum(latencies) / completed if completed else 0.0,
+        },
+        "histogram": build_histogram(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm thử tải open-loop cho search_top5")
+    parser.add_argument("--qps", type=float, default=10.0, help="Tốc độ đến mục tiêu (query/giây)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Thời gian chạy (giây)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Số worker thread tối đa")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Sinh N query tổng hợp thay vì dùng random_queries.csv")
+    parser.add_argument("--poisson", action="store_true", help="Khoảng cách đến theo phân phối Poisson")
+    parser.add_argument("--warmup", type=int, default=5, help="Số query chạy trước để làm nóng model")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--label", default="", help="Nhãn phiên bản ghi vào báo cáo")
+    args = parser.parse_args()
+
+    if args.synthetic > 0:
+        queries = synthesize_queries(args.synthetic, seed=args.seed)
+        source = f"synthetic({args.synthetic})"
+    else:
+        queries = [q["query_text"] for q in load_queries() if q["query_text"].strip()]
+        source = "random_queries.csv"
+
+    print(f"Làm nóng với {args.warmup} queries...")
+    for query in queries[:args.warmup]:
+        search_top5(query)
+
+    print(f"Chạy tải: {args.qps} QPS x {args.duration}s, concurrency={args.concurrency}, nguồn={source}")
+    result = run_load(queries, args.qps, args.duration, args.concurrency,
+                      poisson=args.poisson, seed=args.seed)
+
+    report = {
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "qps": args.qps,
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "arrival": "poisson" if args.poisson else "uniform",
+            "source": source,
+            "num_queries": len(queries),
+            "seed": args.seed,
+        },
+        **result,
+    }
+
+    lat = result["latency_ms"]
+    print("\n" + "="*80)
+    print("KẾT QUẢ KIỂM THỬ TẢI")
+    print("="*80)
+    print(f"Hoàn thành: {result['completed']}/{result['requests']} | Lỗi: {result['errors']}")
+    print(f"Throughput: {result['throughput_qps']:.2f} QPS (mục tiêu {args.qps})")
+    print(f"Độ trễ (ms): p50={lat['p50']:.1f} | p95={lat['p95']:.1f} | "
+          f"p99={lat['p99']:.1f} | max={lat['max']:.1f}")
+    print("Histogram:")
+    for bucket, count in result["histogram"].items():
+        if count:
+            print(f"  {bucket:>10}: {count}")
+
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    report_file = REPORT_DIR / f"load_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with report_file.open("w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+    print(f"\nĐã lưu báo cáo vào: {report_file}")
+
+
+if __name__ == "__main__":
+    main()
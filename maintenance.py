@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Bảo trì chromadb_store: thống kê segment HNSW, dọn segment mồ côi, build lại (compact) index
+
+Sau nhiều lần xóa / thêm lại dữ liệu, mỗi segment HNSW (thư mục <segment_id>/ gồm header.bin,
+link_lists.bin, length.bin, index_metadata.pickle, data_level0.bin) giữ lại các phần tử đã
+xóa (chỉ được đánh dấu, không thu hồi) và dung lượng đã cấp phát. Lệnh này:
+
+- stats:   với mỗi segment: số phần tử, số phần tử đã xóa và tỷ lệ, dung lượng đã cấp phát,
+           dung lượng trên đĩa, collection sở hữu (đọc từ chroma.sqlite3) hoặc "mồ côi"
+- prune:   xóa các thư mục segment mồ côi (không còn trong chroma.sqlite3)
+- rebuild: build lại collection đang phục vụ thành index mới gọn (blue/green, xem
+           collection_alias.py), đo độ trễ query trước / sau
+
+Chỉ đọc file, không cần import chromadb cho "stats" → chạy được cả khi store đang được dùng.
+"rebuild" và "prune" nên chạy khi không có tiến trình nào đang ghi vào store.
+
+Ví dụ:
+    python maintenance.py stats
+    python maintenance.py prune --yes
+    python maintenance.py rebuild --alias qa_collection
+"""
+import argparse
+import json
+import pickle
+import shutil
+import sqlite3
+import struct
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from collection_alias import resolve, new_version_name, publish, record_model, built_with, KEEP_VERSIONS
+from metrics import percentile
+
+BASE_DIR = Path(__file__).resolve().parent
+STORE_DIR = BASE_DIR / "chromadb_store"
+SQLITE_NAME = "chroma.sqlite3"
+COLLECTION_NAME = "qa_collection"
+NUM_SHARDS = 1  # Giống populate_chromadb.py / final_data.py
+PAGE_SIZE = 1000  # Số phần tử mỗi lần collection.get khi build lại
+LATENCY_PROBES = 200  # Số vector mẫu dùng để đo độ trễ query
+DELETED_RATIO_WARN = 0.2  # Tỷ lệ phần tử đã xóa từ mức này trở lên → nên build lại
+
+# header.bin của hnswlib (bản persist của Chroma): version + các trường của HierarchicalNSW
+_HEADER_FORMAT = "<i6QiI3QdQ"
+_HEADER_FIELDS = ["version", "offset_level0", "max_elements", "cur_element_count", "size_data_per_element",
+                  "label_offset", "offset_data", "max_level", "enterpoint_node", "max_m", "max_m0", "m",
+                  "mult", "ef_construction"]
+_DELETE_MARK = 0x01  # Bit đánh dấu đã xóa trong byte thứ 3 của linklist level 0
+
+
+def read_header(segment_dir: Path) -> Optional[Dict[str, Any]]:
+    path = segment_dir / "header.bin"
+    if not path.exists():
+        return None
+    raw = path.read_bytes()
+    if len(raw) < struct.calcsize(_HEADER_FORMAT):
+        return None
+    return dict(zip(_HEADER_FIELDS, struct.unpack_from(_HEADER_FORMAT, raw)))
+
+
+def read_index_metadata(segment_dir: Path) -> Optional[Dict[str, Any]]:
+    """index_metadata.pickle: id_to_label, label_to_id, total_elements_added... (dict hoặc object)."""
+    path = segment_dir / "index_metadata.pickle"
+    if not path.exists():
+        return None
+    with path.open("rb") as f:
+        data = pickle.load(f)
+    return data if isinstance(data, dict) else vars(data)
+
+
+def count_deleted_marks(segment_dir: Path, header: Dict[str, Any]) -> Optional[int]:
+    """Đếm chính xác phần tử bị đánh dấu xóa trong data_level0.bin (None nếu không có file)."""
+    path = segment_dir / "data_level0.bin"
+    if not path.exists() or not header:
+        return None
+    count, stride = header["cur_element_count"], header["size_data_per_element"]
+    if count == 0:
+        return 0
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    if data.size < count * stride:
+        return None
+    flags = data[:count * stride].reshape(count, stride)[:, header["offset_level0"] + 2]
+    return int(np.count_nonzero(flags & _DELETE_MARK))
+
+
+def registered_segments(store_dir: Path) -> Optional[Dict[str, str]]:
+    """{segment_id: tên collection} từ chroma.sqlite3, None nếu không có file."""
+    path = store_dir / SQLITE_NAME
+    if not path.exists():
+        return None
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT s.id, COALESCE(c.name, '?') FROM segments s LEFT JOIN collections c ON s.collection = c.id")
+        return {segment_id: name for segment_id, name in rows}
+    finally:
+        conn.close()
+
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def segment_stats(store_dir: Path = STORE_DIR) -> Dict[str, Any]:
+    """Thống kê mọi thư mục segment HNSW trong store."""
+    registered = registered_segments(store_dir)
+    segments = []
+    for segment_dir in sorted(p for p in store_dir.iterdir() if p.is_dir()):
+        header = read_header(segment_dir)
+        if header is None:
+            continue
+        meta = read_index_metadata(segment_dir) or {}
+        elements = header["cur_element_count"]
+        live = len(meta.get("label_to_id", {})) if meta else None
+        deleted = count_deleted_marks(segment_dir, header)
+        if deleted is None and live is not None:
+            deleted = max(elements - live, 0)  # Chroma bỏ nhãn đã xóa khỏi label_to_id
+        segments.append({
+            "segment_id": segment_dir.name,
+            "collection": registered.get(segment_dir.name) if registered is not None else None,
+            "orphaned": registered is not None and segment_dir.name not in registered,
+            "dimension": (header["label_offset"] - header["offset_data"]) // 4,
+            "elements": elements,
+            "live": live,
+            "deleted": deleted,
+            "deleted_ratio": deleted / elements if elements and deleted is not None else 0.0,
+            "max_elements": header["max_elements"],
+            "allocated_bytes": header["max_elements"] * header["size_data_per_element"],
+            "disk_bytes": _dir_size(segment_dir),
+            "m": header["m"],
+            "ef_construction": header["ef_construction"],
+        })
+    sqlite_path = store_dir / SQLITE_NAME
+    return {
+        "store": str(store_dir),
+        "sqlite_found": registered is not None,
+        "sqlite_bytes": sqlite_path.stat().st_size if sqlite_path.exists() else 0,
+        "segments": segments,
+    }
+
+
+def print_stats(stats: Dict[str, Any]):
+    print(f"Store: {stats['store']}")
+    if stats["sqlite_found"]:
+        print(f"{SQLITE_NAME}: {stats['sqlite_bytes'] / 1024 / 1024:.1f} MB")
+    else:
+        print(f"⚠️  Không có {SQLITE_NAME}: không xác định được segment nào còn được dùng")
+    print(f"\n{'Segment':<38}{'Collection':<32}{'Elements':>9}{'Deleted':>9}{'Ratio':>7}{'Disk MB':>9}")
+    for s in stats["segments"]:
+        owner = "MỒ CÔI" if s["orphaned"] else (s["collection"] or "?")
+        deleted = "?" if s["deleted"] is None else s["deleted"]
+        print(f"{s['segment_id']:<38}{owner[:31]:<32}{s['elements']:>9}{deleted:>9}"
+              f"{s['deleted_ratio']:>7.1%}{s['disk_bytes'] / 1024 / 1024:>9.2f}")
+    orphans = [s for s in stats["segments"] if s["orphaned"]]
+    if orphans:
+        size = sum(s["disk_bytes"] for s in orphans) / 1024 / 1024
+        print(f"\n{len(orphans)} segment mồ côi ({size:.2f} MB) → python maintenance.py prune --yes")
+    bloated = [s for s in stats["segments"] if not s["orphaned"] and s["deleted_ratio"] >= DELETED_RATIO_WARN]
+    for s in bloated:
+        print(f"{s['segment_id']}: {s['deleted_ratio']:.0%} phần tử đã xóa → nên build lại (rebuild)")
+
+
+def prune_orphans(store_dir: Path = STORE_DIR, dry_run: bool = True) -> List[str]:
+    """Xóa thư mục segment mồ côi. Không làm gì nếu không có chroma.sqlite3."""
+    stats = segment_stats(store_dir)
+    if not stats["sqlite_found"]:
+        print(f"Không có {SQLITE_NAME}, không xóa gì (không biết segment nào còn được dùng)")
+        return []
+    removed = []
+    for s in stats["segments"]:
+        if s["orphaned"]:
+            print(f"{'Sẽ xóa' if dry_run else 'Xóa'} {s['segment_id']} ({s['disk_bytes'] / 1024 / 1024:.2f} MB)")
+            if not dry_run:
+                shutil.rmtree(store_dir / s["segment_id"])
+            removed.append(s["segment_id"])
+    return removed
+
+
+def _shard_collections(collection) -> List[Any]:
+    return getattr(collection, "collections", None) or [collection]
+
+
+def iter_pages(collection, page_size: int = PAGE_SIZE):
+    """Đọc toàn bộ (ids, embeddings, metadatas) theo trang, từng shard một."""
+    for coll in _shard_collections(collection):
+        offset = 0
+        while True:
+            page = coll.get(limit=page_size, offset=offset, include=["embeddings", "metadatas"])
+            if not page["ids"]:
+                break
+            yield page
+            offset += len(page["ids"])
+
+
+def measure_latency(collection, probes: List[List[float]], k: int = 5) -> Dict[str, float]:
+    """Độ trễ query (ms) p50 / p99 trên các vector mẫu, chạy lần lượt từng query."""
+    latencies = []
+    for emb in probes:
+        start = time.perf_counter()
+        collection.query(query_embeddings=[emb], n_results=k, include=["distances"])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {"queries": len(latencies), "p50_ms": percentile(latencies, 50), "p99_ms": percentile(latencies, 99),
+            "mean_ms": sum(latencies) / len(latencies) if latencies else 0.0}
+
+
+def rebuild(alias: str = COLLECTION_NAME, num_shards: int = NUM_SHARDS, keep: int = KEEP_VERSIONS) -> Dict[str, Any]:
+    """
+    Build lại phiên bản đang phục vụ của alias thành collection mới (index HNSW gọn, không còn
+    phần tử đã xóa), đổi alias nguyên tử rồi xóa các phiên bản quá hạn.
+    Embeddings được copy nguyên từ collection cũ (không cần encode lại).
+    """
+    import chromadb
+    from populate_chromadb import open_collection, delete_collection, BATCH_SIZE
+
+    client = chromadb.PersistentClient(path=str(STORE_DIR))
+    current = resolve(STORE_DIR, alias)
+    source = open_collection(client, current, num_shards)
+    before_count = source.count()
+    first_page = next(iter_pages(source, LATENCY_PROBES), None)
+    probes = [np.asarray(e).tolist() for e in first_page["embeddings"]] if first_page else []
+    print(f"Đo độ trễ trên {current} ({before_count} documents, {len(probes)} query mẫu)...")
+    latency_before = measure_latency(source, probes)
+
+    target = new_version_name(alias)
+    print(f"Build lại vào {target}...")
+    target_coll = open_collection(client, target, num_shards)
+    start = time.perf_counter()
+    try:
+        for page in iter_pages(source):
+            for j in range(0, len(page["ids"]), BATCH_SIZE):
+                target_coll.add(
+                    ids=page["ids"][j:j + BATCH_SIZE],
+                    embeddings=[np.asarray(e).tolist() for e in page["embeddings"][j:j + BATCH_SIZE]],
+                    metadatas=page["metadatas"][j:j + BATCH_SIZE],
+                )
+        after_count = target_coll.count()
+        if after_count != before_count:
+            raise RuntimeError(f"Số documents không khớp: {before_count} → {after_count}")
+    except BaseException:
+        print(f"Build lại thất bại, xóa {target}...")
+        delete_collection(client, target, num_shards)
+        raise
+    build_seconds = time.perf_counter() - start
+
+    latency_after = measure_latency(target_coll, probes)
+    record_model(STORE_DIR, alias, target, built_with(STORE_DIR, alias))  # Chép nguyên embeddings
+    retired = publish(STORE_DIR, alias, target, keep=keep)
+    print(f"Đã chuyển alias {alias}: {current} -> {target}")
+    for old_name in retired:
+        print(f"Xóa phiên bản cũ: {old_name}")
+        try:
+            delete_collection(client, old_name, num_shards)
+        except Exception as e:
+            print(f"  Cảnh báo: không xóa được {old_name}: {e}")
+    return {"alias": alias, "from": current, "to": target, "documents": after_count,
+            "build_seconds": build_seconds, "latency_before": latency_before,
+            "latency_after": latency_after, "retired": retired}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bảo trì chromadb_store")
+    sub = parser.add_subparsers(dest="command")
+    sub.add_parser("stats", help="Thống kê segment HNSW (mặc định)")
+    prune = sub.add_parser("prune", help="Xóa segment mồ côi")
+    prune.add_argument("--yes", action="store_true", help="Xóa thật (mặc định chỉ liệt kê)")
+    rb = sub.add_parser("rebuild", help="Build lại index của alias (blue/green)")
+    rb.add_argument("--alias", default=COLLECTION_NAME)
+    rb.add_argument("--shards", type=int, default=NUM_SHARDS)
+    parser.add_argument("--output", type=Path, default=None, help="Lưu báo cáo JSON")
+    args = parser.parse_args()
+
+    if args.command == "prune":
+        report = {"removed": prune_orphans(STORE_DIR, dry_run=not args.yes)}
+    elif args.command == "rebuild":
+        before = segment_stats(STORE_DIR)
+        result = rebuild(args.alias, args.shards)
+        after = segment_stats(STORE_DIR)
+        lb, la = result["latency_before"], result["latency_after"]
+        print(f"\nBuild lại {result['documents']} documents trong {result['build_seconds']:.1f}s")
+        print(f"Độ trễ query: p50 {lb['p50_ms']:.2f} → {la['p50_ms']:.2f} ms | "
+              f"p99 {lb['p99_ms']:.2f} → {la['p99_ms']:.2f} ms")
+        print()
+        print_stats(after)
+        report = {"rebuild": result, "before": before, "after": after}
+    else:
+        report = segment_stats(STORE_DIR)
+        print_stats(report)
+
+    if args.output:
+        with args.output.open("w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nĐã lưu báo cáo vào: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
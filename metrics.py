@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Các hàm tính relevance và metrics đánh giá (Precision@K, AP@K, MAP@K)
+
+Tách riêng khỏi final_data.py để có thể import mà không khởi tạo model/ChromaDB
+(ví dụ trong các worker của process pool). final_data.py import lại tất cả các hàm này.
+"""
+import math
+import re
+from typing import List, Dict, Any
+
+# ============================================================================
+# HÀM XỬ LÝ TEXT VÀ TÍNH RELEVANCE
+# ============================================================================
+
+def extract_keywords(text: str) -> set:
+    """
+    Trích xuất từ khóa từ text, bỏ qua các từ không quan trọng.
+    
+    Ví dụ: "Looking for a Python developer" → {"looking", "python", "developer"}
+    """
+    # Tách text thành các từ
+    words = re.findall(r'\b\w+\b', text.lower())
+    
+    # Loại bỏ các từ không quan trọng (từ ngắn và từ thường gặp)
+    stop_words = {'the', 'for', 'and', 'with', 'in', 'on', 'at', 'to', 'a', 'an', 
+                  'is', 'are', 'was', 'were', 'be', 'been', 'being', 'have', 'has', 
+                  'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 
+                  'may', 'might', 'must', 'can', 'of', 'from', 'by', 'as', 'or', 
+                  'but', 'not', 'this', 'that', 'these', 'those'}
+    
+    # Chỉ giữ lại từ có ý nghĩa (dài hơn 2 ký tự và không phải stop word)
+    keywords = {w for w in words if len(w) >= 3 and w not in stop_words}
+    return keywords
+
+
+def calculate_relevance_score(query: str, result: Dict[str, Any]) -> float:
+    """
+    Tính điểm phù hợp (0-1) của một kết quả với query.
+    
+    Điểm được tính từ 4 yếu tố:
+    - 40%: Độ tương đồng ngữ nghĩa (distance) - đánh giá bằng embedding
+    - 20%: Từ khóa khớp trong chức danh (title)
+    - 25%: Từ khóa khớp trong kỹ năng (skills) - quan trọng nhất
+    - 15%: Từ khóa khớp trong khả năng (abilities)
+    
+    Ví dụ: Query "Python developer" với hồ sơ có skills "Python, Django"
+    → Skills match cao → điểm relevance cao
+    """
+    score = 0.0
+    
+    # Phần 1: Điểm từ độ tương đồng ngữ nghĩa (40%)
+    # Distance là khoảng cách giữa vector query và vector hồ sơ
+    # Distance thường trong khoảng 0-2:
+    #   - 0 = giống hoàn toàn
+    #   - 2 = khác biệt hoàn toàn
+    distance = result.get('distance')
+    if distance is not None:
+        # Chuyển distance (0-2) thành điểm (1-0)
+        # distance = 0 → score = 1 (giống hoàn toàn)
+        # distance = 1 → score = 0.5 (giống một nửa)
+        # distance = 2 → score = 0 (khác biệt hoàn toàn)
+        distance_score = max(0, 1 - (distance / 2.0))
+        score += distance_score * 0.4  # Chiếm 40% tổng điểm
+    
+    # Phần 2-4: Điểm từ từ khóa khớp (60% còn lại)
+    # Trích xuất từ khóa từ query (bỏ qua các từ không quan trọng như "the", "a", "for")
+    query_keywords = extract_keywords(query)
+    # Ví dụ: "Looking for a Python developer" → {"looking", "python", "developer"}
+    
+    # So khớp trong chức danh (20%)
+    # Ví dụ: Query có "developer" và hồ sơ có title "Senior Developer" → khớp
+    title = result.get('title', '').lower()
+    title_keywords = extract_keywords(title)
+    # Tính tỷ lệ: số từ khóa chung / tổng số từ khóa trong query
+    # Ví dụ: query có 3 từ khóa, title có 1 từ khóa chung → match = 1/3 = 0.33
+    title_match = len(query_keywords & title_keywords) / max(len(query_keywords), 1)
+    score += title_match * 0.2
+    
+    # So khớp trong kỹ năng (25% - quan trọng nhất)
+    # Ví dụ: Query có "Python" và hồ sơ có skills "Python, Django, SQL" → khớp
+    skills = result.get('skills', '').lower()
+    skills_keywords = extract_keywords(skills)
+    skills_match = len(query_keywords & skills_keywords) / max(len(query_keywords), 1)
+    score += skills_match * 0.25  # Chiếm 25% - quan trọng nhất vì skills là yêu cầu chính
+    
+    # So khớp trong khả năng (15%)
+    # Ví dụ: Query có "leadership" và hồ sơ có abilities "leadership, communication" → khớp
+    abilities = result.get('abilities', '').lower()
+    abilities_keywords = extract_keywords(abilities)
+    abilities_match = len(query_keywords & abilities_keywords) / max(len(query_keywords), 1)
+    score += abilities_match * 0.15
+    
+    # Đảm bảo điểm không vượt quá 1.0 (tối đa 100%)
+    return min(1.0, score)
+
+
+# ============================================================================
+# HÀM TÍNH METRICS ĐÁNH GIÁ
+# ============================================================================
+
+def get_relevance_labels(results: List[Dict[str, Any]], query: str, 
+                         method: str = "distance", threshold: float = 0.8) -> List[int]:
+    """
+    Xác định kết quả nào phù hợp (1) và không phù hợp (0).
+    
+    Có 2 phương pháp đánh giá:
+    
+    1. "distance" (mặc định):
+       - Chỉ dựa vào độ tương đồng ngữ nghĩa (embedding)
+       - Nếu distance < threshold → phù hợp (1)
+       - Ví dụ: threshold = 0.8, distance = 0.6 → phù hợp (0.6 < 0.8)
+       - Ưu điểm: Nhanh, đơn giản
+       - Nhược điểm: Có thể bỏ sót kết quả phù hợp về từ khóa nhưng khác về ngữ nghĩa
+    
+    2. "relevance":
+       - Kết hợp distance (40%) + keyword matching (60%)
+       - Nếu relevance score >= threshold → phù hợp (1)
+       - Ví dụ: threshold = 0.5, score = 0.7 → phù hợp (0.7 >= 0.5)
+       - Ưu điểm: Chính xác hơn, xem xét cả từ khóa
+       - Nhược điểm: Chậm hơn vì phải tính relevance score
+    
+    Returns:
+        List nhãn binary [0, 1, 0, 1, ...] tương ứng với từng kết quả
+        - 1 = phù hợp (relevant)
+        - 0 = không phù hợp (non-relevant)
+    """
+    labels = []
+    
+    # Duyệt qua từng kết quả tìm kiếm
+    for result in results:
+        is_relevant = False
+        
+        if method == "distance":
+            # Phương pháp 1: Chỉ dùng distance
+            # Distance là khoảng cách giữa vector query và vector hồ sơ
+            # Distance càng nhỏ = càng giống nhau về mặt ngữ nghĩa = càng phù hợp
+            distance = result.get('distance')
+            if distance is not None:
+                # Nếu distance nhỏ hơn ngưỡng → kết quả này phù hợp
+                # Ví dụ: threshold = 0.8, distance = 0.6 → 0.6 < 0.8 → phù hợp
+                is_relevant = distance < threshold
+                
+        elif method == "relevance":
+            # Phương pháp 2: Dùng relevance score (kết hợp distance + keywords)
+            # Relevance score được tính từ:
+            # - 40% distance (độ tương đồng ngữ nghĩa)
+            # - 60% keyword matching (từ khóa khớp trong title, skills, abilities)
+            score = calculate_relevance_score(query, result)
+            # Nếu score lớn hơn hoặc bằng ngưỡng → kết quả này phù hợp
+            # Ví dụ: threshold = 0.5, score = 0.7 → 0.7 >= 0.5 → phù hợp
+            is_relevant = score >= threshold
+        
+        # Chuyển đổi thành nhãn binary: 1 = phù hợp, 0 = không phù hợp
+        labels.append(1 if is_relevant else 0)
+    
+    return labels
+
+
+def precision_at_k(relevance_labels: List[int], k: int) -> float:
+    """
+    Tính Precision@K - Tỷ lệ kết quả phù hợp trong top K.
+    
+    Công thức: Precision@K = (Số kết quả phù hợp trong top K) / K
+    
+    Ví dụ: 
+    - labels = [1, 1, 0, 1, 0] (5 kết quả, 3 phù hợp)
+    - Precision@5 = 3/5 = 0.6 (60% kết quả phù hợp)
+    - Precision@5 = 1.0 nghĩa là tất cả 5 kết quả đều phù hợp (hoàn hảo)
+    
+    Precision@K càng cao → hệ thống càng chính xác
+    """
+    if k == 0:
+        return 0.0
+    
+    # Lấy k nhãn đầu tiên (top K kết quả)
+    top_k_labels = relevance_labels[:k]
+    if not top_k_labels:
+        return 0.0
+    
+    # Đếm số kết quả phù hợp (nhãn = 1)
+    # Ví dụ: [1, 1, 0, 1, 0] → sum = 3
+    relevant_count = sum(top_k_labels)
+    
+    # Tính tỷ lệ: số phù hợp / tổng số kết quả
+    return relevant_count / len(top_k_labels)
+
+
+def average_precision_at_k(relevance_labels: List[int], k: int) -> float:
+    """
+    Tính AP@K (Average Precision@K) - Đánh giá chất lượng thứ tự sắp xếp.
+    
+    AP@K khác với Precision@K ở chỗ:
+    - Precision@K: Chỉ quan tâm có bao nhiêu kết quả phù hợp
+    - AP@K: Quan tâm cả vị trí của các kết quả phù hợp
+    
+    Nếu kết quả phù hợp được xếp ở vị trí cao (1, 2, 3) → AP@K cao
+    Nếu kết quả phù hợp bị xếp ở vị trí thấp (4, 5) → AP@K thấp
+    
+    Công thức: AP@K = (1/R) * Σ(P@i cho mỗi vị trí i có kết quả phù hợp)
+    R = tổng số kết quả phù hợp trong top K
+    
+    Ví dụ chi tiết với labels = [1, 1, 0, 1, 0]:
+    - Vị trí 1: phù hợp (1) → P@1 = 1/1 = 1.0 (có 1 phù hợp trong 1 kết quả đầu)
+    - Vị trí 2: phù hợp (1) → P@2 = 2/2 = 1.0 (có 2 phù hợp trong 2 kết quả đầu)
+    - Vị trí 3: không phù hợp (0) → bỏ qua
+    - Vị trí 4: phù hợp (1) → P@4 = 3/4 = 0.75 (có 3 phù hợp trong 4 kết quả đầu)
+    - Vị trí 5: không phù hợp (0) → bỏ qua
+    
+    AP@5 = (1.0 + 1.0 + 0.75) / 3 = 0.917
+    → Điểm cao vì các kết quả phù hợp được xếp ở vị trí cao
+    """
+    if k == 0:
+        return 0.0
+    
+    top_k_labels = relevance_labels[:k]
+    if not top_k_labels:
+        return 0.0
+    
+    # Đếm tổng số kết quả phù hợp trong top K
+    total_relevant = sum(top_k_labels)
+    if total_relevant == 0:
+        return 0.0  # Không có kết quả phù hợp nào → AP@K = 0
+    
+    # Tính precision tại mỗi vị trí có kết quả phù hợp
+    ap_sum = 0.0
+    relevant_found = 0  # Số lượng kết quả phù hợp đã tìm thấy từ đầu đến vị trí hiện tại
+    
+    # Duyệt qua từng vị trí trong top K
+    for i, label in enumerate(top_k_labels, 1):  # i bắt đầu từ 1 (vị trí 1, 2, 3, ...)
+        if label == 1:  # Nếu kết quả ở vị trí i là phù hợp
+            relevant_found += 1  # Tăng số lượng phù hợp đã tìm thấy
+            # Tính precision tại vị trí i
+            # Precision@i = số phù hợp từ đầu đến vị trí i / vị trí i
+            precision_at_i = relevant_found / i
+            ap_sum += precision_at_i  # Cộng dồn vào tổng
+    
+    # Trung bình: tổng precision / số lượng kết quả phù hợp
+    return ap_sum / total_relevant
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Tính phân vị theo phương pháp nearest-rank (pct trong khoảng 0-100).
+    
+    Ví dụ: percentile([0.5, 0.6, 0.7, 0.8], 50) → 0.6
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def calculate_metrics(results: List[Dict[str, Any]], query: str,
+                     k: int = 5, method: str = "distance", threshold: float = 0.8) -> Dict[str, float]:
+    """
+    Tính các chỉ số đánh giá: Precision@K và AP@K.
+    
+    Quy trình:
+    1. Xác định kết quả nào phù hợp (relevant) và không phù hợp (non-relevant)
+    2. Tính Precision@K: Tỷ lệ kết quả phù hợp trong top K
+    3. Tính AP@K: Đánh giá chất lượng thứ tự sắp xếp
+    
+    Args:
+        results: Danh sách 5 kết quả tìm kiếm
+        query: Câu truy vấn
+        k: Số kết quả đầu tiên (thường là 5)
+        method: "distance" hoặc "relevance"
+        threshold: Ngưỡng để xác định phù hợp
+    
+    Returns:
+        Dictionary chứa:
+        - precision_at_k: Precision@K (0.0 - 1.0)
+        - ap_at_k: Average Precision@K (0.0 - 1.0)
+        - relevance_labels: [0, 1, 0, 1, ...] - nhãn của từng kết quả
+        - num_relevant: Số lượng kết quả phù hợp (0-5)
+    """
+    # Bước 1: Xác định kết quả nào phù hợp
+    # Chuyển đổi mỗi kết quả thành nhãn binary: 1 = phù hợp, 0 = không phù hợp
+    # Ví dụ: [1, 1, 0, 1, 0] nghĩa là kết quả 1, 2, 4 phù hợp; kết quả 3, 5 không phù hợp
+    relevance_labels = get_relevance_labels(results, query, method, threshold)
+    
+    # Bước 2: Tính Precision@K
+    # Precision@K = số kết quả phù hợp / tổng số kết quả
+    # Ví dụ: [1, 1, 0, 1, 0] → 3 phù hợp / 5 tổng = 0.6
+    p_at_k = precision_at_k(relevance_labels, k)
+    
+    # Bước 3: Tính AP@K
+    # AP@K đánh giá chất lượng thứ tự: kết quả phù hợp ở vị trí cao → AP@K cao
+    # Ví dụ: [1, 1, 0, 1, 0] → AP@5 = 0.917 (các kết quả phù hợp ở vị trí 1, 2, 4)
+    ap_at_k = average_precision_at_k(relevance_labels, k)
+    
+    return {
+        'precision_at_k': p_at_k,              # Precision@K
+        'ap_at_k': ap_at_k,                    # Average Precision@K
+        'relevance_labels': relevance_labels,   # Nhãn binary [0, 1, 0, 1, ...]
+        'num_relevant': sum(relevance_labels)  # Số lượng kết quả phù hợp
+    }
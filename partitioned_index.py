@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+Index phân vùng kiểu IVF (inverted file) cho qa_collection
+
+Hồ sơ được chia thành các phân vùng, mỗi phân vùng là một collection ChromaDB riêng
+(<alias>_ivf_v<timestamp>_p0..N-1). Mỗi phân vùng có một centroid (vector trung bình đã chuẩn hóa);
+khi tìm kiếm, query chỉ được hỏi ở `nprobe` phân vùng có centroid gần nhất rồi gộp top-K
+bằng sharding.merge_topk → số vector phải so sánh giảm khoảng nlist / nprobe lần.
+
+Hai cách chia phân vùng:
+- "kmeans": k-means cầu (spherical) trên embeddings, nlist mặc định ≈ sqrt(số hồ sơ)
+- "title": nhóm theo chức danh chuẩn hóa (mục đầu tiên của normalized_title, ví dụ
+  "database administrator"): mỗi nhóm có ít nhất MIN_PARTITION_SIZE hồ sơ là một phân vùng
+  và mọi hồ sơ của nhóm nằm trong phân vùng đó; hồ sơ thuộc nhóm nhỏ hơn hoặc không có
+  chức danh được gộp vào phân vùng có centroid gần nhất.
+  Các category query (BE, DBA, NETSEC...) tương ứng với các nhóm chức danh này.
+  Cần populate lại bằng populate_chromadb.py để metadata có normalized_title.
+
+Embeddings được copy từ phiên bản đang phục vụ (không encode lại). Centroids và danh sách
+phân vùng lưu trong ivf_index/ (meta.json ghi kèm phiên bản collection nguồn → biết khi nào
+index đã cũ và cần build lại).
+
+Ví dụ:
+    python partitioned_index.py build --mode kmeans
+    python partitioned_index.py build --mode title
+    python partitioned_index.py bench --nprobe 1 2 4 8 16 --scale 200000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from collection_alias import resolve, collection_version, new_version_name
+from metrics import percentile
+from sharding import merge_topk
+from similar_candidates import knn_blocked
+
+BASE_DIR = Path(__file__).resolve().parent
+STORE_DIR = BASE_DIR / "chromadb_store"
+IVF_DIR = BASE_DIR / "ivf_index"
+REPORT_FILE = BASE_DIR / "ivf_benchmark.json"
+COLLECTION_NAME = "qa_collection"
+PARTITION_MODES = ["kmeans", "title"]
+DEFAULT_NPROBE = 4  # Số phân vùng được hỏi cho mỗi query
+MIN_PARTITION_SIZE = 20  # Mode "title": nhóm nhỏ hơn được gộp vào nhóm gần nhất
+KMEANS_ITERS = 20
+KMEANS_SAMPLE = 100_000  # Số vector tối đa dùng để huấn luyện centroids
+BATCH_SIZE = 100  # Giống populate_chromadb.py
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def assign(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Chỉ số centroid gần nhất của từng vector."""
+    nearest, _ = knn_blocked(embeddings, centroids, 1)
+    return nearest[:, 0]
+
+
+def assign_partitions(embeddings: np.ndarray, metadatas: List[Dict[str, Any]], centroids: np.ndarray,
+                      labels: List[str], mode: str) -> np.ndarray:
+    """
+    Phân vùng của từng hồ sơ: "kmeans" theo centroid gần nhất; "title" theo nhóm chức danh,
+    chỉ hồ sơ có chức danh không thành phân vùng riêng mới theo centroid gần nhất.
+    """
+    assignment = assign(embeddings, centroids)
+    if mode == "title":
+        partition_of = {label: p for p, label in enumerate(labels)}
+        for i, meta in enumerate(metadatas):
+            p = partition_of.get(title_label(meta))
+            if p is not None:
+                assignment[i] = p
+    return assignment
+
+
+def kmeans(embeddings: np.ndarray, nlist: int, iters: int = KMEANS_ITERS, sample: int = KMEANS_SAMPLE,
+           seed: int = 0) -> np.ndarray:
+    """
+    K-means cầu: centroid là trung bình đã chuẩn hóa của các vector trong cụm.
+    Huấn luyện trên tối đa `sample` vector; cụm rỗng được gán lại vector xa centroid nhất.
+    """
+    rng = np.random.default_rng(seed)
+    train = embeddings if len(embeddings) <= sample else embeddings[rng.choice(len(embeddings), sample, replace=False)]
+    nlist = min(nlist, len(train))
+    centroids = normalize(train[rng.choice(len(train), nlist, replace=False)].astype(np.float32))
+    for _ in range(iters):
+        nearest, dist = knn_blocked(train, centroids, 1)
+        labels = nearest[:, 0]
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = np.nonzero(counts == 0)[0]
+        if len(empty):
+            farthest = np.argsort(dist[:, 0])[::-1][:len(empty)]
+            sums[empty] = train[farthest]
+        updated = normalize(sums)
+        shift = float(np.abs(updated - centroids).max())
+        centroids = updated
+        if shift < 1e-4:
+            break
+    return centroids
+
+
+def title_label(meta: Dict[str, Any]) -> str:
+    """Chức danh chuẩn hóa chính: mục đầu tiên của normalized_title, chữ thường."""
+    title = (meta or {}).get("normalized_title") or ""
+    return title.split(",")[0].strip().lower()
+
+
+def title_centroids(embeddings: np.ndarray, metadatas: List[Dict[str, Any]],
+                    min_size: int = MIN_PARTITION_SIZE) -> Tuple[np.ndarray, List[str]]:
+    """Centroid của từng nhóm chức danh có ít nhất min_size hồ sơ."""
+    groups: Dict[str, List[int]] = {}
+    for i, meta in enumerate(metadatas):
+        label = title_label(meta)
+        if label:
+            groups.setdefault(label, []).append(i)
+    labels = sorted((label for label, rows in groups.items() if len(rows) >= min_size),
+                    key=lambda label: -len(groups[label]))
+    if not labels:
+        raise ValueError("Không có nhóm normalized_title nào đủ lớn (cần populate lại hoặc dùng --mode kmeans)")
+    centroids = normalize(np.stack([embeddings[groups[label]].mean(axis=0) for label in labels]))
+    return centroids.astype(np.float32), labels
+
+
+def partition_name(prefix: str, partition: int) -> str:
+    """Tên collection của phân vùng, ví dụ qa_collection_ivf_v20261018_230000_p3."""
+    return f"{prefix}_p{partition}"
+
+
+def write_partitions(client, prefix: str, ids: List[str], embeddings: np.ndarray,
+                     metadatas: List[Dict[str, Any]], assignment: np.ndarray, nlist: int,
+                     batch_size: int = BATCH_SIZE) -> List[int]:
+    """Ghi từng phân vùng vào collection riêng, trả về số hồ sơ mỗi phân vùng."""
+    sizes = []
+    for p in range(nlist):
+        rows = np.nonzero(assignment == p)[0]
+        coll = client.get_or_create_collection(name=partition_name(prefix, p))
+        for j in range(0, len(rows), batch_size):
+            batch = rows[j:j + batch_size]
+            coll.add(ids=[ids[i] for i in batch], embeddings=embeddings[batch].tolist(),
+                     metadatas=[metadatas[i] for i in batch])
+        sizes.append(int(len(rows)))
+    return sizes
+
+
+def train_partitions(embeddings: np.ndarray, metadatas: List[Dict[str, Any]], mode: str,
+                     nlist: Optional[int] = None) -> Tuple[np.ndarray, List[str]]:
+    """Centroids (và nhãn để hiển thị) theo mode."""
+    if mode == "title":
+        return title_centroids(embeddings, metadatas)
+    if mode != "kmeans":
+        raise ValueError(f"Mode không hợp lệ: {mode} (chọn {', '.join(PARTITION_MODES)})")
+    nlist = nlist or max(1, int(round(np.sqrt(len(embeddings)))))
+    centroids = kmeans(embeddings, nlist)
+    return centroids, [f"cluster{i}" for i in range(len(centroids))]
+
+
+def save_index(index_dir: Path, centroids: np.ndarray, meta: Dict[str, Any]):
+    """Ghi centroids + meta.json; meta.json được thay nguyên tử (ghi file tạm rồi đổi tên)."""
+    index_dir.mkdir(parents=True, exist_ok=True)
+    np.save(index_dir / f"centroids_{meta['prefix']}.npy", centroids)
+    tmp = index_dir / "meta.json.tmp"
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, index_dir / "meta.json")
+
+
+def load_meta(index_dir: Path = IVF_DIR) -> Optional[Dict[str, Any]]:
+    path = index_dir / "meta.json"
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build(alias: str = COLLECTION_NAME, mode: str = "kmeans", nlist: Optional[int] = None,
+          index_dir: Path = IVF_DIR) -> Dict[str, Any]:
+    """
+    Build index phân vùng từ phiên bản đang phục vụ của alias. Index cũ vẫn phục vụ cho đến
+    khi meta.json được thay; sau đó các collection phân vùng cũ mới bị xóa.
+    """
+    import chromadb
+    from bulk_match import load_corpus
+
+    start = time.perf_counter()
+    ids, embeddings, metadatas = load_corpus(alias)
+    fetched = time.perf_counter()
+    centroids, labels = train_partitions(embeddings, metadatas, mode, nlist)
+    assignment = assign_partitions(embeddings, metadatas, centroids, labels, mode)
+    trained = time.perf_counter()
+
+    client = chromadb.PersistentClient(path=str(STORE_DIR))
+    prefix = new_version_name(f"{alias}_ivf")
+    try:
+        sizes = write_partitions(client, prefix, ids, embeddings, metadatas, assignment, len(centroids))
+    except BaseException:
+        print(f"Build thất bại, xóa các phân vùng {prefix}_p*...")
+        for p in range(len(centroids)):
+            try:
+                client.delete_collection(name=partition_name(prefix, p))
+            except Exception:
+                pass
+        raise
+    written = time.perf_counter()
+
+    # Nhãn chức danh phổ biến nhất của mỗi phân vùng (để xem phân vùng ứng với nhóm nghề nào)
+    top_titles = [Counter(title_label(metadatas[i]) for i in np.nonzero(assignment == p)[0]).most_common(3)
+                  for p in range(len(centroids))]
+    old_meta = load_meta(index_dir)
+    meta = {
+        "alias": alias,
+        "source": resolve(STORE_DIR, alias),
+        "collection_version": collection_version(STORE_DIR, alias),
+        "mode": mode,
+        "nlist": len(centroids),
+        "prefix": prefix,
+        "labels": labels,
+        "sizes": sizes,
+        "top_titles": [[[t or "(trống)", c] for t, c in tops] for tops in top_titles],
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    save_index(index_dir, centroids, meta)
+
+    if old_meta:
+        for p in range(old_meta["nlist"]):
+            try:
+                client.delete_collection(name=partition_name(old_meta["prefix"], p))
+            except Exception as e:
+                print(f"  Cảnh báo: không xóa được {partition_name(old_meta['prefix'], p)}: {e}")
+        (index_dir / f"centroids_{old_meta['prefix']}.npy").unlink(missing_ok=True)
+
+    return {"rows": len(ids), "mode": mode, "nlist": len(centroids), "sizes": sizes, "labels": labels,
+            "top_titles": meta["top_titles"], "fetch_s": fetched - start, "train_s": trained - fetched,
+            "write_s": written - trained}
+
+
+class PartitionedCollection:
+    """
+    Nhóm collection phân vùng đóng vai trò một collection logic (giống ShardedCollection),
+    nhưng mỗi query chỉ hỏi nprobe phân vùng gần nhất.
+
+    Args:
+        collections: Phần tử thứ i là collection của phân vùng i
+        centroids: (nlist, dim) centroid đã chuẩn hóa
+        sizes: Số hồ sơ mỗi phân vùng (bỏ qua phân vùng rỗng, giới hạn n_results)
+        nprobe: Số phân vùng được hỏi cho mỗi query
+    """
+
+    def __init__(self, collections: List[Any], centroids: np.ndarray, sizes: List[int],
+                 nprobe: int = DEFAULT_NPROBE, max_workers: Optional[int] = None):
+        if len(collections) != len(centroids):
+            raise ValueError("Số collection phải bằng số centroid")
+        self.collections = collections
+        self.centroids = centroids
+        self.sizes = sizes
+        self.nprobe = max(1, min(nprobe, len(collections)))
+        self.meta: Dict[str, Any] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or min(len(collections), 8),
+                                        thread_name_prefix="ivf")
+
+    @classmethod
+    def open(cls, client, index_dir: Path = IVF_DIR, nprobe: int = DEFAULT_NPROBE) -> "PartitionedCollection":
+        meta = load_meta(index_dir)
+        if meta is None:
+            raise FileNotFoundError(f"Chưa có index phân vùng trong {index_dir} (chạy partitioned_index.py build)")
+        centroids = np.load(index_dir / f"centroids_{meta['prefix']}.npy")
+        collections = [client.get_collection(name=partition_name(meta["prefix"], p)) for p in range(meta["nlist"])]
+        coll = cls(collections, centroids, meta["sizes"], nprobe)
+        coll.meta = meta
+        return coll
+
+    def count(self) -> int:
+        return sum(self.sizes)
+
+    def close(self):
+        """Dừng thread pool hỏi các phân vùng."""
+        self._pool.shutdown(wait=True)
+
+    def route(self, query_embeddings: List[List[float]], nprobe: Optional[int] = None) -> np.ndarray:
+        """(Q, nprobe) chỉ số các phân vùng gần nhất của từng query."""
+        q = normalize(np.asarray(query_embeddings, dtype=np.float32))
+        nearest, _ = knn_blocked(q, self.centroids, nprobe or self.nprobe)
+        return nearest
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10,
+              include: Optional[List[str]] = None, nprobe: Optional[int] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Gom các query theo phân vùng được chọn (mỗi phân vùng chỉ một lần collection.query),
+        chạy song song rồi gộp top n_results của từng query bằng merge_topk.
+        """
+        include = list(include or ["metadatas", "distances"])
+        if "distances" not in include:
+            include.append("distances")
+        routes = self.route(query_embeddings, nprobe)
+        by_partition: Dict[int, List[int]] = {}
+        for qi, row in enumerate(routes):
+            for p in row:
+                if p >= 0 and self.sizes[p] > 0:
+                    by_partition.setdefault(int(p), []).append(qi)
+
+        def query_partition(item):
+            p, rows = item
+            return rows, self.collections[p].query(
+                query_embeddings=[query_embeddings[qi] for qi in rows],
+                n_results=min(n_results, self.sizes[p]), include=include, **kwargs)
+
+        per_query: List[List[Dict[str, Any]]] = [[] for _ in query_embeddings]
+        for rows, res in self._pool.map(query_partition, by_partition.items()):
+            for pos, qi in enumerate(rows):
+                per_query[qi].append({key: [res[key][pos]] for key in ["ids"] + include if res.get(key) is not None})
+
+        merged: Dict[str, Any] = {}
+        for candidates in per_query:
+            one = merge_topk(candidates, n_results, 1, include)
+            for key, value in one.items():
+                merged.setdefault(key, []).extend(value)
+        return merged
+
+
+def _jitter(embeddings: np.ndarray, total: int, noise: float, seed: int = 0) -> np.ndarray:
+    """Mở rộng corpus tới `total` vector bằng bản sao có nhiễu (để đo trên corpus lớn)."""
+    rng = np.random.default_rng(seed)
+    extra = total - len(embeddings)
+    if extra <= 0:
+        return embeddings
+    base = embeddings[rng.integers(0, len(embeddings), extra)]
+    copies = normalize(base + rng.normal(0.0, noise, base.shape).astype(np.float32))
+    return np.vstack([embeddings, copies.astype(np.float32)])
+
+
+def benchmark(nprobes: List[int], k: int = 5, mode: str = "kmeans", nlist: Optional[int] = None,
+              scale: Optional[int] = None, noise: float = 0.05, alias: str = COLLECTION_NAME) -> Dict[str, Any]:
+    """
+    Recall@k và độ trễ theo nprobe, so với collection phẳng (một collection chứa tất cả).
+    Ground truth là top-k chính xác (nhân ma trận trên toàn bộ embeddings).
+    Index được build trong thư mục tạm; --scale mở rộng corpus bằng bản sao có nhiễu.
+    """
+    import chromadb
+    from bulk_match import load_corpus
+    from encoders import get_encoder
+    from experiment_grid import read_queries
+
+    ids, embeddings, metadatas = load_corpus(alias)
+    if scale and scale > len(ids):
+        embeddings = _jitter(embeddings, scale, noise)
+        metadatas = metadatas + [metadatas[i % len(metadatas)] for i in range(len(ids), scale)]
+        ids = ids + [f"synthetic_{i}" for i in range(len(ids), scale)]
+    encoder = get_encoder("torch", 'all-MiniLM-L6-v2')
+    queries = [q["query_text"] for q in read_queries()]
+    q_emb = np.asarray(encoder.encode(queries, convert_to_tensor=False, show_progress_bar=False), dtype=np.float32)
+    truth, _ = knn_blocked(q_emb, embeddings, k)
+    truth_ids = [{ids[j] for j in row if j >= 0} for row in truth]
+
+    def measure(collection, **kwargs):
+        latencies, hits = [], 0
+        for emb, expected in zip(q_emb.tolist(), truth_ids):
+            start = time.perf_counter()
+            res = collection.query(query_embeddings=[emb], n_results=k, include=["distances"], **kwargs)
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(expected & set(res["ids"][0]))
+        return {"recall_at_k": hits / max(1, sum(len(t) for t in truth_ids)),
+                "p50_ms": percentile(latencies, 50), "p99_ms": percentile(latencies, 99)}
+
+    report: Dict[str, Any] = {"docs": len(ids), "queries": len(queries), "k": k, "mode": mode, "runs": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        client = chromadb.PersistentClient(path=tmp)
+        flat = client.get_or_create_collection(name="bench_flat")
+        start = time.perf_counter()
+        for j in range(0, len(ids), BATCH_SIZE):
+            flat.add(ids=ids[j:j + BATCH_SIZE], embeddings=embeddings[j:j + BATCH_SIZE].tolist(),
+                     metadatas=metadatas[j:j + BATCH_SIZE])
+        report["flat"] = {"build_s": time.perf_counter() - start, **measure(flat)}
+        print(f"phẳng: {len(ids)} hồ sơ | recall@{k} {report['flat']['recall_at_k']:.3f} | "
+              f"p50 {report['flat']['p50_ms']:.2f} ms | p99 {report['flat']['p99_ms']:.2f} ms")
+
+        start = time.perf_counter()
+        centroids, labels = train_partitions(embeddings, metadatas, mode, nlist)
+        sizes = write_partitions(client, "bench_ivf", ids, embeddings, metadatas,
+                                 assign_partitions(embeddings, metadatas, centroids, labels, mode), len(centroids))
+        report["nlist"] = len(centroids)
+        report["ivf_build_s"] = time.perf_counter() - start
+        ivf = PartitionedCollection([client.get_collection(name=partition_name("bench_ivf", p))
+                                     for p in range(len(centroids))], centroids, sizes)
+        try:
+            for nprobe in sorted(set(n for n in nprobes if n <= len(centroids))):
+                routes = ivf.route(q_emb.tolist(), nprobe)
+                scanned = float(np.mean([sum(sizes[p] for p in row if p >= 0) for row in routes])) / len(ids)
+                run = {"nprobe": nprobe, "scanned_fraction": scanned, **measure(ivf, nprobe=nprobe)}
+                report["runs"].append(run)
+                print(f"nprobe={nprobe:>3}/{len(centroids)}: quét {scanned:6.1%} | recall@{k} {run['recall_at_k']:.3f} | "
+                      f"p50 {run['p50_ms']:.2f} ms | p99 {run['p99_ms']:.2f} ms")
+        finally:
+            ivf.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index phân vùng kiểu IVF")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_build = sub.add_parser("build", help="Build index phân vùng từ collection đang phục vụ")
+    p_build.add_argument("--mode", choices=PARTITION_MODES, default="kmeans")
+    p_build.add_argument("--nlist", type=int, default=None, help="Số phân vùng (kmeans, mặc định ≈ sqrt(N))")
+    p_build.add_argument("--alias", default=COLLECTION_NAME)
+    p_bench = sub.add_parser("bench", help="Recall / độ trễ theo số phân vùng được hỏi")
+    p_bench.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    p_bench.add_argument("--k", type=int, default=5)
+    p_bench.add_argument("--mode", choices=PARTITION_MODES, default="kmeans")
+    p_bench.add_argument("--nlist", type=int, default=None)
+    p_bench.add_argument("--scale", type=int, default=None, help="Mở rộng corpus tới N vector (bản sao có nhiễu)")
+    p_bench.add_argument("--noise", type=float, default=0.05)
+    p_bench.add_argument("--alias", default=COLLECTION_NAME)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        result = build(args.alias, args.mode, args.nlist)
+        print(f"OK {result['rows']} hồ sơ → {result['nlist']} phân vùng ({result['mode']}) | "
+              f"đọc {result['fetch_s']:.1f}s | huấn luyện {result['train_s']:.1f}s | ghi {result['write_s']:.1f}s")
+        for p, (label, size, tops) in enumerate(zip(result["labels"], result["sizes"], result["top_titles"])):
+            titles = ", ".join(f"{t} ({c})" for t, c in tops)
+            print(f"  p{p:<3} {label[:30]:<30} {size:>7} hồ sơ | {titles}")
+    else:
+        report = benchmark(args.nprobe, args.k, args.mode, args.nlist, args.scale, args.noise, args.alias)
+        with REPORT_FILE.open("w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nĐã lưu báo cáo vào: {REPORT_FILE}")
+
+
+if __name__ == "__main__":
+    main()
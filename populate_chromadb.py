@@ -1,12 +1,32 @@
 # -*- coding: utf-8 -*-
 """
 Script populate dữ liệu vào ChromaDB
-Đọc từ resume_CLEANED.csv và thêm vào collection qa_collection
+Đọc từ resume_CLEANED.csv (hoặc nhiều file trong DATA_FILES) và thêm vào collection qa_collection
+
+Nhiều file nguồn được gộp theo person_id trước khi embedding (xem merge_sources):
+mỗi hồ sơ chỉ được encode đúng 1 lần dù xuất hiện ở nhiều file.
+
+Nếu NUM_SHARDS > 1, hồ sơ được chia theo person_id vào các collection
+qa_collection_shard0..N-1 (xem sharding.py). NUM_SHARDS phải giống final_data.py.
+
+Nếu CHUNKING_ENABLED, mỗi hồ sơ được chia thành nhiều chunk giới hạn theo token (không bị
+cắt mất phần ability dài) và nạp vào alias qa_chunks (xem chunking.py).
+
+Build lại (blue/green): dữ liệu được nạp vào phiên bản mới qa_collection_v<timestamp>
+trong khi phiên bản cũ vẫn phục vụ tìm kiếm; xong mới đổi alias sang phiên bản mới
+(xem collection_alias.py) → không có thời gian gián đoạn tìm kiếm.
 """
 import csv
+import os
 import chromadb
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+from encoders import get_encoder
+from batching import encode_scheduled, TOKEN_BUDGET
+from autotune import tune_token_budget, AdaptiveTokenBudget, default_memory_budget_mb
+from sharding import ShardedCollection, shard_name
+from chunking import chunk_records, CHUNK_COLLECTION_NAME, CHUNK_TOKENS
+from collection_alias import resolve, new_version_name, publish, bump_generation, record_model, KEEP_VERSIONS
 try:
     from tqdm import tqdm
     HAS_TQDM = True
@@ -16,117 +36,286 @@ except ImportError:
         return iterable
 
 BASE_DIR = Path(__file__).resolve().parent
+STORE_DIR = BASE_DIR / "chromadb_store"
 DATA_FILE = BASE_DIR / "resume_CLEANED.csv"
+DATA_FILES = [DATA_FILE]  # Có thể thêm data.csv, Moredata.csv... → gộp theo person_id
+CONFLICT_RULE = "first"  # Khi trùng person_id: "first", "last" hoặc "most_complete"
 COLLECTION_NAME = "qa_collection"
+NUM_SHARDS = 1  # > 1: chia collection thành N shard theo person_id
+BATCH_SIZE = 100  # Số dòng mỗi lần collection.add
+SCHEDULE_WINDOW = 5000  # Số dòng được lập lịch encode cùng nhau (giới hạn RAM)
+AUTOTUNE_BATCH = True  # Đo thử vài token budget lúc khởi động, chọn cái nhanh nhất vừa RAM
+MEMORY_BUDGET_MB = None  # None: 50% RAM còn trống (xem autotune.py)
+AUTOTUNE_SAMPLE = 256  # Số hồ sơ dùng để đo thử
+ENCODER_BACKEND = "torch"  # "torch", "onnx" hoặc "onnx-int8" (xem encoders.py)
+EMBEDDING_MODEL = 'all-MiniLM-L6-v2'  # Được ghi vào manifest alias (xem collection_alias.built_with)
+CONFLICT_RULES = ["first", "last", "most_complete"]
+EMBED_FIELDS = ["title", "skill", "ability", "program"]  # Các cột CSV được ghép thành text embedding
+CHUNKING_ENABLED = False  # True: chia hồ sơ thành chunk <= CHUNK_TOKENS token vào CHUNK_COLLECTION_NAME (xem chunking.py)
 
-# Khởi tạo model embedding (phải cùng model với final_data.py)
-model = SentenceTransformer('all-MiniLM-L6-v2')
-
-# Kết nối ChromaDB
-print("Ket noi ChromaDB...")
-client = chromadb.PersistentClient(path=str(BASE_DIR / "chromadb_store"))
-collection = client.get_or_create_collection(name=COLLECTION_NAME)
-
-# Kiểm tra số lượng hiện tại
-current_count = collection.count()
-print(f"So luong documents hien tai: {current_count}")
-
-if current_count > 0:
-    response = input(f"Collection da co {current_count} documents. Ban co muon xoa va them lai? (y/n): ")
-    if response.lower() == 'y':
-        print("Xoa collection cu...")
-        client.delete_collection(name=COLLECTION_NAME)
-        collection = client.get_or_create_collection(name=COLLECTION_NAME)
-        print("Da xoa xong.")
-    else:
-        print("Giu nguyen collection. Them du lieu moi vao...")
-
-# Đọc dữ liệu từ CSV
-print(f"\nDang doc du lieu tu {DATA_FILE}...")
-if not DATA_FILE.exists():
-    print(f"LOI: Khong tim thay file {DATA_FILE}")
-    exit(1)
 
-rows = []
-with DATA_FILE.open("r", encoding="utf-8", newline="") as f:
+def _reader(f) -> csv.DictReader:
+    """DictReader với tên cột đã bỏ khoảng trắng (header một số file có tab thừa sau normalized_title)."""
     reader = csv.DictReader(f)
-    for row in reader:
-        rows.append(row)
-
-print(f"Da doc duoc {len(rows)} records")
-
-# Chuẩn bị dữ liệu để thêm vào ChromaDB
-print("\nDang chuan bi du lieu va tao embeddings...")
-ids = []
-embeddings = []
-metadatas = []
-
-batch_size = 100  # Xử lý theo batch để tránh hết RAM
-
-for i in tqdm(range(0, len(rows), batch_size), desc="Xu ly batches"):
-    batch_rows = rows[i:i+batch_size]
-    
-    batch_ids = []
-    batch_texts = []
-    batch_metadatas = []
-    
-    for row in batch_rows:
-        person_id = row.get("person_id", "").strip()
-        if not person_id:
-            continue
-        
-        # Tạo text để embedding (kết hợp title, skills, abilities, program)
-        title = row.get("title", "").strip()
-        skills = row.get("skill", "").strip()
-        abilities = row.get("ability", "").strip()
-        program = row.get("program", "").strip()
-        
-        # Kết hợp các trường thành một text để tạo embedding
-        combined_text = f"{title}. {skills}. {abilities}. {program}".strip()
-        
-        if not combined_text:
+    if reader.fieldnames:
+        reader.fieldnames = [(name or "").strip() for name in reader.fieldnames]
+    return reader
+
+
+def load_rows(path: Path) -> List[Dict[str, str]]:
+    """Đọc tất cả dòng từ file CSV."""
+    rows = []
+    with path.open("r", encoding="utf-8", newline="") as f:
+        reader = _reader(f)
+        for row in reader:
+            rows.append(row)
+    return rows
+
+
+def iter_rows(path: Path) -> Iterator[Dict[str, str]]:
+    """Đọc từng dòng CSV (không giữ cả file trong bộ nhớ)."""
+    with path.open("r", encoding="utf-8", newline="") as f:
+        yield from _reader(f)
+
+
+def _completeness(row: Dict[str, str]) -> int:
+    """Số trường dùng để embedding có nội dung (dùng cho CONFLICT_RULE = "most_complete")."""
+    return sum(1 for field in EMBED_FIELDS if (row.get(field) or "").strip())
+
+
+def merge_sources(paths: List[Path], rule: str = CONFLICT_RULE) -> Tuple[List[Dict[str, str]], Dict[str, Any]]:
+    """
+    Gộp nhiều file CSV theo person_id, đọc lần lượt từng dòng.
+
+    Mỗi person_id chỉ giữ 1 dòng (giữ vị trí lần xuất hiện đầu tiên), chọn theo `rule`:
+    - "first": giữ dòng gặp trước
+    - "last": dòng gặp sau ghi đè dòng trước
+    - "most_complete": giữ dòng có nhiều trường title/skill/ability/program hơn (hòa thì giữ dòng trước)
+
+    Returns:
+        (rows đã gộp, thống kê: số dòng đọc mỗi file, số trùng = số lần encode tiết kiệm được, ...)
+    """
+    if rule not in CONFLICT_RULES:
+        raise ValueError(f"CONFLICT_RULE khong hop le: {rule} (chon {', '.join(CONFLICT_RULES)})")
+    merged: Dict[str, Dict[str, str]] = {}
+    stats = {"files": {}, "rows_read": 0, "missing_id": 0, "duplicates": 0, "replaced": 0}
+    for path in paths:
+        count = 0
+        for row in iter_rows(path):
+            count += 1
+            person_id = (row.get("person_id") or "").strip()
+            if not person_id:
+                stats["missing_id"] += 1
+                continue
+            existing = merged.get(person_id)
+            if existing is None:
+                merged[person_id] = row
+                continue
+            stats["duplicates"] += 1
+            if rule == "last" or (rule == "most_complete" and _completeness(row) > _completeness(existing)):
+                merged[person_id] = row
+                stats["replaced"] += 1
+        stats["files"][path.name] = count
+        stats["rows_read"] += count
+    stats["unique"] = len(merged)
+    stats["encodes_avoided"] = stats["duplicates"]
+    return list(merged.values()), stats
+
+
+def row_to_record(row: Dict[str, str]) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+    """
+    Chuyển một dòng CSV thành (id, text để embedding, metadata).
+    Trả về None nếu dòng không có person_id hoặc không có nội dung.
+    """
+    person_id = row.get("person_id", "").strip()
+    if not person_id:
+        return None
+
+    # Tạo text để embedding (kết hợp title, skills, abilities, program)
+    title = row.get("title", "").strip()
+    skills = row.get("skill", "").strip()
+    abilities = row.get("ability", "").strip()
+    program = row.get("program", "").strip()
+    normalized_title = (row.get("normalized_title") or "").strip()  # Nhóm chức danh, dùng cho partitioned_index.py
+
+    # Kết hợp các trường thành một text để tạo embedding
+    combined_text = f"{title}. {skills}. {abilities}. {program}".strip()
+
+    if not combined_text:
+        return None
+
+    return str(person_id), combined_text, {
+        "person_id": person_id,
+        "title": title,
+        "skills": skills,
+        "abilities": abilities,
+        "program": program,
+        "normalized_title": normalized_title,
+    }
+
+
+def ingest(collection, rows: List[Dict[str, str]], model, batch_size: int = BATCH_SIZE,
+           window: int = SCHEDULE_WINDOW, budget: Optional[AdaptiveTokenBudget] = None,
+           chunk_tokens: Optional[int] = None) -> int:
+    """
+    Tạo embeddings và thêm vào collection (collection thường hoặc ShardedCollection).
+
+    Mỗi cửa sổ `window` dòng được encode bằng các batch theo token budget (xem batching.py):
+    text được sắp theo độ dài token nên ít phải pad, embedding được đặt lại đúng thứ tự
+    trước khi collection.add theo từng batch `batch_size` dòng.
+    Nếu có `budget`, token budget tự giảm khi gần hết bộ nhớ (xem autotune.py).
+    Nếu có `chunk_tokens`, mỗi hồ sơ được chia thành các chunk <= chunk_tokens token (xem chunking.py).
+
+    Returns:
+        Số records (hoặc chunk) đã thêm
+    """
+    added = 0
+    for i in tqdm(range(0, len(rows), window), desc="Xu ly batches"):
+        records = [r for r in (row_to_record(row) for row in rows[i:i+window]) if r is not None]
+        if chunk_tokens:
+            records = chunk_records(records, model, chunk_tokens)
+        if not records:
             continue
-        
-        batch_ids.append(str(person_id))
-        batch_texts.append(combined_text)
-        batch_metadatas.append({
-            "person_id": person_id,
-            "title": title,
-            "skills": skills,
-            "abilities": abilities,
-            "program": program,
-        })
-    
-    if not batch_texts:
-        continue
-    
-    # Tạo embeddings cho batch này
-    batch_embeddings = model.encode(batch_texts, convert_to_tensor=False, show_progress_bar=False)
-    
-    # Thêm vào ChromaDB
-    collection.add(
-        ids=batch_ids,
-        embeddings=batch_embeddings.tolist(),
-        metadatas=batch_metadatas
+
+        # Tạo embeddings cho cả cửa sổ (thứ tự giống records)
+        texts = [r[1] for r in records]
+        embeddings = budget.encode(model, texts) if budget else encode_scheduled(model, texts)
+
+        # Thêm vào ChromaDB (ShardedCollection tự chia batch và ghi song song vào các shard)
+        for j in range(0, len(records), batch_size):
+            batch = records[j:j+batch_size]
+            collection.add(
+                ids=[r[0] for r in batch],
+                embeddings=embeddings[j:j+batch_size].tolist(),
+                metadatas=[r[2] for r in batch]
+            )
+        added += len(records)
+    return added
+
+
+def open_collection(client, name: str = COLLECTION_NAME, num_shards: int = NUM_SHARDS):
+    """Mở collection đơn hoặc nhóm shard tùy theo num_shards."""
+    if num_shards > 1:
+        return ShardedCollection.open(STORE_DIR, name, num_shards, client=client)
+    return client.get_or_create_collection(name=name)
+
+
+def delete_collection(client, name: str = COLLECTION_NAME, num_shards: int = NUM_SHARDS):
+    """Xóa collection đơn hoặc tất cả shard."""
+    names = [shard_name(name, i) for i in range(num_shards)] if num_shards > 1 else [name]
+    for n in names:
+        client.delete_collection(name=n)
+
+
+def main():
+    # Khởi tạo model embedding (phải cùng model với final_data.py)
+    model = get_encoder(ENCODER_BACKEND, EMBEDDING_MODEL)
+
+    # Kết nối ChromaDB
+    print("Ket noi ChromaDB...")
+    client = chromadb.PersistentClient(path=str(STORE_DIR))
+    alias = CHUNK_COLLECTION_NAME if CHUNKING_ENABLED else COLLECTION_NAME
+    current_name = resolve(STORE_DIR, alias)
+    collection = open_collection(client, current_name)
+    target_name = None  # Tên phiên bản mới nếu build blue/green
+
+    # Kiểm tra số lượng hiện tại
+    current_count = collection.count()
+    print(f"Collection dang phuc vu: {current_name}")
+    print(f"So luong documents hien tai: {current_count}")
+
+    if current_count > 0:
+        response = input(f"Collection da co {current_count} documents. Ban co muon build lai tu dau? (y/n): ")
+        if response.lower() == 'y':
+            # Không xóa collection cũ: build vào phiên bản mới, collection cũ vẫn phục vụ tìm kiếm
+            target_name = new_version_name(alias)
+            print(f"Se build phien ban moi {target_name} ({current_name} van phuc vu tim kiem)")
+        else:
+            print("Giu nguyen collection. Them du lieu moi vao...")
+
+    # Đọc và gộp dữ liệu từ các file CSV (mỗi person_id chỉ encode 1 lần)
+    print(f"\nDang doc du lieu tu {', '.join(p.name for p in DATA_FILES)}...")
+    for path in DATA_FILES:
+        if not path.exists():
+            print(f"LOI: Khong tim thay file {path}")
+            exit(1)
+
+    rows, merge_stats = merge_sources(DATA_FILES, CONFLICT_RULE)
+    for name, count in merge_stats["files"].items():
+        print(f"  {name}: {count} dong")
+    print(f"Da doc duoc {merge_stats['rows_read']} dong -> {merge_stats['unique']} ho so khac nhau "
+          f"(trung: {merge_stats['duplicates']}, thay the theo '{CONFLICT_RULE}': {merge_stats['replaced']}, "
+          f"thieu person_id: {merge_stats['missing_id']})")
+
+    if target_name:
+        collection = open_collection(client, target_name)
+
+    # Chọn token budget cho bước encode
+    memory_budget = MEMORY_BUDGET_MB or default_memory_budget_mb()
+    token_budget = TOKEN_BUDGET
+    if AUTOTUNE_BATCH and rows:
+        sample = [r[1] for r in (row_to_record(row) for row in rows[:AUTOTUNE_SAMPLE]) if r is not None]
+        print(f"\nDo thu token budget tren {len(sample)} ho so...")
+        tuning = tune_token_budget(model, sample, memory_budget)
+        for probe in tuning["probes"]:
+            if "error" in probe:
+                print(f"  budget {probe['token_budget']:>6}: {probe['error']}")
+            else:
+                print(f"  budget {probe['token_budget']:>6}: {probe['texts_per_sec']:8.1f} texts/s | "
+                      f"peak RSS {probe['peak_rss_mb']:.0f} MB{'' if probe['fits'] else ' (vuot budget)'}")
+        token_budget = tuning["token_budget"]
+    print(f"Token budget: {token_budget} | Memory budget: "
+          f"{f'{memory_budget:.0f} MB' if memory_budget else 'khong gioi han'} | CPU: {os.cpu_count()}")
+    budget = AdaptiveTokenBudget(token_budget, memory_budget)
+
+    # Chuẩn bị dữ liệu để thêm vào ChromaDB
+    print("\nDang chuan bi du lieu va tao embeddings...")
+    try:
+        added = ingest(collection, rows, model, budget=budget,
+                       chunk_tokens=CHUNK_TOKENS if CHUNKING_ENABLED else None)
+    except BaseException:
+        if target_name:
+            # Build dở dang: xóa phiên bản mới, alias vẫn trỏ vào phiên bản cũ
+            print(f"Build that bai, xoa phien ban dang build {target_name}...")
+            delete_collection(client, target_name)
+        raise
+    print(f"Da encode {added} {'chunk' if CHUNKING_ENABLED else 'ho so'}, tiet kiem {merge_stats['encodes_avoided']} lan encode nho gop trung")
+    record_model(STORE_DIR, alias, target_name or current_name, EMBEDDING_MODEL)
+
+    if target_name:
+        # Đổi alias nguyên tử sang phiên bản mới, sau đó dọn các phiên bản quá hạn
+        retired = publish(STORE_DIR, alias, target_name, keep=KEEP_VERSIONS)
+        print(f"\nOK Da chuyen alias {alias}: {current_name} -> {target_name}")
+        for old_name in retired:
+            print(f"Xoa phien ban cu: {old_name}")
+            try:
+                delete_collection(client, old_name)
+            except Exception as e:
+                print(f"  Canh bao: khong xoa duoc {old_name}: {e}")
+    else:
+        # Thêm dữ liệu vào phiên bản đang phục vụ → báo cho cache kết quả tìm kiếm biết
+        bump_generation(STORE_DIR, alias)
+
+    # Kiem tra ket qua
+    final_count = collection.count()
+    print(f"\nOK Hoan thanh! So luong documents trong collection: {final_count}")
+
+    # Test query
+    print("\nThu query de kiem tra...")
+    test_query = "software developer"
+    q_emb = model.encode([test_query], convert_to_tensor=False)[0].tolist()
+    results = collection.query(
+        query_embeddings=[q_emb],
+        n_results=3,
+        include=["metadatas", "distances"]
     )
 
-# Kiem tra ket qua
-final_count = collection.count()
-print(f"\nOK Hoan thanh! So luong documents trong collection: {final_count}")
-
-# Test query
-print("\nThu query de kiem tra...")
-test_query = "software developer"
-q_emb = model.encode([test_query], convert_to_tensor=False)[0].tolist()
-results = collection.query(
-    query_embeddings=[q_emb],
-    n_results=3,
-    include=["metadatas", "distances"]
-)
-
-if results.get("ids") and results["ids"][0]:
-    print(f"OK Query test thanh cong! Tim thay {len(results['ids'][0])} ket qua")
-    print(f"  Document dau tien: person_id={results['metadatas'][0][0].get('person_id')}")
-else:
-    print("X Query test khong tim thay ket qua")
+    if results.get("ids") and results["ids"][0]:
+        print(f"OK Query test thanh cong! Tim thay {len(results['ids'][0])} ket qua")
+        print(f"  Document dau tien: person_id={results['metadatas'][0][0].get('person_id')}")
+    else:
+        print("X Query test khong tim thay ket qua")
+
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Tìm trước (prefetch) kết quả của các query kế tiếp trong lúc người dùng đang đánh giá
+
+Khi đánh giá thủ công, process_queries dừng ở input() trong lúc người dùng đọc kết quả.
+Prefetcher dùng thời gian đó để chạy trước hàm tìm kiếm + tính metrics cho `depth` query
+tiếp theo trên một thread nền duy nhất:
+- Các query được xử lý đúng thứ tự như khi chạy tuần tự (cache / semantic cache
+  cho ra kết quả giống hệt), chỉ sớm hơn
+- Kết quả chỉ được lấy ra (và lưu file) ở thread chính, theo thứ tự → file kết quả không đổi
+- Khi dừng giữa chừng, các query đã tìm trước nhưng chưa đánh giá bị bỏ đi
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable, Dict, List, Any, Optional
+
+
+class Prefetcher:
+    """
+    Args:
+        fn: Hàm xử lý một phần tử (ví dụ tìm kiếm + tính metrics cho một query)
+        items: Danh sách phần tử theo thứ tự xử lý; None = bỏ qua (không gọi fn)
+        depth: Số phần tử được chạy trước phần tử đang lấy ra
+    """
+
+    def __init__(self, fn: Callable[[Any], Any], items: List[Optional[Any]], depth: int = 3):
+        self.fn = fn
+        self.items = items
+        self.depth = max(depth, 0)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._futures: Dict[int, Future] = {}
+        self._submitted = 0  # Chỉ số phần tử tiếp theo chưa được gửi cho thread nền
+        self.ready = 0       # Số lần kết quả đã có sẵn khi được lấy ra
+        self.waited = 0      # Số lần phải chờ
+        self.wait_seconds = 0.0
+
+    def _fill(self, upto: int):
+        while self._submitted <= min(upto, len(self.items) - 1):
+            item = self.items[self._submitted]
+            if item is not None:
+                self._futures[self._submitted] = self._executor.submit(self.fn, item)
+            self._submitted += 1
+
+    def get(self, index: int) -> Any:
+        """Lấy kết quả của items[index] (chờ nếu chưa xong), đồng thời gửi trước các phần tử kế tiếp."""
+        self._fill(index + self.depth)
+        future = self._futures.pop(index)
+        if future.done():
+            self.ready += 1
+            result = future.result()
+        else:
+            self.waited += 1
+            start = time.perf_counter()
+            result = future.result()
+            self.wait_seconds += time.perf_counter() - start
+        return result
+
+    def close(self):
+        """Hủy các phần tử chưa chạy; phần tử đang chạy được chờ cho xong."""
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.ready + self.waited
+        return {
+            "depth": self.depth,
+            "ready": self.ready,
+            "waited": self.waited,
+            "ready_rate": self.ready / lookups if lookups else 0.0,
+            "wait_seconds": self.wait_seconds,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Kho nhãn đánh giá (qrels) dùng lại giữa các lần chạy
+
+Mỗi nhãn gắn với cặp (query_id, person_id), không phụ thuộc lần chạy hay phiên bản collection:
+build lại collection rồi chạy lại thì các cặp đã được đánh giá tự động lấy nhãn cũ,
+người đánh giá chỉ phải xem các cặp mới.
+
+Lưu trong SQLite (qrels.sqlite3), khóa chính (query_id, person_id) nên tra cứu
+theo query là một lần quét index.
+
+Ví dụ:
+    python qrels.py                      # Thống kê kho nhãn
+    python qrels.py --export qrels.tsv   # Xuất dạng TREC qrels: query_id 0 person_id label
+"""
+import argparse
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent
+QRELS_FILE = BASE_DIR / "qrels.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS judgments (
+    query_id   TEXT NOT NULL,
+    person_id  TEXT NOT NULL,
+    label      INTEGER NOT NULL,
+    source     TEXT NOT NULL,
+    judged_at  TEXT NOT NULL,
+    PRIMARY KEY (query_id, person_id)
+) WITHOUT ROWID
+"""
+
+
+class JudgmentStore:
+    """
+    Args:
+        path: File SQLite (tự tạo nếu chưa có)
+    """
+
+    def __init__(self, path: Path = QRELS_FILE):
+        self.path = path
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self.reused = 0  # Số nhãn lấy lại từ kho trong lần chạy này
+        self.added = 0   # Số nhãn mới ghi vào kho trong lần chạy này
+
+    def lookup(self, query_id: str, person_ids: Iterable[str]) -> Dict[str, int]:
+        """Nhãn đã có cho các person_id của query_id (cặp chưa đánh giá không có trong kết quả)."""
+        wanted = {str(pid) for pid in person_ids}
+        rows = self._conn.execute(
+            "SELECT person_id, label FROM judgments WHERE query_id = ?", (str(query_id),))
+        known = {pid: label for pid, label in rows if pid in wanted}
+        self.reused += len(known)
+        return known
+
+    def record(self, query_id: str, labels: Dict[str, int], source: str = "manual"):
+        """Ghi (hoặc ghi đè) nhãn cho các cặp (query_id, person_id), commit ngay."""
+        if not labels:
+            return
+        now = datetime.now().isoformat(timespec="seconds")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO judgments (query_id, person_id, label, source, judged_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(str(query_id), str(pid), int(label), source, now) for pid, label in labels.items()])
+        self._conn.commit()
+        self.added += len(labels)
+
+    def all_judgments(self) -> List[Tuple[str, str, int, str]]:
+        return list(self._conn.execute(
+            "SELECT query_id, person_id, label, source FROM judgments ORDER BY query_id, person_id"))
+
+    def stats(self) -> Dict[str, Any]:
+        total, queries, relevant = self._conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT query_id), COALESCE(SUM(label), 0) FROM judgments").fetchone()
+        return {"judgments": total, "queries": queries, "relevant": relevant,
+                "reused": self.reused, "added": self.added}
+
+    def close(self):
+        self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thống kê / xuất kho nhãn đánh giá")
+    parser.add_argument("--db", type=Path, default=QRELS_FILE)
+    parser.add_argument("--export", type=Path, default=None, help="Xuất file TREC qrels")
+    args = parser.parse_args()
+
+    store = JudgmentStore(args.db)
+    stats = store.stats()
+    print(f"{args.db}: {stats['judgments']} nhãn cho {stats['queries']} queries "
+          f"({stats['relevant']} phù hợp)")
+    if args.export:
+        with args.export.open("w", encoding="utf-8") as f:
+            for query_id, person_id, label, _ in store.all_judgments():
+                f.write(f"{query_id}\t0\t{person_id}\t{label}\n")
+        print(f"Đã xuất vào: {args.export}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Cache kết quả tìm kiếm theo query (khớp chính xác sau khi chuẩn hóa)
+
+- Key: (query đã chuẩn hóa, k, phiên bản collection)
+- LRU trong bộ nhớ, tùy chọn lưu ra file JSON để dùng lại giữa các lần chạy
+- Phiên bản collection đổi (populate_chromadb.py build lại hoặc thêm dữ liệu) → các entry cũ
+  không bao giờ được trả về nữa và bị dọn bởi invalidate()
+- Counter hits / misses / evictions để chọn kích thước cache
+"""
+import copy
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+
+def normalize_query(text: str) -> str:
+    """Chữ thường, gộp khoảng trắng: "  Python   Dev " → "python dev"."""
+    return " ".join(text.lower().split())
+
+
+class QueryResultCache:
+    """
+    LRU cache cho kết quả search_top5.
+
+    Args:
+        max_entries: Số entry tối đa, quá thì bỏ entry dùng lâu nhất
+        persist_path: File JSON để load()/save() (None = chỉ trong bộ nhớ)
+    """
+
+    def __init__(self, max_entries: int = 1024, persist_path: Optional[Path] = None):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self._entries: "OrderedDict[Tuple[str, int, str], List[Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, query: str, k: int, version: str) -> Optional[List[Dict[str, Any]]]:
+        key = (normalize_query(query), k, version)
+        results = self._entries.get(key)
+        if results is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(results)  # Người gọi có thể sửa kết quả mà không làm hỏng cache
+
+    def put(self, query: str, k: int, version: str, results: List[Dict[str, Any]]):
+        key = (normalize_query(query), k, version)
+        self._entries[key] = copy.deepcopy(results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, current_version: Optional[str] = None) -> int:
+        """Xóa entry của các phiên bản khác current_version (None = xóa hết). Trả về số entry đã xóa."""
+        stale = [key for key in self._entries if current_version is None or key[2] != current_version]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def load(self, current_version: Optional[str] = None) -> int:
+        """Đọc cache từ persist_path, bỏ entry không thuộc current_version. Trả về số entry đã nạp."""
+        if not self.persist_path or not self.persist_path.exists():
+            return 0
+        with self.persist_path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        for query, k, version, results in data.get("entries", []):
+            if current_version is None or version == current_version:
+                self._entries[(query, k, version)] = results
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return len(self._entries)
+
+    def save(self):
+        """Ghi cache ra persist_path (ghi file tạm rồi os.replace)."""
+        if not self.persist_path:
+            return
+        tmp_path = self.persist_path.with_name(self.persist_path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"entries": [[q, k, v, r] for (q, k, v), r in self._entries.items()]},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self.persist_path)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Re-rank giai đoạn 2 bằng cross-encoder (chạy trên CPU)
+
+Chức năng:
+- Nhận top-N ứng viên từ ChromaDB và chấm điểm tất cả cặp (query, hồ sơ)
+  trong MỘT lần gọi cross-encoder theo batch
+- Cache điểm của từng cặp để không chấm lại khi query lặp lại
+- Giữ ngân sách độ trễ cho mỗi query bằng cách tự thu nhỏ N
+"""
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple
+
+
+def resume_text(result: Dict[str, Any]) -> str:
+    """Ghép các trường của hồ sơ giống hệt combined_text trong populate_chromadb.py."""
+    return (f"{result.get('title', '')}. {result.get('skills', '')}. "
+            f"{result.get('abilities', '')}. {result.get('program', '')}").strip()
+
+
+class CrossEncoderReranker:
+    """
+    Re-rank kết quả tìm kiếm bằng cross-encoder.
+
+    Ngân sách độ trễ: sau mỗi lần chấm điểm, thời gian trung bình cho một cặp
+    được cập nhật (EMA). Số ứng viên N cho query tiếp theo là số cặp lớn nhất
+    chấm được trong `latency_budget_ms`, nằm trong khoảng [min_top_n, top_n].
+    """
+
+    def __init__(self, model_name: str, top_n: int = 50, min_top_n: int = 10,
+                 latency_budget_ms: float = 200.0, batch_size: int = 64,
+                 cache_size: int = 20000):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.top_n = top_n
+        self.min_top_n = min(min_top_n, top_n)
+        self.latency_budget_ms = latency_budget_ms
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self._ms_per_pair = None  # Chưa đo → dùng top_n cho query đầu tiên
+        self.last_top_n = top_n
+
+    def candidate_count(self) -> int:
+        """Số ứng viên N nên lấy từ ChromaDB cho query tiếp theo."""
+        if not self._ms_per_pair:
+            n = self.top_n
+        else:
+            affordable = int(self.latency_budget_ms / self._ms_per_pair)
+            n = max(self.min_top_n, min(self.top_n, affordable))
+        self.last_top_n = n
+        return n
+
+    def _score_pairs(self, query: str, candidates: List[Dict[str, Any]]) -> List[float]:
+        """Chấm điểm các cặp, chỉ gọi model cho những cặp chưa có trong cache."""
+        scores: List[float] = [0.0] * len(candidates)
+        missing = []
+        for idx, cand in enumerate(candidates):
+            key = (query, str(cand.get("person_id")))
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                scores[idx] = self._cache[key]
+            else:
+                missing.append(idx)
+
+        if missing:
+            pairs = [(query, resume_text(candidates[i])) for i in missing]
+            start = time.perf_counter()
+            predicted = self.model.predict(pairs, batch_size=self.batch_size,
+                                           show_progress_bar=False)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            per_pair = elapsed_ms / len(pairs)
+            # EMA để N thay đổi mượt, không giật theo một query đơn lẻ
+            self._ms_per_pair = (per_pair if self._ms_per_pair is None
+                                 else 0.8 * self._ms_per_pair + 0.2 * per_pair)
+
+            for i, score in zip(missing, predicted):
+                key = (query, str(candidates[i].get("person_id")))
+                self._cache[key] = float(score)
+                scores[i] = float(score)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]], k: int = 5) -> List[Dict[str, Any]]:
+        """Sắp xếp lại ứng viên theo điểm cross-encoder và trả về top k."""
+        if not candidates:
+            return []
+        scores = self._score_pairs(query, candidates)
+        ranked = sorted(zip(candidates, scores), key=lambda x: x[1], reverse=True)
+        items = []
+        for cand, score in ranked[:k]:
+            item = dict(cand)
+            item["rerank_score"] = score  # Giữ nguyên distance gốc để tính metrics
+            items.append(item)
+        return items
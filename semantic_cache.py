@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Cache ngữ nghĩa cho các query gần trùng nhau (paraphrase)
+
+Giữ embedding của các query gần đây trong một ring buffer NumPy. Query mới có embedding
+nằm trong bán kính cosine `radius` (cosine distance = 1 - cosine) so với một query đã cache
+→ dùng lại top-K của query đó, bỏ qua collection.query().
+
+Với vài trăm query, nhân ma trận (capacity x dim) · (dim,) là tìm kiếm chính xác và chỉ
+mất vài micro giây, nên không cần thêm thư viện ANN riêng.
+"""
+import copy
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+
+class SemanticQueryCache:
+    """
+    Args:
+        capacity: Số query tối đa giữ lại (cũ nhất bị ghi đè trước)
+        radius: Cosine distance tối đa để coi là cùng một query (ví dụ 0.05 ≈ cosine >= 0.95)
+    """
+
+    def __init__(self, capacity: int = 512, radius: float = 0.05):
+        self.capacity = capacity
+        self.radius = radius
+        self._vectors: Optional[np.ndarray] = None  # (capacity, dim), đã chuẩn hóa L2
+        self._keys: List[Optional[tuple]] = [None] * capacity  # (k, version) của từng slot
+        self._results: List[Optional[List[Dict[str, Any]]]] = [None] * capacity
+        self._next = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def lookup(self, embedding, k: int, version: str) -> Optional[List[Dict[str, Any]]]:
+        """Trả về kết quả của query đã cache gần nhất nếu nằm trong bán kính, ngược lại None."""
+        if self._vectors is None:
+            self.misses += 1
+            return None
+        sims = self._vectors @ self._normalize(embedding)
+        valid = np.array([key == (k, version) for key in self._keys])
+        if not valid.any():
+            self.misses += 1
+            return None
+        sims = np.where(valid, sims, -np.inf)
+        best = int(np.argmax(sims))
+        if 1.0 - sims[best] <= self.radius:
+            self.hits += 1
+            return copy.deepcopy(self._results[best])
+        self.misses += 1
+        return None
+
+    def add(self, embedding, k: int, version: str, results: List[Dict[str, Any]]):
+        vec = self._normalize(embedding)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.capacity, vec.shape[0]), dtype=np.float32)
+        slot = self._next
+        self._vectors[slot] = vec
+        self._keys[slot] = (k, version)
+        self._results[slot] = copy.deepcopy(results)
+        self._next = (slot + 1) % self.capacity
+
+    def invalidate(self, current_version: Optional[str] = None):
+        """Bỏ các slot không thuộc current_version (None = bỏ hết)."""
+        for slot, key in enumerate(self._keys):
+            if key is not None and (current_version is None or key[1] != current_version):
+                self._keys[slot] = None
+                self._results[slot] = None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": sum(1 for key in self._keys if key is not None),
+            "capacity": self.capacity,
+            "radius": self.radius,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
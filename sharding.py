@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Chia shard collection theo person_id và tìm kiếm scatter-gather
+
+Chức năng:
+- Hash-partition hồ sơ theo person_id vào N collection (qa_collection_shard0..N-1),
+  tùy chọn mỗi shard một thư mục store riêng
+- add(): chia batch theo shard và ghi song song
+- query(): hỏi tất cả shard song song (thread pool), gộp top-K của từng shard bằng heap
+
+ShardedCollection trả về kết quả cùng dạng với collection.query() của ChromaDB,
+nên search_top5 trong final_data.py dùng được mà không cần sửa.
+"""
+import heapq
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import chromadb
+
+
+def shard_for(person_id: Any, num_shards: int) -> int:
+    """Shard của một person_id (crc32 ổn định giữa các lần chạy, khác với hash())."""
+    return zlib.crc32(str(person_id).encode("utf-8")) % num_shards
+
+
+def shard_name(base_name: str, shard: int) -> str:
+    """Tên collection của shard, ví dụ qa_collection_shard3."""
+    return f"{base_name}_shard{shard}"
+
+
+class ShardedCollection:
+    """
+    Nhóm N collection ChromaDB đóng vai trò một collection logic.
+
+    Args:
+        collections: Danh sách collection, phần tử thứ i là shard i
+        max_workers: Số thread cho scatter-gather (mặc định = số shard)
+    """
+
+    def __init__(self, collections: List[Any], max_workers: Optional[int] = None):
+        if not collections:
+            raise ValueError("Cần ít nhất 1 shard")
+        self.collections = collections
+        self.num_shards = len(collections)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or self.num_shards,
+                                        thread_name_prefix="shard")
+
+    @classmethod
+    def open(cls, store_dir: Path, base_name: str, num_shards: int,
+             separate_dirs: bool = False, client=None) -> "ShardedCollection":
+        """
+        Mở (hoặc tạo) N shard.
+
+        separate_dirs=False: tất cả shard nằm trong store_dir (cùng một client)
+        separate_dirs=True: shard i nằm trong store_dir/shard<i> (client riêng)
+        """
+        collections = []
+        for i in range(num_shards):
+            if separate_dirs:
+                shard_client = chromadb.PersistentClient(path=str(store_dir / f"shard{i}"))
+            else:
+                shard_client = client or chromadb.PersistentClient(path=str(store_dir))
+                client = shard_client
+            collections.append(shard_client.get_or_create_collection(name=shard_name(base_name, i)))
+        return cls(collections)
+
+    def count(self) -> int:
+        return sum(self._pool.map(lambda c: c.count(), self.collections))
+
+    def close(self):
+        """Dừng thread pool scatter-gather."""
+        self._pool.shutdown(wait=True)
+
+    def add(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]]):
+        """Chia batch theo shard rồi ghi song song vào các shard."""
+        parts: Dict[int, Dict[str, list]] = {}
+        for item_id, emb, meta in zip(ids, embeddings, metadatas):
+            part = parts.setdefault(shard_for(meta.get("person_id", item_id), self.num_shards),
+                                    {"ids": [], "embeddings": [], "metadatas": []})
+            part["ids"].append(item_id)
+            part["embeddings"].append(emb)
+            part["metadatas"].append(meta)
+
+        futures = [self._pool.submit(self.collections[shard].add, **part)
+                   for shard, part in parts.items()]
+        for future in futures:
+            future.result()  # Ném lại lỗi của shard (nếu có)
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10,
+              include: Optional[List[str]] = None, **kwargs) -> Dict[str, Any]:
+        """
+        Scatter-gather: mỗi shard trả về top n_results, gộp lại lấy top n_results
+        toàn cục theo distance nhỏ nhất (heapq.nsmallest).
+        """
+        include = list(include or ["metadatas", "distances"])
+        if "distances" not in include:
+            include.append("distances")  # Cần distance để gộp
+
+        def query_shard(coll):
+            return coll.query(query_embeddings=query_embeddings, n_results=n_results,
+                              include=include, **kwargs)
+
+        shard_results = list(self._pool.map(query_shard, self.collections))
+        return merge_topk(shard_results, n_results, len(query_embeddings), include)
+
+
+def merge_topk(shard_results: List[Dict[str, Any]], k: int, num_queries: int,
+               include: List[str]) -> Dict[str, Any]:
+    """Gộp kết quả dạng ChromaDB của nhiều shard thành top-k cho từng query."""
+    fields = [f for f in include if f != "distances"]
+    merged: Dict[str, Any] = {"ids": [], "distances": []}
+    for f in fields:
+        merged[f] = []
+
+    for q in range(num_queries):
+        candidates = []
+        for res in shard_results:
+            ids = (res.get("ids") or [])
+            if q >= len(ids):
+                continue
+            for pos, item_id in enumerate(ids[q]):
+                distance = res["distances"][q][pos]
+                # Không dùng `res.get(f) or ...`: "embeddings" là mảng numpy (không có giá trị bool)
+                extras = tuple(None if res.get(f) is None else res[f][q][pos] for f in fields)
+                candidates.append((distance, item_id, extras))
+        top = heapq.nsmallest(k, candidates, key=lambda c: c[0])
+        merged["ids"].append([c[1] for c in top])
+        merged["distances"].append([c[0] for c in top])
+        for idx, f in enumerate(fields):
+            merged[f].append([c[2][idx] for c in top])
+    return merged
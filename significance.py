@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Khoảng tin cậy bootstrap và kiểm định so sánh cặp giữa hai lần chạy (vectorized NumPy)
+
+- Khoảng tin cậy (percentile bootstrap) cho Precision@5 và MAP@5, tổng và theo category
+- So sánh 2 file kết quả trên các query chung (ghép theo query_id):
+  chênh lệch trung bình, khoảng tin cậy bootstrap của chênh lệch, và p-value của
+  kiểm định hoán vị cặp (đổi dấu ngẫu nhiên chênh lệch từng query)
+
+Mỗi lần resample là một dòng của ma trận chỉ số (B x n) → hàng nghìn lần resample chỉ là
+vài phép toán trên mảng, chia khối để giới hạn bộ nhớ.
+
+Ví dụ:
+    python significance.py final_results.json                         # Khoảng tin cậy
+    python significance.py runs_a/final_results.json final_results.json   # So sánh A → B
+"""
+import argparse
+import json
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+N_RESAMPLES = 10000
+ALPHA = 0.05  # Khoảng tin cậy 95%
+MAX_CHUNK_ELEMENTS = 5_000_000  # Số phần tử tối đa của một khối ma trận resample
+METRICS = [("precision_at_5", "Precision@5"), ("ap_at_5", "MAP@5")]
+
+
+def load_results(path: Path) -> List[Dict[str, Any]]:
+    """Đọc final_results.json hoặc progress_final_data.json."""
+    with path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["results"] if isinstance(data, dict) else data
+
+
+def _chunks(n_resamples: int, n: int):
+    """Chia B lần resample thành các khối sao cho mỗi khối có <= MAX_CHUNK_ELEMENTS phần tử."""
+    rows = max(1, MAX_CHUNK_ELEMENTS // max(n, 1))
+    for start in range(0, n_resamples, rows):
+        yield min(rows, n_resamples - start)
+
+
+def bootstrap_means(values: np.ndarray, n_resamples: int = N_RESAMPLES,
+                    rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Trung bình của n_resamples mẫu bootstrap (lấy lại có hoàn lại)."""
+    rng = rng or np.random.default_rng()
+    n = len(values)
+    out = []
+    for rows in _chunks(n_resamples, n):
+        idx = rng.integers(0, n, size=(rows, n))
+        out.append(values[idx].mean(axis=1))
+    return np.concatenate(out)
+
+
+def bootstrap_ci(values, n_resamples: int = N_RESAMPLES, alpha: float = ALPHA,
+                 rng: Optional[np.random.Generator] = None) -> Dict[str, float]:
+    """Trung bình và khoảng tin cậy percentile bootstrap (1 - alpha)."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return {"n": 0, "mean": 0.0, "low": 0.0, "high": 0.0}
+    means = bootstrap_means(values, n_resamples, rng)
+    low, high = np.quantile(means, [alpha / 2, 1 - alpha / 2])
+    return {"n": int(len(values)), "mean": float(values.mean()), "low": float(low), "high": float(high)}
+
+
+def permutation_test(diffs, n_resamples: int = N_RESAMPLES,
+                     rng: Optional[np.random.Generator] = None) -> float:
+    """
+    p-value hai phía của kiểm định hoán vị cặp: dưới H0 (hai lần chạy như nhau),
+    dấu của chênh lệch mỗi query là ngẫu nhiên.
+    """
+    rng = rng or np.random.default_rng()
+    diffs = np.asarray(diffs, dtype=np.float64)
+    n = len(diffs)
+    if n == 0:
+        return 1.0
+    observed = abs(diffs.mean())
+    extreme = 0
+    for rows in _chunks(n_resamples, n):
+        signs = rng.integers(0, 2, size=(rows, n), dtype=np.int8) * 2 - 1
+        extreme += int(np.count_nonzero(np.abs((signs * diffs).mean(axis=1)) >= observed - 1e-12))
+    return (extreme + 1) / (n_resamples + 1)
+
+
+def confidence_report(results: List[Dict[str, Any]], n_resamples: int = N_RESAMPLES,
+                      alpha: float = ALPHA, seed: Optional[int] = None) -> Dict[str, Any]:
+    """Khoảng tin cậy tổng và theo category cho từng metric."""
+    rng = np.random.default_rng(seed)
+    report: Dict[str, Any] = {"overall": {}, "by_category": {}}
+    for key, _ in METRICS:
+        report["overall"][key] = bootstrap_ci([r.get(key, 0.0) for r in results], n_resamples, alpha, rng)
+    for category in sorted({r.get("category", "") for r in results}):
+        subset = [r for r in results if r.get("category", "") == category]
+        report["by_category"][category] = {
+            key: bootstrap_ci([r.get(key, 0.0) for r in subset], n_resamples, alpha, rng) for key, _ in METRICS}
+    return report
+
+
+def paired_arrays(a: List[Dict[str, Any]], b: List[Dict[str, Any]], key: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Ghép hai lần chạy theo query_id, trả về 2 mảng cùng thứ tự trên các query chung."""
+    b_by_id = {r["query_id"]: r for r in b}
+    common = [r for r in a if r["query_id"] in b_by_id]
+    return (np.array([r.get(key, 0.0) for r in common], dtype=np.float64),
+            np.array([b_by_id[r["query_id"]].get(key, 0.0) for r in common], dtype=np.float64))
+
+
+def compare_runs(a: List[Dict[str, Any]], b: List[Dict[str, Any]], n_resamples: int = N_RESAMPLES,
+                 alpha: float = ALPHA, seed: Optional[int] = None) -> Dict[str, Any]:
+    """So sánh cặp B - A cho từng metric: chênh lệch, khoảng tin cậy, p-value hoán vị."""
+    rng = np.random.default_rng(seed)
+    report = {}
+    for key, _ in METRICS:
+        va, vb = paired_arrays(a, b, key)
+        diffs = vb - va
+        ci = bootstrap_ci(diffs, n_resamples, alpha, rng)
+        report[key] = {
+            "n": int(len(diffs)),
+            "mean_a": float(va.mean()) if len(va) else 0.0,
+            "mean_b": float(vb.mean()) if len(vb) else 0.0,
+            "diff": ci["mean"],
+            "diff_low": ci["low"],
+            "diff_high": ci["high"],
+            "p_value": permutation_test(diffs, n_resamples, rng),
+            "improved": int(np.count_nonzero(diffs > 0)),
+            "worse": int(np.count_nonzero(diffs < 0)),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Khoảng tin cậy bootstrap / so sánh cặp hai lần chạy")
+    parser.add_argument("files", nargs="+", type=Path, help="1 file: khoảng tin cậy; 2 file: so sánh A → B")
+    parser.add_argument("--resamples", type=int, default=N_RESAMPLES)
+    parser.add_argument("--alpha", type=float, default=ALPHA)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", type=Path, default=None, help="Lưu báo cáo JSON")
+    args = parser.parse_args()
+    level = f"{(1 - args.alpha) * 100:.0f}%"
+
+    if len(args.files) == 1:
+        report = confidence_report(load_results(args.files[0]), args.resamples, args.alpha, args.seed)
+        print(f"Khoảng tin cậy {level} ({args.resamples} lần bootstrap)")
+        for key, label in METRICS:
+            ci = report["overall"][key]
+            print(f"  {label}: {ci['mean']:.4f} [{ci['low']:.4f}, {ci['high']:.4f}] (n={ci['n']})")
+        print("\nTHEO CATEGORY")
+        for category, cis in report["by_category"].items():
+            parts = " | ".join(f"{label} {cis[key]['mean']:.4f} [{cis[key]['low']:.4f}, {cis[key]['high']:.4f}]"
+                               for key, label in METRICS)
+            note = " (n quá nhỏ, không kết luận được)" if cis["precision_at_5"]["n"] < 5 else ""
+            print(f"  {category} (n={cis['precision_at_5']['n']}): {parts}{note}")
+    elif len(args.files) == 2:
+        report = compare_runs(load_results(args.files[0]), load_results(args.files[1]),
+                              args.resamples, args.alpha, args.seed)
+        print(f"So sánh {args.files[0]} (A) → {args.files[1]} (B), {args.resamples} lần resample")
+        for key, label in METRICS:
+            r = report[key]
+            verdict = "có ý nghĩa" if r["p_value"] < args.alpha else "không có ý nghĩa"
+            print(f"  {label}: {r['mean_a']:.4f} → {r['mean_b']:.4f} | chênh lệch {r['diff']:+.4f} "
+                  f"[{r['diff_low']:+.4f}, {r['diff_high']:+.4f}] | p = {r['p_value']:.4f} ({verdict}) | "
+                  f"tốt hơn {r['improved']}, kém hơn {r['worse']} / {r['n']} queries chung")
+    else:
+        parser.error("Chỉ nhận 1 hoặc 2 file kết quả")
+
+    if args.output:
+        with args.output.open("w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nĐã lưu báo cáo vào: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
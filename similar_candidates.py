@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Đồ thị kNN "hồ sơ tương tự" tính trước cho toàn bộ hồ sơ trong qa_collection
+
+Thay vì biến một hồ sơ thành query và gọi search_top5 mỗi lần, job offline này tính sẵn
+top-K hàng xóm gần nhất của mọi hồ sơ:
+- Đọc embeddings đã lưu trong collection (theo trang, không encode lại)
+- Nhân ma trận theo khối (block hàng x block cột), giữ top-K đang chạy cho mỗi hàng →
+  bộ nhớ giới hạn bởi ROW_BLOCK x COL_BLOCK dù corpus lớn đến đâu; các block hàng chạy
+  song song trên mọi CPU (NumPy nhả GIL khi nhân ma trận)
+- Distance là L2 bình phương, giống distance mà ChromaDB trả về
+
+Bảng hàng xóm lưu dạng mảng gọn trong knn_graph/:
+    ids.npy         person_id của từng dòng
+    neighbors.npy   (N, K) int32 — chỉ số dòng của K hàng xóm (-1 nếu không đủ)
+    distances.npy   (N, K) float16
+    meta.json       K, collection nguồn và phiên bản của nó, thời điểm build
+→ tra cứu "hồ sơ tương tự" là một lần đọc mảng (memory-map), O(1).
+
+Cập nhật tăng dần (`update`): hồ sơ mới thêm bởi populate_chromadb.py được tính top-K với
+toàn bộ corpus, và top-K của hồ sơ cũ được trộn với các hồ sơ mới. Build lại toàn bộ nếu có
+hồ sơ bị xóa khỏi collection, hoặc alias đã trỏ sang phiên bản collection khác (build lại
+blue/green: embeddings có thể đã đổi dù tập person_id giữ nguyên).
+
+Ví dụ:
+    python similar_candidates.py build --k 20
+    python similar_candidates.py update
+    python similar_candidates.py show 1318
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from collection_alias import resolve, collection_version
+
+BASE_DIR = Path(__file__).resolve().parent
+STORE_DIR = BASE_DIR / "chromadb_store"
+GRAPH_DIR = BASE_DIR / "knn_graph"
+COLLECTION_NAME = "qa_collection"
+NUM_SHARDS = 1  # Giống populate_chromadb.py / final_data.py
+DEFAULT_K = 20
+ROW_BLOCK = 1024   # Số hồ sơ (hàng) mỗi block
+COL_BLOCK = 65536  # Số hồ sơ (cột) mỗi lần nhân → mỗi block tốn ROW_BLOCK x COL_BLOCK x 4 byte
+
+
+def fetch_embeddings(alias: str = COLLECTION_NAME, num_shards: int = NUM_SHARDS) -> Tuple[List[str], np.ndarray]:
+    """Đọc toàn bộ (ids, embeddings) của phiên bản đang phục vụ, theo trang."""
+    import chromadb
+    from populate_chromadb import open_collection
+    from maintenance import iter_pages
+
+    client = chromadb.PersistentClient(path=str(STORE_DIR))
+    collection = open_collection(client, resolve(STORE_DIR, alias), num_shards)
+    ids, chunks = [], []
+    for page in iter_pages(collection):
+        ids.extend(page["ids"])
+        chunks.append(np.asarray(page["embeddings"], dtype=np.float32))
+    embeddings = np.vstack(chunks) if chunks else np.zeros((0, 0), dtype=np.float32)
+    return ids, embeddings
+
+
+def merge_topk(idx_a: np.ndarray, dist_a: np.ndarray, idx_b: np.ndarray, dist_b: np.ndarray,
+               k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Trộn hai danh sách top-K theo từng hàng, giữ K distance nhỏ nhất (tăng dần)."""
+    idx = np.concatenate([idx_a, idx_b], axis=1)
+    dist = np.concatenate([dist_a, dist_b], axis=1).astype(np.float32)
+    order = np.argsort(dist, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(dist, order, axis=1)
+
+
+def _empty_topk(rows: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    return np.full((rows, k), -1, dtype=np.int32), np.full((rows, k), np.inf, dtype=np.float32)
+
+
+def _block_topk(queries: np.ndarray, corpus: np.ndarray, corpus_sq: np.ndarray, k: int,
+                self_offset: Optional[int]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-K của một block hàng trên toàn corpus, duyệt corpus theo block cột.
+    self_offset: hàng i của queries là dòng self_offset + i của corpus (bỏ chính nó ra).
+    """
+    rows = len(queries)
+    q_sq = np.einsum("ij,ij->i", queries, queries)
+    best_idx, best_dist = _empty_topk(rows, k)
+    for col in range(0, len(corpus), COL_BLOCK):
+        block = corpus[col:col + COL_BLOCK]
+        dist = q_sq[:, None] + corpus_sq[None, col:col + COL_BLOCK] - 2.0 * (queries @ block.T)
+        np.maximum(dist, 0.0, out=dist)
+        if self_offset is not None:
+            own = np.arange(rows) + self_offset - col
+            mask = (own >= 0) & (own < len(block))
+            dist[np.nonzero(mask)[0], own[mask]] = np.inf
+        kk = min(k, dist.shape[1])
+        part = np.argpartition(dist, kk - 1, axis=1)[:, :kk]
+        part_dist = np.take_along_axis(dist, part, axis=1)
+        best_idx, best_dist = merge_topk(best_idx, best_dist, (part + col).astype(np.int32), part_dist, k)
+    best_idx[~np.isfinite(best_dist)] = -1
+    return best_idx, best_dist
+
+
+def knn_blocked(queries: np.ndarray, corpus: np.ndarray, k: int, self_offset: Optional[int] = None,
+                workers: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-K hàng xóm trong corpus cho mọi hàng của queries, các block hàng chạy song song."""
+    if len(queries) == 0 or len(corpus) == 0:
+        return _empty_topk(len(queries), k)
+    corpus_sq = np.einsum("ij,ij->i", corpus, corpus)
+    starts = list(range(0, len(queries), ROW_BLOCK))
+
+    def run(start):
+        offset = None if self_offset is None else self_offset + start
+        return _block_topk(queries[start:start + ROW_BLOCK], corpus, corpus_sq, k, offset)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        parts = list(pool.map(run, starts))
+    return np.vstack([p[0] for p in parts]), np.vstack([p[1] for p in parts])
+
+
+class NeighborTable:
+    """Bảng hàng xóm đã tính sẵn (memory-map), tra cứu theo person_id."""
+
+    def __init__(self, graph_dir: Path = GRAPH_DIR):
+        self.graph_dir = graph_dir
+        with (graph_dir / "meta.json").open("r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.ids = np.load(graph_dir / "ids.npy")
+        self.neighbors = np.load(graph_dir / "neighbors.npy", mmap_mode="r")
+        self.distances = np.load(graph_dir / "distances.npy", mmap_mode="r")
+        self._row = {pid: i for i, pid in enumerate(self.ids.tolist())}
+
+    def similar(self, person_id: str, k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """K hồ sơ gần nhất với person_id (rỗng nếu person_id chưa có trong bảng)."""
+        row = self._row.get(str(person_id))
+        if row is None:
+            return []
+        k = k or self.meta["k"]
+        return [{"person_id": str(self.ids[j]), "distance": float(d)}
+                for j, d in zip(self.neighbors[row, :k], self.distances[row, :k]) if j >= 0]
+
+
+def save_table(graph_dir: Path, ids: List[str], neighbors: np.ndarray, distances: np.ndarray,
+               k: int, alias: str):
+    """Ghi bảng vào thư mục tạm rồi đổi tên → người đọc không bao giờ thấy bảng dở dang."""
+    tmp_dir = graph_dir.with_name(graph_dir.name + ".tmp")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    np.save(tmp_dir / "ids.npy", np.array(ids))
+    np.save(tmp_dir / "neighbors.npy", neighbors.astype(np.int32))
+    np.save(tmp_dir / "distances.npy", np.where(np.isfinite(distances), distances, np.inf).astype(np.float16))
+    with (tmp_dir / "meta.json").open("w", encoding="utf-8") as f:
+        json.dump({"k": k, "count": len(ids), "alias": alias, "collection": resolve(STORE_DIR, alias),
+                   "collection_version": collection_version(STORE_DIR, alias),
+                   "built_at": datetime.now().isoformat(timespec="seconds")}, f, ensure_ascii=False, indent=2)
+    if graph_dir.exists():
+        old_dir = graph_dir.with_name(graph_dir.name + ".old")
+        os.replace(graph_dir, old_dir)
+        os.replace(tmp_dir, graph_dir)
+        for p in old_dir.iterdir():
+            p.unlink()
+        old_dir.rmdir()
+    else:
+        os.replace(tmp_dir, graph_dir)
+
+
+def build(k: int = DEFAULT_K, alias: str = COLLECTION_NAME, graph_dir: Path = GRAPH_DIR) -> Dict[str, Any]:
+    start = time.perf_counter()
+    ids, embeddings = fetch_embeddings(alias)
+    fetched = time.perf_counter()
+    neighbors, distances = knn_blocked(embeddings, embeddings, k, self_offset=0)
+    computed = time.perf_counter()
+    save_table(graph_dir, ids, neighbors, distances, k, alias)
+    return {"mode": "build", "rows": len(ids), "k": k, "fetch_s": fetched - start,
+            "knn_s": computed - fetched, "total_s": time.perf_counter() - start}
+
+
+def update(alias: str = COLLECTION_NAME, graph_dir: Path = GRAPH_DIR) -> Dict[str, Any]:
+    """
+    Thêm các hồ sơ mới vào bảng; build lại toàn bộ nếu collection nguồn đã đổi phiên bản
+    hoặc có hồ sơ bị xóa.
+    """
+    if not (graph_dir / "meta.json").exists():
+        return build(alias=alias, graph_dir=graph_dir)
+    table = NeighborTable(graph_dir)
+    k = table.meta["k"]
+    # Bảng cũ chưa có "collection": lấy tên từ collection_version ("<tên>@<generation>")
+    source = table.meta.get("collection") or table.meta.get("collection_version", "").rsplit("@", 1)[0]
+    current = resolve(STORE_DIR, alias)
+    if table.meta.get("alias", alias) != alias or source != current:
+        print(f"Bảng được build từ {source}, alias {alias} đang trỏ tới {current} → build lại toàn bộ")
+        del table
+        return build(k, alias, graph_dir)
+    start = time.perf_counter()
+    ids, embeddings = fetch_embeddings(alias)
+    position = {pid: i for i, pid in enumerate(ids)}
+    old_ids = table.ids.tolist()
+    if any(pid not in position for pid in old_ids):
+        print("Có hồ sơ đã bị xóa khỏi collection → build lại toàn bộ")
+        return build(k, alias, graph_dir)
+
+    # Sắp lại: hồ sơ cũ giữ đúng thứ tự dòng trong bảng, hồ sơ mới nối vào sau
+    old_set = set(old_ids)
+    new_ids = [pid for pid in ids if pid not in old_set]
+    if not new_ids:
+        return {"mode": "update", "rows": len(old_ids), "added": 0, "k": k, "total_s": time.perf_counter() - start}
+    all_ids = old_ids + new_ids
+    all_emb = embeddings[[position[pid] for pid in all_ids]]
+    n_old = len(old_ids)
+
+    # 1. Hàng xóm của hồ sơ mới trên toàn corpus
+    new_nb, new_dist = knn_blocked(all_emb[n_old:], all_emb, k, self_offset=n_old)
+    # 2. Hồ sơ mới có thể lọt vào top-K của hồ sơ cũ → trộn
+    cand_nb, cand_dist = knn_blocked(all_emb[:n_old], all_emb[n_old:], k)
+    cand_nb = np.where(cand_nb >= 0, cand_nb + n_old, -1).astype(np.int32)
+    old_nb, old_dist = merge_topk(np.asarray(table.neighbors), np.asarray(table.distances, dtype=np.float32),
+                                  cand_nb, cand_dist, k)
+    neighbors = np.vstack([old_nb, new_nb])
+    distances = np.vstack([old_dist, new_dist])
+    del table  # Đóng memory-map trước khi thay thư mục
+    save_table(graph_dir, all_ids, neighbors, distances, k, alias)
+    return {"mode": "update", "rows": len(all_ids), "added": len(new_ids), "k": k,
+            "total_s": time.perf_counter() - start}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đồ thị kNN hồ sơ tương tự")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="Tính lại toàn bộ")
+    b.add_argument("--k", type=int, default=DEFAULT_K)
+    sub.add_parser("update", help="Chỉ thêm hồ sơ mới")
+    s = sub.add_parser("show", help="Xem hồ sơ tương tự")
+    s.add_argument("person_id")
+    s.add_argument("--k", type=int, default=5)
+    parser.add_argument("--alias", default=COLLECTION_NAME)
+    args = parser.parse_args()
+
+    if args.command == "show":
+        table = NeighborTable(GRAPH_DIR)
+        print(f"Bảng build lúc {table.meta['built_at']} ({table.meta['collection_version']})")
+        for i, r in enumerate(table.similar(args.person_id, args.k), 1):
+            print(f"  {i}. person_id={r['person_id']} | distance {r['distance']:.4f}")
+        return
+
+    report = build(args.k, args.alias) if args.command == "build" else update(args.alias)
+    details = " | ".join(f"{key} {value:.2f}" if isinstance(value, float) else f"{key} {value}"
+                         for key, value in report.items())
+    print(f"OK {details}")
+    print(f"Đã lưu bảng hàng xóm vào: {GRAPH_DIR}")
+
+
+if __name__ == "__main__":
+    main()